@@ -0,0 +1,29 @@
+--
+-- Migración 001: dimensión de estación en `lectura`
+--
+-- Las lecturas llegan ahora por iot/<estacion>/data. Las filas anteriores
+-- venían todas de iot/esp32/data, así que se asignan a la estación `esp32`.
+--
+-- MySQL confirma cada ALTER TABLE por su cuenta (no hay DDL en una
+-- transacción), así que cada paso comprueba antes en information_schema
+-- si ya está hecho: si la migración se corta, se vuelve a lanzar entera.
+--
+
+SET @falta := (SELECT COUNT(*) = 0 FROM information_schema.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'lectura'
+                 AND COLUMN_NAME = 'estacion');
+SET @paso := IF(@falta,
+  'ALTER TABLE `lectura` ADD COLUMN `estacion` varchar(64) DEFAULT NULL AFTER `id`',
+  'DO 0');
+PREPARE paso FROM @paso; EXECUTE paso; DEALLOCATE PREPARE paso;
+
+UPDATE `lectura` SET `estacion` = 'esp32' WHERE `estacion` IS NULL;
+
+-- Índice compuesto para "últimas N lecturas de una estación"
+SET @falta := (SELECT COUNT(*) = 0 FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'lectura'
+                 AND INDEX_NAME = 'ix_lectura_estacion_fecha');
+SET @paso := IF(@falta,
+  'ALTER TABLE `lectura` ADD KEY `ix_lectura_estacion_fecha` (`estacion`, `fecha`)',
+  'DO 0');
+PREPARE paso FROM @paso; EXECUTE paso; DEALLOCATE PREPARE paso;
@@ -0,0 +1,41 @@
+--
+-- Migración 002: índices de series temporales y particiones mensuales
+--
+-- Todas las consultas calientes hacen ORDER BY fecha DESC LIMIT n, con o
+-- sin filtro de estación. Se añade un índice sobre `fecha` (el compuesto
+-- (estacion, fecha) viene de la migración 001) y se particiona la tabla
+-- por mes con RANGE (TO_DAYS(fecha)).
+--
+-- En MySQL/MariaDB la columna de partición debe formar parte de toda clave
+-- única, así que la clave primaria pasa a ser (id, fecha) y `fecha` deja de
+-- admitir NULL. La primera partición recoge todo lo anterior a nov-2025.
+--
+-- Las particiones futuras y el borrado de meses viejos los hace el servidor
+-- (ver `particiones.py` y `flask particiones`): DROP PARTITION en lugar de
+-- DELETE sobre millones de filas.
+--
+-- Los meses de abajo acaban en p202603: lo posterior cae en `pmax` hasta
+-- que el servidor (o `flask particiones`) crea los meses que faltan,
+-- partiendo `pmax` mes a mes desde p202604. Conviene lanzar
+-- `flask particiones` justo después de esta migración, antes de que
+-- `pmax` acumule filas que haya que mover.
+--
+
+UPDATE `lectura` SET `fecha` = NOW() WHERE `fecha` IS NULL;
+
+ALTER TABLE `lectura`
+  MODIFY `fecha` datetime NOT NULL,
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (`id`, `fecha`),
+  ADD KEY `ix_lectura_fecha` (`fecha`);
+
+ALTER TABLE `lectura`
+  PARTITION BY RANGE (TO_DAYS(`fecha`)) (
+    PARTITION p202510 VALUES LESS THAN (TO_DAYS('2025-11-01')),
+    PARTITION p202511 VALUES LESS THAN (TO_DAYS('2025-12-01')),
+    PARTITION p202512 VALUES LESS THAN (TO_DAYS('2026-01-01')),
+    PARTITION p202601 VALUES LESS THAN (TO_DAYS('2026-02-01')),
+    PARTITION p202602 VALUES LESS THAN (TO_DAYS('2026-03-01')),
+    PARTITION p202603 VALUES LESS THAN (TO_DAYS('2026-04-01')),
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+  );
@@ -0,0 +1,52 @@
+--
+-- Migración 003: agregados por minuto, hora y día (`lectura_rollup`)
+--
+-- Una fila por (resolución en segundos, estación, inicio del intervalo) con
+-- el número de lecturas y min/max/suma de cada variable. El servidor la
+-- mantiene en cada lote de ingesta; aquí se crea y se rellena con las
+-- lecturas existentes. /history?from=&to= la usa para rangos largos, y
+-- sobrevive a la purga de particiones de `lectura`.
+--
+-- Se puede volver a lanzar: la tabla solo se crea si no existe y solo se
+-- rellena si está vacía (el INSERT ... SELECT es una sola sentencia, así
+-- que o entra todo o nada). No va en una transacción porque el CREATE
+-- TABLE la confirmaría igualmente.
+--
+
+CREATE TABLE IF NOT EXISTS `lectura_rollup` (
+  `resolucion` int(11) NOT NULL,
+  `estacion` varchar(64) NOT NULL,
+  `inicio` datetime NOT NULL,
+  `n` int(11) NOT NULL,
+  `temp_min` float NOT NULL,
+  `temp_max` float NOT NULL,
+  `temp_suma` double NOT NULL,
+  `hum_min` float NOT NULL,
+  `hum_max` float NOT NULL,
+  `hum_suma` double NOT NULL,
+  `co2_min` float NOT NULL,
+  `co2_max` float NOT NULL,
+  `co2_suma` double NOT NULL,
+  PRIMARY KEY (`resolucion`, `estacion`, `inicio`),
+  KEY `ix_rollup_resolucion_inicio` (`resolucion`, `inicio`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+SET @vacia := NOT EXISTS (SELECT 1 FROM `lectura_rollup`);
+
+INSERT INTO `lectura_rollup`
+SELECT r.resolucion, l.estacion,
+       CASE r.resolucion
+         WHEN 60   THEN DATE_FORMAT(l.fecha, '%Y-%m-%d %H:%i:00')
+         WHEN 3600 THEN DATE_FORMAT(l.fecha, '%Y-%m-%d %H:00:00')
+         ELSE DATE(l.fecha)
+       END AS inicio,
+       COUNT(*),
+       MIN(l.temperatura), MAX(l.temperatura), SUM(l.temperatura),
+       MIN(l.humedad), MAX(l.humedad), SUM(l.humedad),
+       MIN(l.co2), MAX(l.co2), SUM(l.co2)
+FROM `lectura` l
+JOIN (SELECT 60 AS resolucion UNION ALL SELECT 3600 UNION ALL SELECT 86400) r
+WHERE @vacia
+  AND l.estacion IS NOT NULL
+  AND l.temperatura IS NOT NULL AND l.humedad IS NOT NULL AND l.co2 IS NOT NULL
+GROUP BY r.resolucion, l.estacion, inicio;
@@ -0,0 +1,55 @@
+--
+-- Migración 004: marca de anomalías por lectura
+--
+-- `anomalia` es una máscara de bits (1 = temperatura, 2 = humedad,
+-- 4 = co2) que pone el detector de la ingesta (Servidor Flask/anomalias.py).
+-- Las filas anteriores solo se pueden marcar por rango físico; el caso
+-- conocido es el co2 = 0 del volcado inicial.
+--
+-- Cada paso se puede repetir (MySQL confirma el ALTER TABLE por su
+-- cuenta, así que una transacción no haría atómica la migración): la
+-- columna se añade si falta, el UPDATE solo toca filas sin marca (no
+-- borra lo que haya marcado ya el detector) y los agregados de los días
+-- con anomalías se borran y se recalculan desde `lectura`.
+--
+
+SET @falta := (SELECT COUNT(*) = 0 FROM information_schema.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'lectura'
+                 AND COLUMN_NAME = 'anomalia');
+SET @paso := IF(@falta,
+  'ALTER TABLE `lectura` ADD COLUMN `anomalia` smallint(6) NOT NULL DEFAULT 0 AFTER `co2`',
+  'DO 0');
+PREPARE paso FROM @paso; EXECUTE paso; DEALLOCATE PREPARE paso;
+
+UPDATE `lectura`
+SET `anomalia` =
+      (CASE WHEN `temperatura` NOT BETWEEN -40 AND 85 THEN 1 ELSE 0 END)
+    | (CASE WHEN `humedad` NOT BETWEEN 0 AND 100 THEN 2 ELSE 0 END)
+    | (CASE WHEN `co2` NOT BETWEEN 1 AND 10000 THEN 4 ELSE 0 END)
+WHERE `anomalia` = 0;
+
+-- Los agregados no cuentan las lecturas marcadas
+DELETE r FROM `lectura_rollup` r
+JOIN (
+  SELECT DISTINCT `estacion`, DATE(`fecha`) AS dia FROM `lectura` WHERE `anomalia` <> 0
+) m ON r.`estacion` = m.`estacion` AND DATE(r.`inicio`) = m.dia;
+
+INSERT INTO `lectura_rollup`
+SELECT r.resolucion, l.estacion,
+       CASE r.resolucion
+         WHEN 60   THEN DATE_FORMAT(l.fecha, '%Y-%m-%d %H:%i:00')
+         WHEN 3600 THEN DATE_FORMAT(l.fecha, '%Y-%m-%d %H:00:00')
+         ELSE DATE(l.fecha)
+       END AS inicio,
+       COUNT(*),
+       MIN(l.temperatura), MAX(l.temperatura), SUM(l.temperatura),
+       MIN(l.humedad), MAX(l.humedad), SUM(l.humedad),
+       MIN(l.co2), MAX(l.co2), SUM(l.co2)
+FROM `lectura` l
+JOIN (SELECT 60 AS resolucion UNION ALL SELECT 3600 UNION ALL SELECT 86400) r
+JOIN (
+  SELECT DISTINCT `estacion`, DATE(`fecha`) AS dia FROM `lectura` WHERE `anomalia` <> 0
+) m ON l.`estacion` = m.`estacion` AND DATE(l.`fecha`) = m.dia
+WHERE l.anomalia = 0
+  AND l.temperatura IS NOT NULL AND l.humedad IS NOT NULL AND l.co2 IS NOT NULL
+GROUP BY r.resolucion, l.estacion, inicio;
@@ -0,0 +1,18 @@
+--
+-- Migración 005: número de secuencia de la estación
+--
+-- Las estaciones con firmware nuevo numeran sus muestras (payload binario
+-- v3, ver Servidor Flask/mensajes.py): `seq` = arranque << 32 | contador,
+-- creciente incluso entre reinicios. Un reenvío trae la misma (estacion,
+-- seq, fecha) y el INSERT de la ingesta la ignora gracias a esta clave
+-- única. `fecha` tiene que estar en ella porque la tabla está
+-- particionada por fecha (migración 002); como la fija la estación al
+-- medir, un reenvío la repite igual.
+--
+-- Las filas anteriores y las de estaciones sin secuencia quedan con
+-- seq = NULL, que no choca con nada.
+--
+
+ALTER TABLE `lectura`
+  ADD COLUMN `seq` bigint(20) DEFAULT NULL AFTER `estacion`,
+  ADD UNIQUE KEY `ux_lectura_estacion_seq` (`estacion`, `seq`, `fecha`);
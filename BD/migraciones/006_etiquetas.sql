@@ -0,0 +1,15 @@
+--
+-- Migración 006: etiquetas de estación
+--
+-- Grupos de estaciones (planta, edificio, lote de firmware...) para
+-- mandar control a varias a la vez: POST /control/bulk con
+-- {"selector": {"tag": "<etiqueta>"}}. Se gestionan con
+-- PUT /stations/<estacion>/tags.
+--
+
+CREATE TABLE IF NOT EXISTS `estacion_etiqueta` (
+  `estacion` varchar(64) NOT NULL,
+  `etiqueta` varchar(64) NOT NULL,
+  PRIMARY KEY (`estacion`, `etiqueta`),
+  KEY `ix_estacion_etiqueta_etiqueta` (`etiqueta`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
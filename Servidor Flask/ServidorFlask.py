@@ -1,163 +1,685 @@
-from flask import Flask, render_template_string, jsonify, request
-from flask_sqlalchemy import SQLAlchemy
+import click
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 import paho.mqtt.client as mqtt
+import atexit
 import json
+import logging
 from datetime import datetime
+import threading
+from functools import partial
+import os
+import socket
 import time
-
-from pmdarima import auto_arima
+import zlib
+
+from anomalias import BITS, DetectorAnomalias, variables_marcadas
+from cache import CacheUltimaLectura
+from configuracion import (
+    ANOMALIAS_UMBRAL, ANOMALIAS_VENTANA, ARCHIVO_CADA, ARCHIVO_DIR, ARCHIVO_MAX_DIAS,
+    ARCHIVO_RETRASO_DIAS, DUPLICADOS_VENTANA, EXPORT_LOTE, INGESTA_ESPERA_MAX,
+    INGESTA_ESPERA_REINTENTO, INGESTA_INTENTOS, INGESTA_INTERVALO, INGESTA_MAX_COLA,
+    INGESTA_TAM_LOTE, MANTENIMIENTO_CADA, PARTICIONES_ADELANTE, RETENCION_MESES,
+)
+from control import PublicadorControl
+from difusion import CERRADA, HubEventos
+from historial import HistorialReciente, parsear_desde
+from ingesta import ColaIngesta, VentanaDuplicados
+from mensajes import BROKER, PUERTO, TOPICS, completa, leer_lecturas, tipo_de_topic
+from muestreo import ControladorMuestreo
+from metricas import FILAS, SEGUNDOS_LARGOS, TIPO_CONTENIDO, RegistroMetricas
+import modelos
+from modelos import EstacionEtiqueta, Lectura, Rollup, db, guardar_etiquetas, guardar_filas
+import numpy as np
+from pronostico import METODOS, PlanificadorPronosticos, PronosticosRecibidos, pronosticar
+import archivo
+import bitacora
+import particiones
+import respuestas
+import rollups
 
 # -------------------------------------------------
 # Configuración Flask + MySQL
 # -------------------------------------------------
+# URI, réplica de lectura y pools por variables de entorno (ver modelos.py)
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+pymysql://root:@localhost/estacion_iot'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+modelos.configurar(app)
+
+# Ingesta "embebida": este proceso guarda en la BD lo que llega por MQTT
+# (un solo proceso, p. ej. `python ServidorFlask.py`).
+# Ingesta "externa": la BD la llena servicio_ingesta.py y este proceso es
+# solo de lectura, así que se pueden arrancar tantos workers como haga
+# falta (`IOT_INGESTA=externa gunicorn -w 4 ServidorFlask:app`, sin
+# --preload: cada worker arranca sus hilos). Cada worker sigue suscrito a
+# MQTT, sin suscripción compartida, para mantener al día su cache, su
+# historial y sus clientes /stream. Las escrituras que quedan (etiquetas)
+# van por el motor de escritura, como la ingesta.
+INGESTA_MODO = os.environ.get("IOT_INGESTA", "embebida")
+INGESTA_EMBEBIDA = INGESTA_MODO != "externa"
+
+# Pronósticos y muestreo adaptativo: un solo proceso los calcula. Con
+# ingesta externa lo hace el que arranca con IOT_TAREAS_FONDO=1 (un
+# worker, o una instancia aparte con un worker); si no, cada worker
+# repetiría el pool de pronósticos y mandaría sus propios intervalos.
+# Los demás reciben los pronósticos por MQTT (iot/<estacion>/forecast,
+# retenido) y le pasan los cambios de modo del muestreo
+# (iot/servidor/sampling).
+TAREAS_FONDO = os.environ.get("IOT_TAREAS_FONDO", "1" if INGESTA_EMBEBIDA else "0") == "1"
+
+# Logs con nivel y límite de frecuencia (IOT_LOG_NIVEL=off los apaga, ver
+# bitacora.py). A nivel de módulo para que también los tengan los procesos
+# del pool de pronósticos.
+bitacora.configurar()
+log = logging.getLogger("iot.servidor")
+log_mqtt = logging.getLogger("iot.mqtt")
+
+# Métricas para GET /metrics (formato Prometheus, ver metricas.py)
+metricas = RegistroMetricas("iot")
+m_mensajes = metricas.contador("mqtt_messages_total", "Mensajes MQTT recibidos por tipo de topic", ("kind",))
+m_lecturas = metricas.contador("mqtt_readings_total", "Lecturas decodificadas de los mensajes MQTT", ("result",))
+m_invalidos = metricas.contador("mqtt_invalid_messages_total", "Mensajes MQTT descartados", ("reason",))
+m_commit = metricas.histograma("db_commit_seconds", "Duración de la escritura de un lote en la BD")
+m_lote = metricas.histograma("db_batch_rows", "Filas por lote escrito en la BD", limites=FILAS)
+m_rutas = metricas.histograma("http_request_seconds", "Duración de las peticiones HTTP por ruta", ("route", "method"))
+m_respuestas = metricas.contador("http_responses_total", "Respuestas HTTP por ruta y código", ("route", "status"))
+m_ajustes = metricas.histograma("forecast_fit_seconds", "Duración de cada ajuste de pronóstico por variable",
+                                ("variable",), limites=SEGUNDOS_LARGOS)
+
+
+# Última lectura por estación, servida por /data y / sin ir a la BD
+ultima_lectura = CacheUltimaLectura()
+SIN_LECTURA = {"temperature": "-", "humidity": "-", "co2": "-"}
+
+# Ventana reciente por estación para /history (360 lecturas = 1 h a 10 s)
+HISTORIAL_CAPACIDAD = 360
+HISTORIAL_PUNTOS = 30
+historial = HistorialReciente(HISTORIAL_CAPACIDAD)
+
+# Detección de anomalías en la ingesta (anomalias.py)
+# (ventana y umbral en configuracion.py, los mismos que servicio_ingesta.py)
+ANOMALIAS_CUARENTENA = False     # True: las lecturas marcadas no llegan a /data, /history ni /stream
+detector = DetectorAnomalias(ventana=ANOMALIAS_VENTANA, umbral=ANOMALIAS_UMBRAL)
+
+# Reenvíos de las estaciones (seq del payload v3) descartados antes de la BD
+ventana_duplicados = VentanaDuplicados(DUPLICADOS_VENTANA)
+
+# Muestreo adaptativo (muestreo.py): cada estación mide más despacio con
+# la señal plana y bien pronosticada, y vuelve al mínimo cuando cambia
+MUESTREO_ADAPTATIVO = True
+MUESTREO_MIN = 10                # s (el intervalo por defecto del firmware)
+MUESTREO_MAX = 300               # s con la señal plana
+INTERVALO_MAX = 3600             # s, el mayor que acepta el firmware (INTERVALO_MAX_MS)
+
+def intervalo_valido(segundos):
+    """Intervalo pedido por un operador dentro de [MUESTREO_MIN, INTERVALO_MAX]."""
+    return MUESTREO_MIN <= segundos <= INTERVALO_MAX
+
+def enviar_intervalo(estacion, segundos):
+    """Control retenido en iot/<estacion>/control: la estación lo recibe también al reconectar."""
+    client.publish(topic_control_estacion.format(estacion), json.dumps({"interval_s": segundos}),
+                   qos=1, retain=True)
+    log_mqtt.info("Intervalo de muestreo", extra={"estacion": estacion, "segundos": segundos})
+
+controlador_muestreo = ControladorMuestreo(enviar_intervalo, minimo=MUESTREO_MIN, maximo=MUESTREO_MAX)
+
+def cambiar_modo_muestreo(estacion, segundos, automatico):
+    """
+    Modo manual (intervalo fijo) o automático de la estación (None: todas)
+    en el controlador, que puede estar en otro proceso (ver TAREAS_FONDO).
+    """
+    if not TAREAS_FONDO:
+        client.publish(topic_modo_muestreo, json.dumps(
+            {"station": estacion, "interval_s": segundos, "auto": automatico}), qos=1)
+    elif automatico:
+        controlador_muestreo.automatico(estacion, segundos)
+    else:
+        controlador_muestreo.fijar(estacion, segundos)
 
-class Lectura(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    temperatura = db.Column(db.Float)
-    humedad = db.Column(db.Float)
-    co2 = db.Column(db.Float)
-    fecha = db.Column(db.DateTime, default=datetime.now)
+# Conexiones /stream abiertas: lecturas y pronósticos se empujan al llegar
+STREAM_LATIDO = 15      # s entre comentarios keep-alive
+hub = HubEventos()
+
+# -------------------------------------------------
+# Ingesta por lotes (cola + hilo escritor)
+# -------------------------------------------------
+# Tamaño de cola y lote y reintentos en configuracion.py
+INGESTA_ESPERA_ENCOLAR = 0.05 # backpressure antes de descartar con la cola llena
 
-with app.app_context():
-    db.create_all()
+# Lotes guardados por estación (None = todas): versión de lo que hay en
+# la BD para el ETag de /history?from=. Solo lo escribe el hilo escritor.
+lotes_guardados = {}
 
-# Para mostrar algo mientras tanto
-latest_data = {"temperature": "-", "humidity": "-", "co2": "-"}
-last_update_time = 0
+def guardar_lote(filas):
+    """
+    Guarda un lote (modelos.guardar_filas) y avisa al planificador de
+    pronósticos: sus series se leen de la BD, así que las estaciones se
+    marcan cuando sus filas ya están guardadas. Devuelve las filas
+    insertadas (sin las repetidas).
+    """
+    m_lote.observar(len(filas))
+    with m_commit.medir(), app.app_context():
+        guardadas = guardar_filas(filas)
+    for estacion in {f["estacion"] for f in filas}:
+        planificador.marcar(estacion)
+        lotes_guardados[estacion] = lotes_guardados.get(estacion, 0) + 1
+    planificador.marcar(None)
+    lotes_guardados[None] = lotes_guardados.get(None, 0) + 1
+    return guardadas
+
+def _olvidar_lote(filas):
+    """Lote perdido: sus seq salen de la ventana para que el reenvío de la estación entre."""
+    for fila in filas:
+        ventana_duplicados.olvidar(fila)
+
+cola_ingesta = ColaIngesta(
+    guardar_lote,
+    max_cola=INGESTA_MAX_COLA,
+    tam_lote=INGESTA_TAM_LOTE,
+    intervalo=INGESTA_INTERVALO,
+    espera_encolar=INGESTA_ESPERA_ENCOLAR,
+    intentos=INGESTA_INTENTOS,
+    espera_reintento=INGESTA_ESPERA_REINTENTO,
+    espera_max=INGESTA_ESPERA_MAX,
+    al_perder=_olvidar_lote,
+)
 
 # -------------------------------------------------
-# MQTT
+# Retención por particiones mensuales
 # -------------------------------------------------
-broker = "broker.emqx.io"
-port = 1883
-topic_data = "iot/esp32/data"
-topic_control = "iot/esp32/control"
-client_id = "FlaskDashboard_MySQL"
+# RETENCION_MESES, PARTICIONES_ADELANTE y MANTENIMIENTO_CADA en configuracion.py
+
+def mantener_particiones():
+    """
+    Crea las particiones de los próximos meses y borra las que salen de la
+    ventana de retención. No hace nada si la tabla no está particionada
+    (BD/migraciones/002_particiones.sql) o si la BD no es MySQL.
+    """
+    with app.app_context():
+        creadas, borradas = particiones.mantener(db.engine, PARTICIONES_ADELANTE, RETENCION_MESES)
+    if creadas or borradas:
+        log.info("Particiones mantenidas", extra={"creadas": creadas, "borradas": borradas})
+    return creadas, borradas
+
+def _bucle_particiones():
+    while True:
+        try:
+            mantener_particiones()
+        except Exception as e:
+            log.error("Error en mantenimiento de particiones", extra={"error": str(e)})
+        time.sleep(MANTENIMIENTO_CADA)
+
+@app.cli.command("particiones")
+def particiones_cli():
+    """Ejecuta una pasada de mantenimiento de particiones y sale."""
+    creadas, borradas = mantener_particiones()
+    print(f"Particiones creadas: {creadas or '-'}")
+    print(f"Particiones borradas: {borradas or '-'}")
 
-def to_float_safe(value):
+# -------------------------------------------------
+# Archivo Parquet de días cerrados
+# -------------------------------------------------
+# Directorio, frecuencia y tamaños (ARCHIVO_*, EXPORT_LOTE) en configuracion.py
+
+def archivar():
+    """Archiva en Parquet los días cerrados pendientes (ver archivo.py)."""
+    with app.app_context():
+        archivados = archivo.archivar_pendientes(
+            db.engine, Lectura.__table__, ARCHIVO_DIR,
+            max_dias=ARCHIVO_MAX_DIAS, lote=EXPORT_LOTE, retraso_dias=ARCHIVO_RETRASO_DIAS,
+        )
+    for dia, filas in archivados.items():
+        log.info("Día archivado", extra={"dia": dia.isoformat(), "filas": filas})
+    return archivados
+
+def _bucle_archivo():
+    while True:
+        try:
+            archivar()
+        except Exception as e:
+            log.error("Error archivando lecturas", extra={"error": str(e)})
+        time.sleep(ARCHIVO_CADA)
+
+@app.cli.command("archivar")
+def archivar_cli():
+    """Archiva en Parquet los días cerrados pendientes y sale."""
+    if not archivo.DISPONIBLE:
+        print("Falta pyarrow: pip install pyarrow")
+        return
+    archivados = archivar()
+    print(f"Días archivados: {len(archivados) or '-'}")
+
+# -------------------------------------------------
+# Consultas por estación
+# -------------------------------------------------
+def lecturas_de(estacion=None):
+    """
+    Query base de Lectura filtrada por estación.
+    Con estación, ORDER BY fecha usa el índice (estacion, fecha);
+    sin estación se mantiene la vista global de antes.
+    """
+    query = Lectura.query
+    if estacion:
+        query = query.filter(Lectura.estacion == estacion)
+    return query
+
+def estacion_pedida():
+    return request.args.get("station") or None
+
+def rango_pedido():
+    """(desde, hasta) de ?from=&to= (epoch en ms o ISO; `to` por defecto ahora)."""
     try:
-        return float(value)
-    except (TypeError, ValueError):
-        return None
+        desde = datetime.fromtimestamp(parsear_desde(request.args["from"]) / 1000)
+        hasta = request.args.get("to")
+        hasta = datetime.fromtimestamp(parsear_desde(hasta) / 1000) if hasta else datetime.now()
+    except (KeyError, ValueError, OverflowError, OSError):
+        raise ValueError("from/to inválidos")
+    if hasta < desde:
+        raise ValueError("to anterior a from")
+    return desde, hasta
+
+def precargar_memoria():
+    """
+    Carga desde la BD la cache de última lectura y el historial reciente
+    de cada estación (una consulta indexada por estación), antes de que
+    empiece a llegar la ingesta MQTT.
+    """
+    with app.app_context():
+        estaciones = [
+            f[0] for f in db.session.query(Lectura.estacion).distinct().all()
+        ]
+        for estacion in estaciones:
+            query = Lectura.query
+            if estacion is None:
+                query = query.filter(Lectura.estacion.is_(None))
+            else:
+                query = query.filter(Lectura.estacion == estacion)
+            lecturas = query.order_by(Lectura.fecha.desc()).limit(HISTORIAL_CAPACIDAD).all()
+            if not lecturas:
+                continue
+            if estacion is not None:
+                for l in reversed(lecturas):
+                    historial.agregar(estacion, l.fecha, l.temperatura, l.humedad, l.co2,
+                                      global_=False, anomalia=l.anomalia)
+                    if not l.anomalia:
+                        detector.calentar(estacion, l.temperatura, l.humedad, l.co2)
+            ultima = lecturas[0]
+            ultima_lectura.actualizar(
+                estacion, ultima.temperatura, ultima.humedad, ultima.co2,
+                ultima.fecha, instante_ms=ultima.fecha.timestamp() * 1000,
+                anomalias=variables_marcadas(ultima.anomalia, api=True),
+            )
+
+        # Vista global: todas las estaciones mezcladas
+        lecturas = Lectura.query.order_by(Lectura.fecha.desc()).limit(HISTORIAL_CAPACIDAD).all()
+        for l in reversed(lecturas):
+            historial.agregar(None, l.fecha, l.temperatura, l.humedad, l.co2, anomalia=l.anomalia)
+    log.info("Memoria precargada", extra={"estaciones": len(estaciones)})
+
+# -------------------------------------------------
+# Historial por rango (lecturas crudas o agregados)
+# -------------------------------------------------
+RANGO_PUNTOS = 500          # puntos por defecto en /history?from=
+RANGO_PUNTOS_MAX = 5000     # tope de max_points
+LTTB_MARGEN = 10            # con downsample=lttb se leen hasta 10x puntos y se reducen
+
+def _lecturas_rango(estacion, desde, hasta, limite):
+    """Lecturas crudas sin anomalías del rango como arrays (t en ms, valores n×3), como mucho `limite`."""
+    query = db.session.query(Lectura.fecha, Lectura.temperatura, Lectura.humedad, Lectura.co2)
+    if estacion:
+        query = query.filter(Lectura.estacion == estacion)
+    filas = (
+        query.filter(
+            Lectura.fecha >= desde, Lectura.fecha <= hasta,
+            Lectura.temperatura.isnot(None), Lectura.humedad.isnot(None), Lectura.co2.isnot(None),
+            Lectura.anomalia == 0,  # igual que los agregados
+        )
+        .order_by(Lectura.fecha)
+        .limit(limite)
+        .all()
+    )
+    t = np.array([f[0].timestamp() * 1000 for f in filas])
+    valores = np.array([f[1:] for f in filas], dtype=float).reshape(-1, 3)
+    return t, valores
+
+def _filas_rango(estacion, desde, hasta, tope):
+    """
+    Filas del rango, contando como mucho hasta `tope`: solo recorre el
+    índice (estacion, fecha) o (fecha), sin leer las filas. Incluye las
+    incompletas y las anómalas, así que es una cota de las que devuelve
+    _lecturas_rango.
+    """
+    query = db.session.query(Lectura.fecha).filter(Lectura.fecha >= desde, Lectura.fecha <= hasta)
+    if estacion:
+        query = query.filter(Lectura.estacion == estacion)
+    acotada = query.limit(tope).subquery()
+    return db.session.query(db.func.count()).select_from(acotada).scalar()
+
+def _rollups_rango(estacion, resolucion, desde, hasta):
+    """
+    Agregados del rango a una resolución. Sin estación se combinan todas
+    por intervalo (suma de n y sumas, min de mínimos, max de máximos).
+    Devuelve (t, medias, mínimos, máximos, n).
+    """
+    columnas = [Rollup.inicio, db.func.sum(Rollup.n)]
+    for v in rollups.VARIABLES:
+        columnas += [
+            db.func.min(getattr(Rollup, f"{v}_min")),
+            db.func.max(getattr(Rollup, f"{v}_max")),
+            db.func.sum(getattr(Rollup, f"{v}_suma")),
+        ]
+    query = db.session.query(*columnas).filter(
+        Rollup.resolucion == resolucion,
+        Rollup.inicio >= rollups.inicio_cubo(desde, resolucion),
+        Rollup.inicio <= hasta,
+    )
+    if estacion:
+        query = query.filter(Rollup.estacion == estacion)
+    filas = query.group_by(Rollup.inicio).order_by(Rollup.inicio).all()
+
+    t = np.array([f[0].timestamp() * 1000 for f in filas])
+    datos = np.array([f[1:] for f in filas], dtype=float).reshape(-1, 10)
+    n = datos[:, 0]
+    minimos, maximos, sumas = datos[:, 1::3], datos[:, 2::3], datos[:, 3::3]
+    return t, sumas / np.maximum(n, 1)[:, None], minimos, maximos, n
+
+def historial_rango(estacion, desde, hasta, max_puntos, lttb=False):
+    """
+    Serie de [desde, hasta] con como mucho `max_puntos` puntos. Se usa la
+    resolución más fina que cabe en el presupuesto: lecturas crudas si
+    caben, si no el agregado por minuto, hora o día. Con `lttb` se admite
+    una resolución hasta LTTB_MARGEN veces más fina y se reduce con LTTB;
+    también se reduce si ni los agregados diarios caben.
+    """
+    presupuesto = max_puntos * LTTB_MARGEN if lttb else max_puntos
+    minimos = maximos = n = None
+    with app.app_context():
+        # Primero se cuenta sobre el índice: las lecturas crudas solo se
+        # leen si caben
+        if _filas_rango(estacion, desde, hasta, presupuesto + 1) <= presupuesto:
+            t, valores = _lecturas_rango(estacion, desde, hasta, presupuesto)
+            resolucion = 0
+        else:
+            for resolucion in rollups.RESOLUCIONES:
+                inicio = rollups.inicio_cubo(desde, resolucion)
+                if (hasta - inicio).total_seconds() // resolucion + 1 <= presupuesto:
+                    break
+            t, valores, minimos, maximos, n = _rollups_rango(estacion, resolucion, desde, hasta)
+
+    reducida = len(t) > max_puntos
+    if reducida:
+        i = rollups.lttb(t, valores, max_puntos)
+        t, valores = t[i], valores[i]
+        if n is not None:
+            minimos, maximos, n = minimos[i], maximos[i], n[i]
+    return {
+        "station": estacion,
+        "from": desde.isoformat(),
+        "to": hasta.isoformat(),
+        "resolution": rollups.RESOLUCIONES.get(resolucion, "raw"),
+        "downsampled": bool(reducida),
+        "points": rollups.serializar_rango(t, valores, resolucion, minimos, maximos, n),
+    }
+
+# -------------------------------------------------
+# MQTT
+# -------------------------------------------------
+topic_control = "iot/esp32/control"
+topic_control_estacion = "iot/{}/control"
+topic_pronostico = "iot/{}/forecast"     # "_" = todas las estaciones
+topic_pronosticos = "iot/+/forecast"
+topic_modo_muestreo = "iot/servidor/sampling"
+# Un client_id por proceso: con el mismo id el broker desconecta al anterior
+client_id = f"FlaskDashboard-{socket.gethostname()}-{os.getpid()}"
 
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
-        print("✅ Conectado al broker MQTT")
-        client.subscribe(topic_data)
+        log_mqtt.info("Conectado al broker MQTT", extra={"client_id": client_id})
+        client.subscribe([(topic, 0) for topic in TOPICS])
+        if TAREAS_FONDO:
+            client.subscribe(topic_modo_muestreo, 1)
+        else:
+            client.subscribe(topic_pronosticos, 1)
     else:
-        print(f"❌ Error de conexión MQTT rc={rc}")
+        log_mqtt.error("Error de conexión MQTT", extra={"rc": rc})
+
+def recibir_tareas_fondo(msg):
+    """Mensajes entre procesos: pronósticos publicados y cambios de modo del muestreo."""
+    try:
+        datos = json.loads(msg.payload)
+        if msg.topic == topic_modo_muestreo:
+            cambiar_modo_muestreo(datos["station"], datos["interval_s"], datos["auto"])
+            return
+        estacion = msg.topic.split("/")[1]
+        estacion = None if estacion == "_" else estacion
+        planificador.recibir(estacion, datos)
+        hub.publicar("forecast", planificador.obtener(estacion), estacion)
+    except Exception as e:
+        log_mqtt.warning("Mensaje entre procesos inválido", extra={"topic": msg.topic, "error": str(e)})
 
 def on_message(client, userdata, msg):
     """
-    Cada vez que llega un mensaje MQTT:
-      - se procesa el JSON,
-      - se actualiza latest_data,
-      - y se GUARDA una fila nueva en la tabla Lectura.
+    Cada vez que llega un mensaje MQTT (JSON o binario, ver mensajes.py):
+      - se decodifican sus lecturas y se marcan las anomalías,
+      - se actualiza la cache de última lectura,
+      - y, con ingesta embebida, se ENCOLAN las lecturas; el hilo escritor
+        las guarda en la BD por lotes. Con ingesta externa las guarda
+        servicio_ingesta.py y aquí solo se avisa al planificador.
     """
-    global latest_data, last_update_time
+    if msg.topic == topic_modo_muestreo or msg.topic.endswith("/forecast"):
+        recibir_tareas_fondo(msg)
+        return
+    m_mensajes.inc(tipo_de_topic(msg.topic))
+    depurar = log_mqtt.isEnabledFor(logging.DEBUG)
+    # Lo que la estación guardó sin conexión no dice nada del ritmo actual
+    en_vivo = not msg.topic.endswith("/batch")
     try:
-        payload = json.loads(msg.payload.decode())
-        temp = to_float_safe(payload.get("temperature"))
-        hum  = to_float_safe(payload.get("humidity"))
-        co2  = to_float_safe(payload.get("co2"))
-
-        latest_data["temperature"] = temp if temp is not None else "-"
-        latest_data["humidity"]    = hum  if hum  is not None else "-"
-        latest_data["co2"]         = co2  if co2  is not None else "-"
-
-        print(f"📥 MQTT recibido: {payload}")
-        print(f"📥 Procesado -> temp={temp}, hum={hum}, co2={co2}")
-
-        # 👉 Aquí es donde se GUARDA en la BD
-        if temp is not None and hum is not None and co2 is not None:
-            with app.app_context():
-                lectura = Lectura(temperatura=temp, humedad=hum, co2=co2)
-                db.session.add(lectura)
-                db.session.commit()
-                print("💾 Lectura guardada en la BD:", lectura.id)
-
-        last_update_time = time.time() * 1000
+        # 👉 La fecha se fija al llegar (o la trae la estación), no al escribir el lote
+        lecturas = leer_lecturas(msg.topic, msg.payload)
+        if lecturas is None:
+            m_invalidos.inc("topic")
+            log_mqtt.warning("Topic MQTT no reconocido", extra={"topic": msg.topic})
+            return
+
+        for lectura in lecturas:
+            if ventana_duplicados.repetida(lectura):
+                m_lecturas.inc("duplicate")
+                continue
+            estacion, fecha = lectura["estacion"], lectura["fecha"]
+            temp, hum, co2 = lectura["temperatura"], lectura["humedad"], lectura["co2"]
+            if depurar:
+                log_mqtt.debug("Lectura recibida", extra={"estacion": estacion, "temp": temp, "hum": hum, "co2": co2})
+            if not completa(lectura):
+                m_lecturas.inc("incomplete")
+                continue
+            m_lecturas.inc("complete")
+
+            anomalia = detector.evaluar(lectura)
+            if anomalia:
+                log_mqtt.info("Anomalía", extra={"estacion": estacion, "variables": variables_marcadas(anomalia)})
+            # El seq se anota cuando la lectura ya está en la cola: si se
+            # descarta, el reenvío de la estación tiene que poder entrar
+            if INGESTA_EMBEBIDA and not cola_ingesta.encolar(lectura):
+                log_mqtt.warning("Cola de ingesta llena, lectura descartada")
+            else:
+                ventana_duplicados.anotar(lectura)
+            if MUESTREO_ADAPTATIVO and TAREAS_FONDO and en_vivo:
+                controlador_muestreo.observar(lectura, planificador.obtener(estacion))
+            if anomalia and ANOMALIAS_CUARENTENA:
+                continue
+            # Un reenvío que escapó a la ventana (misma fecha que la última
+            # del buffer) no se vuelve a mostrar ni a emitir
+            if not historial.agregar(estacion, fecha, temp, hum, co2, anomalia=anomalia):
+                continue
+            ultima_lectura.actualizar(estacion, temp, hum, co2, fecha, instante_ms=fecha.timestamp() * 1000,
+                                      anomalias=variables_marcadas(anomalia, api=True))
+            hub.publicar("reading", {
+                "station": estacion,
+                "t": fecha.timestamp() * 1000,
+                "fecha": fecha.strftime("%H:%M:%S"),
+                "temperatura": temp,
+                "humedad": hum,
+                "co2": co2,
+                "anomalias": variables_marcadas(anomalia),
+            }, estacion)
+
+        if not INGESTA_EMBEBIDA and any(completa(l) for l in lecturas):
+            planificador.marcar(lecturas[0]["estacion"])
+            planificador.marcar(None)
 
     except Exception as e:
-        print(f"⚠️ Error procesando datos MQTT: {e}")
+        m_invalidos.inc("payload")
+        log_mqtt.warning("Error procesando datos MQTT", extra={"topic": msg.topic, "error": str(e)})
 
-client = mqtt.Client(client_id)
-client.on_connect = on_connect
-client.on_message = on_message
-client.connect(broker, port)
-client.loop_start()
 
 # -------------------------------------------------
-# Modelo de predicción (auto-ARIMA)
+# Series para el pronóstico
 # -------------------------------------------------
-def autoarima_forecast(series, nombre=""):
-    valid = [float(v) for v in series if v is not None]
-
-    if len(valid) < 5:
-        print(f"⚠️ [{nombre}] Muy pocos datos válidos para auto-ARIMA (n={len(valid)}).")
-        return None
+PRONOSTICO_PUNTOS = 80           # lecturas recientes por serie
 
-    if all(v == valid[0] for v in valid):
-        print(f"ℹ️ [{nombre}] Serie casi constante, predicción = {valid[-1]}")
-        return float(valid[-1])
+# Variable del pronóstico -> columna de Lectura
+COLUMNAS_PRONOSTICO = {"temperature": "temperatura", "humidity": "humedad", "co2": "co2"}
 
-    try:
-        model = auto_arima(
-            valid,
-            seasonal=False,
-            stepwise=True,
-            error_action="ignore",
-            suppress_warnings=True,
-            max_p=5,
-            max_q=5
+def series_pronostico(estacion=None):
+    """
+    Hasta PRONOSTICO_PUNTOS lecturas recientes por variable, en orden
+    cronológico, como (tiempos, valores) en arrays de NumPy; el tiempo
+    (epoch en s) permite al modelo saber qué puntos son nuevos desde su
+    último ajuste. Con PRONOSTICO_SIN_ANOMALIAS se quitan los valores
+    marcados en la ingesta (la marca ya está en la fila, no hay que volver
+    a analizar la serie).
+
+    Se leen solo las columnas necesarias, sin crear objetos Lectura, y los
+    huecos (NULL -> NaN) y las marcas se filtran con máscaras. Una
+    variable sin nada que quitar comparte el array de tiempos con las
+    demás, y pronostico.py usa los arrays tal cual, sin copiarlos.
+    """
+    columnas = [getattr(Lectura, c) for c in COLUMNAS_PRONOSTICO.values()]
+    with app.app_context():
+        filas = (
+            lecturas_de(estacion)
+            .with_entities(Lectura.fecha, Lectura.anomalia, *columnas)
+            .order_by(Lectura.fecha.desc())
+            .limit(PRONOSTICO_PUNTOS)
+            .all()
         )
-        fc = model.predict(n_periods=1)[0]
-        print(f"✅ [{nombre}] auto-ARIMA OK, predicción = {fc}")
-        return float(fc)
-    except Exception as e:
-        print(f"⚠️ [{nombre}] Error en auto_arima: {e}")
-        return None
-
-def calcular_pronostico():
-    # Tomamos hasta 80 lecturas recientes, en orden cronológico
-    lecturas = (
-        Lectura.query
-        .order_by(Lectura.fecha.desc())
-        .limit(80)
-        .all()
-    )
-    lecturas = list(reversed(lecturas))
 
-    if not lecturas:
-        print("⚠️ No hay lecturas en la BD todavía.")
-        return {"temperature": None, "humidity": None, "co2": None}
+    if not filas:
+        log.info("No hay lecturas en la BD todavía", extra={"estacion": estacion})
+        vacia = np.empty(0)
+        return {variable: (vacia, vacia) for variable in COLUMNAS_PRONOSTICO}
 
-    temps = [l.temperatura for l in lecturas if l.temperatura is not None]
-    hums  = [l.humedad    for l in lecturas if l.humedad    is not None]
-    co2s_raw = [l.co2     for l in lecturas if l.co2        is not None]
-    co2s = [v for v in co2s_raw if v is not None and v > 0]
+    fechas, anomalias, *valores = zip(*reversed(filas))
+    tiempos = np.fromiter((f.timestamp() for f in fechas), dtype=float, count=len(fechas))
+    marcas = np.array(anomalias, dtype=np.int64)
 
-    print("📊 Muestras BD ->")
-    print(f"   Temps (n={len(temps)}): {temps[-5:] if temps else '[]'}")
-    print(f"   Hums  (n={len(hums)}): {hums[-5:] if hums else '[]'}")
-    print(f"   CO2   (n_raw={len(co2s_raw)}, n_filtrado={len(co2s)}): {co2s[-5:] if co2s else '[]'}")
+    series = {}
+    for (variable, columna), valores_columna in zip(COLUMNAS_PRONOSTICO.items(), valores):
+        serie = np.array(valores_columna, dtype=float)   # None -> NaN
+        validos = ~np.isnan(serie)
+        if PRONOSTICO_SIN_ANOMALIAS:
+            validos &= (marcas & BITS[columna]) == 0
+        series[variable] = (tiempos, serie) if validos.all() else (tiempos[validos], serie[validos])
 
-    pred_temp = autoarima_forecast(temps, nombre="Temperatura") if temps else None
-    pred_hum  = autoarima_forecast(hums,  nombre="Humedad")     if hums  else None
-    pred_co2  = autoarima_forecast(co2s,  nombre="CO2")         if co2s else None
+    log.debug("Series para el pronóstico",
+              extra={"estacion": estacion, "temp_n": len(series["temperature"][1]),
+                     "hum_n": len(series["humidity"][1]), "co2_n": len(series["co2"][1])})
+    return series
 
-    print("🔮 Pronósticos finales ->",
-          "Temp:", pred_temp, "| Hum:", pred_hum, "| CO2:", pred_co2)
+# -------------------------------------------------
+# Pronósticos en segundo plano
+# -------------------------------------------------
+PRONOSTICO_MIN_INTERVALO = 30    # s mínimos entre recálculos de una estación con datos nuevos
+PRONOSTICO_MAX_INTERVALO = 300   # s máximos sin recalcular una estación conocida
+PRONOSTICO_PROCESOS = os.cpu_count() or 1   # procesos del pool (0 = en el hilo del planificador)
+PRONOSTICO_TIMEOUT = 120         # s máximos por ajuste (estación, variable)
+HORIZONTE_MAX = 60               # pasos máximos en /forecast?horizon=
+NIVEL_POR_DEFECTO = 0.95         # nivel de confianza de las bandas
+
+# Método por variable: "auto", "arima", "ewma", "holt" o "holt_winters".
+# "auto" usa el más barato cuyo error de backtest quede dentro de
+# PRONOSTICO_TOLERANCIA (relativa) del de ARIMA.
+PRONOSTICADORES = {"temperature": "auto", "humidity": "auto", "co2": "auto"}
+PRONOSTICO_TOLERANCIA = 0.10
+PRONOSTICO_SIN_ANOMALIAS = True  # excluir de las series los valores marcados en la ingesta
+HOLT_WINTERS_PERIODO = 6         # muestras por ciclo estacional (6 x 10 s = 1 min)
+
+for _variable, _metodo in PRONOSTICADORES.items():
+    if _metodo not in METODOS:
+        raise ValueError(f"Pronosticador desconocido para {_variable}: {_metodo}")
+
+def pronostico_publicado(estacion, resultado):
+    """
+    Cada pronóstico nuevo va a los clientes /stream y, con ingesta externa,
+    a los demás workers, retenido y con los caminos al horizonte máximo.
+    """
+    hub.publicar("forecast", resultado, estacion)
+    if INGESTA_EMBEBIDA:
+        return
+    caminos = planificador.obtener_trayectorias(estacion, HORIZONTE_MAX, NIVEL_POR_DEFECTO)
+    client.publish(topic_pronostico.format(estacion or "_"), json.dumps(dict(resultado, paths=caminos)),
+                   qos=1, retain=True)
+
+if TAREAS_FONDO:
+    planificador = PlanificadorPronosticos(
+        series_pronostico,
+        ajustar={
+            variable: partial(pronosticar, metodo=metodo, periodo=HOLT_WINTERS_PERIODO,
+                              tolerancia=PRONOSTICO_TOLERANCIA)
+            for variable, metodo in PRONOSTICADORES.items()
+        },
+        procesos=PRONOSTICO_PROCESOS,
+        timeout=PRONOSTICO_TIMEOUT,
+        min_intervalo=PRONOSTICO_MIN_INTERVALO,
+        max_intervalo=PRONOSTICO_MAX_INTERVALO,
+        al_publicar=pronostico_publicado,
+        al_ajustar=lambda variable, segundos: m_ajustes.observar(segundos, variable),
+    )
+else:
+    planificador = PronosticosRecibidos(HORIZONTE_MAX, NIVEL_POR_DEFECTO)
 
-    return {
-        "temperature": pred_temp,
-        "humidity": pred_hum,
-        "co2": pred_co2
-    }
+client = mqtt.Client(client_id)
+client.on_connect = on_connect
+client.on_message = on_message
+
+# Control masivo (control.py): conexiones propias y seguimiento de PUBACK
+CONTROL_CONEXIONES = 4
+CONTROL_TIMEOUT = 30             # s sin PUBACK para dar un mensaje por perdido
+CONTROL_MAX_ENVIOS = 100         # envíos consultables en /control/jobs/<id>
+CONTROL_MAX_ESTACIONES = 5000    # estaciones por envío como mucho
+publicador_control = PublicadorControl(BROKER, PUERTO, CONTROL_CONEXIONES, CONTROL_TIMEOUT,
+                                       CONTROL_MAX_ENVIOS, prefijo=client_id)
+
+# -------------------------------------------------
+# Arranque
+# -------------------------------------------------
+def arrancar():
+    """
+    Crea las tablas, precarga la memoria y arranca los hilos y el cliente
+    MQTT. El cliente va al final, cuando ya existe todo lo que usa on_message.
+    Con ingesta externa no se crean tablas, ni se mantienen particiones,
+    ni se archiva: eso lo hace servicio_ingesta.py.
+    """
+    if INGESTA_EMBEBIDA:
+        with app.app_context():
+            db.create_all()
+    precargar_memoria()
+
+    if INGESTA_EMBEBIDA:
+        cola_ingesta.iniciar()
+        atexit.register(cola_ingesta.detener)
+        threading.Thread(target=_bucle_particiones, name="particiones", daemon=True).start()
+        if archivo.DISPONIBLE:
+            threading.Thread(target=_bucle_archivo, name="archivo", daemon=True).start()
+
+    if TAREAS_FONDO:
+        for estacion in [None] + ultima_lectura.estaciones():
+            planificador.marcar(estacion)
+        planificador.iniciar()
+        atexit.register(planificador.detener)
+    publicador_control.iniciar()
+    atexit.register(publicador_control.detener)
+
+    client.connect(BROKER, PUERTO)
+    client.loop_start()
 
 # -------------------------------------------------
 # HTML (igual que antes, resumido aquí)
@@ -220,6 +742,29 @@ body{
   width:8px;height:8px;border-radius:50%;background:#22c55e;
   box-shadow:0 0 8px rgba(34,197,94,0.7);
 }
+.header-right{
+  display:flex;
+  align-items:center;
+  gap:10px;
+}
+select{
+  padding:5px 8px;
+  border-radius:999px;
+  border:1px solid #d1d5db;
+  background:#ffffff;
+  color:#111827;
+  font-size:0.8rem;
+}
+.section-row{
+  display:flex;
+  align-items:center;
+  justify-content:space-between;
+  gap:8px;
+}
+.section-row select{
+  padding:2px 6px;
+  font-size:0.72rem;
+}
 .section-title{
   font-size:0.8rem;
   text-transform:uppercase;
@@ -404,11 +949,16 @@ button:hover{
     <div class="header">
       <div class="header-left">
         <h1>Estación IoT – Clima y Calidad del Aire</h1>
-        <p>Lecturas en tiempo real y pronóstico auto-ARIMA desde la base de datos</p>
+        <p>Lecturas en tiempo real y pronóstico (auto-ARIMA / suavizado exponencial) desde la base de datos</p>
       </div>
-      <div class="badge">
-        <span class="badge-dot"></span>
-        <span>MQTT conectado</span>
+      <div class="header-right">
+        <select id="stationSelect" onchange="changeStation(this.value)">
+          <option value="">Todas las estaciones</option>
+        </select>
+        <div class="badge">
+          <span class="badge-dot"></span>
+          <span>MQTT conectado</span>
+        </div>
       </div>
     </div>
 
@@ -418,22 +968,22 @@ button:hover{
         <div class="card-row">
           <div class="card">
             <h2>Temperatura</h2>
-            <div class="card-value" id="temp">{{ temperature }}°C</div>
+            <div class="card-value" id="temp">-°C</div>
             <div class="card-sub">Última medición</div>
           </div>
           <div class="card">
             <h2>Humedad relativa</h2>
-            <div class="card-value" id="hum">{{ humidity }}%</div>
+            <div class="card-value" id="hum">-%</div>
             <div class="card-sub">Condición ambiente</div>
           </div>
           <div class="card">
             <h2>CO₂ estimado</h2>
-            <div class="card-value" id="co2">{{ co2 }} ppm</div>
+            <div class="card-value" id="co2">- ppm</div>
             <div class="card-sub">Calidad del aire</div>
           </div>
         </div>
 
-        <div class="section-title">Pronóstico próximo intervalo (auto-ARIMA)</div>
+        <div class="section-title">Pronóstico próximo intervalo</div>
         <div class="card-row">
           <div class="card card-forecast">
             <h2>Temp. pronosticada</h2>
@@ -454,7 +1004,16 @@ button:hover{
       </div>
 
       <div class="right-column">
-        <div class="section-title">Histórico de variables (BD)</div>
+        <div class="section-row">
+          <div class="section-title">Histórico de variables (BD) <span id="rangeInfo"></span></div>
+          <select id="rangeSelect" onchange="changeRange(this.value)">
+            <option value="">En vivo</option>
+            <option value="3600">Última hora</option>
+            <option value="86400">Últimas 24 h</option>
+            <option value="604800">Últimos 7 días</option>
+            <option value="2592000">Últimos 30 días</option>
+          </select>
+        </div>
         <div class="charts-grid">
           <div class="chart-panel">
             <div class="chart-title">Temperatura</div>
@@ -480,16 +1039,16 @@ button:hover{
       <div class="forecast-panel temp">
         <div class="forecast-header">
           <div class="forecast-label">Temperatura – histórico + predicción</div>
-          <div class="forecast-chip">auto-ARIMA</div>
+          <div class="forecast-chip" id="tempModel">--</div>
         </div>
         <div class="forecast-main-value" id="tempForecastMain">--</div>
-        <div class="forecast-note">La línea amarilla une el último valor histórico con el valor pronosticado.</div>
+        <div class="forecast-note">La línea amarilla sigue el camino pronosticado; la banda es el intervalo de confianza del 95%.</div>
         <canvas id="chartTempForecast"></canvas>
       </div>
       <div class="forecast-panel hum">
         <div class="forecast-header">
           <div class="forecast-label">Humedad – histórico + predicción</div>
-          <div class="forecast-chip">auto-ARIMA</div>
+          <div class="forecast-chip" id="humModel">--</div>
         </div>
         <div class="forecast-main-value" id="humForecastMain">--</div>
         <div class="forecast-note">Pronóstico basado en el comportamiento reciente.</div>
@@ -498,7 +1057,7 @@ button:hover{
       <div class="forecast-panel co2">
         <div class="forecast-header">
           <div class="forecast-label">CO₂ – histórico + predicción</div>
-          <div class="forecast-chip">auto-ARIMA</div>
+          <div class="forecast-chip" id="co2Model">--</div>
         </div>
         <div class="forecast-main-value" id="co2ForecastMain">--</div>
         <div class="forecast-note">El punto final indica la tendencia inmediata de CO₂.</div>
@@ -510,6 +1069,7 @@ button:hover{
       <span>Intervalo de lectura (minutos):</span>
       <input type="number" id="intervalInput" min="1" placeholder="Ej. 10">
       <button onclick="sendControl()">Enviar al ESP32</button>
+      <button onclick="sendAuto()">Automático</button>
       <span id="statusMsg"></span>
     </div>
   </div>
@@ -530,10 +1090,25 @@ const baseLineOptions = {
   }
 };
 
+let currentStation = new URLSearchParams(location.search).get("station") || "";
+
+function withStation(url, params){
+  const q = new URLSearchParams(params || {});
+  if (currentStation) q.set("station", currentStation);
+  const qs = q.toString();
+  return qs ? url + "?" + qs : url;
+}
+
 let lastLabels = [];
 let lastTemps = [];
 let lastHums = [];
 let lastCO2 = [];
+let lastPreds = null;
+
+// Cursor de /history: `t` del último punto recibido (null = pedir la ventana completa)
+const HISTORY_POINTS = 30;
+let lastT = null;
+let historyGen = 0;
 
 const chartTemp = new Chart(document.getElementById('chartTemp'), {
   ...baseLineOptions,
@@ -563,6 +1138,21 @@ function makeForecastChart(ctx){
           fill:true,
           pointRadius:1.5
         },
+        {
+          label:"Límite inferior",
+          data:[],
+          borderColor:"rgba(0,0,0,0)",
+          pointRadius:0,
+          fill:false
+        },
+        {
+          label:"Banda de confianza",
+          data:[],
+          borderColor:"rgba(0,0,0,0)",
+          backgroundColor:"rgba(250,204,21,0.18)",
+          pointRadius:0,
+          fill:'-1'
+        },
         {
           label:"Pronóstico",
           data:[],
@@ -570,7 +1160,7 @@ function makeForecastChart(ctx){
           backgroundColor:"rgba(250,204,21,0.35)",
           tension:0,
           fill:false,
-          pointRadius:6,
+          pointRadius:3,
           pointBackgroundColor:"#fde047",
           pointBorderColor:"#f97316",
           pointBorderWidth:2,
@@ -591,13 +1181,53 @@ function makeForecastChart(ctx){
   });
 }
 
+// En vivo, las gráficas de histórico comparten los arrays que fetchHistory va
+// ampliando; con un rango muestran la serie de /history?from= (las de
+// pronóstico siguen usando la ventana en vivo)
+function bindHistoryCharts(labels, temps, hums, co2) {
+  chartTemp.data.labels = labels; chartTemp.data.datasets[0].data = temps;
+  chartHum.data.labels  = labels; chartHum.data.datasets[0].data  = hums;
+  chartCO2.data.labels  = labels; chartCO2.data.datasets[0].data  = co2;
+  chartTemp.update();
+  chartHum.update();
+  chartCO2.update();
+}
+bindHistoryCharts(lastLabels, lastTemps, lastHums, lastCO2);
+
+// Rango elegido en segundos hacia atrás ("" = en vivo)
+const RANGE_POINTS = 300;
+let historyRange = "";
+
+function changeRange(sec) {
+  historyRange = sec;
+  if (!sec) {
+    document.getElementById("rangeInfo").innerText = "";
+    bindHistoryCharts(lastLabels, lastTemps, lastHums, lastCO2);
+    return;
+  }
+  fetchRange();
+}
+
+function fetchRange() {
+  const gen = historyGen;
+  const sec = historyRange;
+  const params = { from: Date.now() - sec * 1000, max_points: RANGE_POINTS, downsample: "lttb" };
+  fetch(withStation("/history", params)).then(r => r.json()).then(data => {
+    if (gen !== historyGen || sec !== historyRange) return;
+    const p = data.points;
+    document.getElementById("rangeInfo").innerText =
+      "· " + data.resolution + (data.downsampled ? " (LTTB)" : "");
+    bindHistoryCharts(p.map(d => d.fecha), p.map(d => d.temperatura), p.map(d => d.humedad), p.map(d => d.co2));
+  });
+}
+
 const chartTempForecast = makeForecastChart(document.getElementById('chartTempForecast'));
 const chartHumForecast  = makeForecastChart(document.getElementById('chartHumForecast'));
 const chartCO2Forecast  = makeForecastChart(document.getElementById('chartCO2Forecast'));
 
 function fetchData() {
   // ahora /data lee la última fila de la BD
-  fetch("/data").then(r => r.json()).then(data => {
+  fetch(withStation("/data")).then(r => r.json()).then(data => {
     document.getElementById("temp").innerText = data.temperature + "°C";
     document.getElementById("hum").innerText  = data.humidity + "%";
     document.getElementById("co2").innerText  = data.co2 + " ppm";
@@ -605,35 +1235,46 @@ function fetchData() {
 }
 
 function fetchHistory() {
-  fetch("/history").then(r => r.json()).then(data => {
-    const labels = data.map(d => d.fecha);
-    const temps  = data.map(d => d.temperatura);
-    const hums   = data.map(d => d.humedad);
-    const co2s   = data.map(d => d.co2);
-
-    lastLabels = labels;
-    lastTemps  = temps;
-    lastHums   = hums;
-    lastCO2    = co2s;
-
-    chartTemp.data.labels = labels;
-    chartTemp.data.datasets[0].data = temps;
-    chartTemp.update();
-
-    chartHum.data.labels = labels;
-    chartHum.data.datasets[0].data = hums;
-    chartHum.update();
-
-    chartCO2.data.labels = labels;
-    chartCO2.data.datasets[0].data = co2s;
-    chartCO2.update();
-
-    updateForecastCharts();
+  const full = lastT === null;
+  const gen = historyGen;
+  const url = full ? withStation("/history") : withStation("/history", { since: lastT });
+  fetch(url).then(r => r.json()).then(data => {
+    if (gen !== historyGen) return;  // respuesta de otra estación
+    if (!full && data.length === 0) return;
+    appendPoints(data, full);
   });
 }
 
+function appendPoints(data, full) {
+  const series = [lastLabels, lastTemps, lastHums, lastCO2];
+  if (full) series.forEach(a => { a.length = 0; });
+
+  // Se añaden solo los puntos nuevos y se recorta la ventana
+  for (const d of data) {
+    if (!full && lastT !== null && d.t <= lastT) continue;
+    lastLabels.push(d.fecha);
+    lastTemps.push(d.temperatura);
+    lastHums.push(d.humedad);
+    lastCO2.push(d.co2);
+    lastT = d.t;
+  }
+  const extra = lastLabels.length - HISTORY_POINTS;
+  if (extra > 0) series.forEach(a => a.splice(0, extra));
+
+  chartTemp.update();
+  chartHum.update();
+  chartCO2.update();
+
+  updateForecastCharts(lastPreds);
+}
+
+// Pasos del camino pronosticado y nivel de la banda
+const FORECAST_HORIZON = 6;
+const FORECAST_LEVEL = 0.95;
+
 function fetchForecast() {
-  fetch("/forecast").then(r => r.json()).then(data => {
+  fetch(withStation("/forecast", { horizon: FORECAST_HORIZON, level: FORECAST_LEVEL })).then(r => r.json()).then(data => {
+    lastPreds = data;
     if (data.temperature !== null) {
       const t = data.temperature.toFixed(2)+"°C";
       document.getElementById("tempForecast").innerText = t;
@@ -661,48 +1302,50 @@ function fetchForecast() {
       document.getElementById("co2ForecastMain").innerText = "--";
     }
 
+    const models = data.models || {};
+    document.getElementById("tempModel").innerText = models.temperature || "--";
+    document.getElementById("humModel").innerText  = models.humidity || "--";
+    document.getElementById("co2Model").innerText  = models.co2 || "--";
+
     updateForecastCharts(data);
   });
 }
 
-function buildForecastSeries(values, forecastVal){
+function buildForecastSeries(values, path){
   if (!values || values.length === 0) {
-    return { labels: [], hist: [], forecast: [] };
+    return { labels: [], hist: [], lower: [], upper: [], forecast: [] };
   }
   const n = values.length;
-  const labelsWithForecast = [...lastLabels, "Pronóstico"];
-  const histForChart = [...values, null];
-
-  const forecastSeries = [];
-  for (let i = 0; i < n - 1; i++) forecastSeries.push(null);
-  forecastSeries.push(values[n - 1]);
-  forecastSeries.push(forecastVal != null && !isNaN(forecastVal) ? forecastVal : null);
+  const steps = path ? path.mean.length : 0;
+  const labels = [...lastLabels];
+  for (let i = 1; i <= steps; i++) labels.push("+" + i);
+  const pad = () => Array(n - 1).fill(null);
+
+  // El camino sale del último valor histórico; la banda empieza ahí con ancho cero
+  const last = values[n - 1];
+  const hist = [...values, ...Array(steps).fill(null)];
+  const forecast = [...pad(), last, ...(path ? path.mean : [])];
+  const lower = [...pad(), last, ...(path ? path.lower : [])];
+  const upper = [...pad(), last, ...(path ? path.upper : [])];
+
+  return { labels, hist, lower, upper, forecast };
+}
 
-  return { labels: labelsWithForecast, hist: histForChart, forecast: forecastSeries };
+function setForecastChart(chart, values, path){
+  const s = buildForecastSeries(values, path);
+  chart.data.labels = s.labels;
+  chart.data.datasets[0].data = s.hist;
+  chart.data.datasets[1].data = s.lower;
+  chart.data.datasets[2].data = s.upper;
+  chart.data.datasets[3].data = s.forecast;
+  chart.update();
 }
 
 function updateForecastCharts(preds){
-  let tempPred = preds && preds.temperature!=null ? preds.temperature : null;
-  let humPred  = preds && preds.humidity!=null ? preds.humidity : null;
-  let co2Pred  = preds && preds.co2!=null ? preds.co2 : null;
-
-  const sTemp = buildForecastSeries(lastTemps, tempPred);
-  chartTempForecast.data.labels = sTemp.labels;
-  chartTempForecast.data.datasets[0].data = sTemp.hist;
-  chartTempForecast.data.datasets[1].data = sTemp.forecast;
-  chartTempForecast.update();
-
-  const sHum = buildForecastSeries(lastHums, humPred);
-  chartHumForecast.data.labels = sHum.labels;
-  chartHumForecast.data.datasets[0].data = sHum.hist;
-  chartHumForecast.data.datasets[1].data = sHum.forecast;
-  chartHumForecast.update();
-
-  const sCO2 = buildForecastSeries(lastCO2, co2Pred);
-  chartCO2Forecast.data.labels = sCO2.labels;
-  chartCO2Forecast.data.datasets[0].data = sCO2.hist;
-  chartCO2Forecast.data.datasets[1].data = sCO2.forecast;
-  chartCO2Forecast.update();
+  const paths = preds && preds.paths ? preds.paths : {};
+  setForecastChart(chartTempForecast, lastTemps, paths.temperature);
+  setForecastChart(chartHumForecast, lastHums, paths.humidity);
+  setForecastChart(chartCO2Forecast, lastCO2, paths.co2);
 }
 
 function sendControl() {
@@ -711,7 +1354,7 @@ function sendControl() {
   fetch("/send_control", {
     method: "POST",
     headers: {"Content-Type": "application/json"},
-    body: JSON.stringify({ interval: value })
+    body: JSON.stringify({ interval: value, station: currentStation || null })
   })
   .then(res => res.json())
   .then(() => {
@@ -720,78 +1363,591 @@ function sendControl() {
   });
 }
 
-setInterval(fetchData, 10000);
-setInterval(fetchHistory, 15000);
-setInterval(fetchForecast, 30000);
+function sendAuto() {
+  fetch("/send_control", {
+    method: "POST",
+    headers: {"Content-Type": "application/json"},
+    body: JSON.stringify({ auto: true, station: currentStation || null })
+  })
+  .then(res => res.json())
+  .then(() => {
+    document.getElementById("statusMsg").innerText = "Muestreo automático ✔";
+    setTimeout(() => document.getElementById("statusMsg").innerText = "", 3000);
+  });
+}
+
+function fetchStations() {
+  fetch("/stations").then(r => r.json()).then(list => {
+    const sel = document.getElementById("stationSelect");
+    for (const st of list) {
+      if ([...sel.options].some(o => o.value === st)) continue;
+      const opt = document.createElement("option");
+      opt.value = st;
+      opt.textContent = st;
+      sel.appendChild(opt);
+    }
+    sel.value = currentStation;
+  });
+}
+
+function changeStation(st) {
+  currentStation = st;
+  const url = new URL(window.location);
+  if (st) url.searchParams.set("station", st); else url.searchParams.delete("station");
+  history.replaceState(null, "", url);
+  lastT = null;
+  lastPreds = null;
+  historyGen++;
+  fetchData();
+  fetchHistory();
+  if (historyRange) fetchRange();
+  fetchForecast();
+  openStream();
+}
+
+// ----- Empuje desde el servidor (SSE); el sondeo queda solo como respaldo -----
+let stream = null;
+let pollTimers = [];
+let forecastTimer = null;
+
+function startPolling() {
+  if (pollTimers.length) return;
+  pollTimers = [
+    setInterval(fetchData, 10000),
+    setInterval(fetchHistory, 15000),
+    setInterval(fetchForecast, 30000),
+  ];
+}
+
+function stopPolling() {
+  pollTimers.forEach(clearInterval);
+  pollTimers = [];
+}
+
+function showReading(d) {
+  document.getElementById("temp").innerText = d.temperatura + "°C";
+  document.getElementById("hum").innerText  = d.humedad + "%";
+  document.getElementById("co2").innerText  = d.co2 + " ppm";
+}
+
+function openStream() {
+  if (!window.EventSource) { startPolling(); return; }
+  if (stream) stream.close();
+  stream = new EventSource(withStation("/stream"));
+  // Al (re)conectar se recupera con ?since= lo que llegó mientras tanto
+  stream.onopen = () => { stopPolling(); fetchHistory(); };
+  // EventSource reintenta solo; mientras tanto, sondeo
+  stream.onerror = () => { startPolling(); };
+  stream.addEventListener("reading", e => {
+    const d = JSON.parse(e.data);
+    showReading(d);
+    if (lastT !== null) appendPoints([d], false);
+  });
+  // Llega un evento por variable: se agrupan en una sola petición
+  stream.addEventListener("forecast", () => {
+    clearTimeout(forecastTimer);
+    forecastTimer = setTimeout(fetchForecast, 300);
+  });
+}
+
+fetchStations();
+fetchData();
 fetchHistory();
 fetchForecast();
+openStream();
 </script>
 </body>
 </html>
 """
 
+# La página no depende de la petición (estación y lecturas las pide el
+# navegador): se prepara una vez, ya comprimida, y se sirve con su ETag
+PAGINA = respuestas.PaginaEstatica(HTML_PAGE)
+
 # -------------------------------------------------
 # Rutas Flask
 # -------------------------------------------------
+@app.before_request
+def _medir_inicio():
+    g.inicio_peticion = time.perf_counter()
+
+@app.after_request
+def _medir_fin(response):
+    inicio = g.pop("inicio_peticion", None)
+    if inicio is not None:
+        # La regla (/history), no la URL: una serie por ruta, no por petición
+        ruta = request.url_rule.rule if request.url_rule is not None else "(sin ruta)"
+        m_rutas.observar(time.perf_counter() - inicio, ruta, request.method)
+        m_respuestas.inc(ruta, str(response.status_code))
+    return response
+
+# Registrado después: los after_request corren en orden inverso, así que
+# la compresión entra en la latencia medida
+app.after_request(respuestas.comprimir)
+
+# Los contadores de versión (historial, pronósticos) vuelven a empezar en
+# cada proceso: sus ETags llevan también la instancia
+INSTANCIA = f"{os.getpid():x}.{int(time.time()):x}"
+
+def _etag(tipo, version, instancia=True):
+    """ETag de una respuesta: tipo, versión de los datos y la query (estación, parámetros)."""
+    etag = f"{tipo}-{version}-{zlib.crc32(request.query_string):08x}"
+    return f"{etag}-{INSTANCIA}" if instancia else etag
+
 @app.route("/")
 def index():
-    # Leemos última fila de la BD para las tarjetas
-    lectura = Lectura.query.order_by(Lectura.fecha.desc()).first()
-    if lectura is None:
-        t = h = c = "-"
-    else:
-        t = lectura.temperatura
-        h = lectura.humedad
-        c = lectura.co2
-
-    return render_template_string(
-        HTML_PAGE,
-        temperature=t,
-        humidity=h,
-        co2=c
-    )
+    # Página fija; las tarjetas se llenan con /data desde el navegador
+    return PAGINA.respuesta()
 
 @app.route("/data")
 def get_data():
-    lectura = Lectura.query.order_by(Lectura.fecha.desc()).first()
+    """
+    Última lectura de la estación. El ETag es la hora de esa lectura: si
+    el cliente ya la tiene, 304 (age_s no cuenta como cambio).
+    """
+    lectura = ultima_lectura.obtener(estacion_pedida())
     if lectura is None:
-        return jsonify({"temperature": "-", "humidity": "-", "co2": "-"})
-    return jsonify({
-        "temperature": lectura.temperatura,
-        "humidity": lectura.humedad,
-        "co2": lectura.co2
-    })
+        return jsonify(SIN_LECTURA)
+
+    def construir():
+        # Antigüedad de la lectura, para que el cliente sepa si está al día
+        lectura["age_s"] = round(max(0.0, time.time() - lectura["last_update_time"] / 1000), 3)
+        return jsonify(lectura)
+
+    return respuestas.condicional(
+        _etag("d", int(lectura["last_update_time"]), instancia=False),   # la hora vale entre procesos
+        respuestas.instante_http(lectura["last_update_time"]),
+        construir,
+    )
 
 @app.route("/history")
 def history():
-    lecturas = Lectura.query.order_by(Lectura.fecha.desc()).limit(30).all()
-    data = [
-        {
-            "fecha": l.fecha.strftime("%H:%M:%S"),
-            "temperatura": l.temperatura,
-            "humedad": l.humedad,
-            "co2": l.co2,
-        }
-        for l in reversed(lecturas)
-    ]
-    return jsonify(data)
+    """
+    Últimas lecturas desde el historial en memoria.
+    Con ?since=<t> (el `t` del último punto que tiene el cliente, o una
+    fecha ISO) devuelve solo los puntos nuevos.
+    Con ?from=<t>[&to=<t>][&max_points=N][&downsample=lttb] devuelve el
+    rango desde la BD a la resolución que cabe en max_points.
+    El ETag de las lecturas en memoria es la versión del historial de la
+    estación: cambia con cada lectura nueva, así que sin lecturas nuevas se
+    contesta 304. El del rango es la de lo guardado en la BD (los lotes
+    atrasados de /batch no entran en el historial pero sí en el rango);
+    con ingesta externa este proceso no lo sabe y el rango va sin ETag.
+    """
+    estacion = estacion_pedida()
+    if request.args.get("from") or request.args.get("to"):
+        try:
+            desde, hasta = rango_pedido()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            max_puntos = int(request.args.get("max_points", RANGO_PUNTOS))
+        except ValueError:
+            return jsonify({"error": "max_points inválido"}), 400
+        if not 3 <= max_puntos <= RANGO_PUNTOS_MAX:
+            return jsonify({"error": f"max_points debe estar entre 3 y {RANGO_PUNTOS_MAX}"}), 400
+        lttb = request.args.get("downsample") == "lttb"
+        construir = lambda: jsonify(historial_rango(estacion, desde, hasta, max_puntos, lttb=lttb))
+        if not INGESTA_EMBEBIDA:
+            return construir()
+        return respuestas.condicional(_etag("r", lotes_guardados.get(estacion, 0)), None, construir)
+    etag = _etag("h", historial.version(estacion))
+    since = request.args.get("since")
+    if since:
+        try:
+            t_desde = parsear_desde(since)
+        except ValueError:
+            return jsonify({"error": "since inválido"}), 400
+        return respuestas.condicional(etag, None, lambda: jsonify(
+            historial.desde(estacion, t_desde, limite=HISTORIAL_CAPACIDAD)
+        ))
+    return respuestas.condicional(etag, None, lambda: jsonify(historial.ultimos(estacion, HISTORIAL_PUNTOS)))
+
+@app.route("/export")
+def export():
+    """
+    Descarga de lecturas de ?from=&to= (y ?station=) en CSV o Parquet
+    (?format=csv|parquet), generada por bloques mientras se envía. Los
+    días archivados se leen de los ficheros Parquet, no de la BD.
+    """
+    try:
+        desde, hasta = rango_pedido()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    formato = request.args.get("format", "csv")
+    if formato not in ("csv", "parquet"):
+        return jsonify({"error": "format debe ser csv o parquet"}), 400
+    if formato == "parquet" and not archivo.DISPONIBLE:
+        return jsonify({"error": "exportación Parquet no disponible (falta pyarrow)"}), 501
+
+    bloques = archivo.leer_rango(
+        modelos.motor_lectura(), Lectura.__table__, ARCHIVO_DIR, desde, hasta,
+        estacion=estacion_pedida(), lote=EXPORT_LOTE,
+    )
+    if formato == "csv":
+        cuerpo, tipo = archivo.a_csv(bloques), "text/csv"
+    else:
+        cuerpo, tipo = archivo.a_parquet(bloques), "application/vnd.apache.parquet"
+    nombre = f"lecturas_{desde:%Y%m%d%H%M}_{hasta:%Y%m%d%H%M}.{formato}"
+    return Response(
+        stream_with_context(cuerpo),
+        mimetype=tipo,
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'},
+    )
 
 @app.route("/forecast")
 def forecast():
-    preds = calcular_pronostico()
-    return jsonify(preds)
+    """
+    Último pronóstico de la estación (solo lectura: el planificador calcula
+    en segundo plano). ?horizon=<pasos>&level=<0.5-0.99> añade en `paths`
+    el camino completo con su banda de confianza, del mismo modelo ajustado.
+    """
+    estacion = estacion_pedida()
+    try:
+        horizonte = int(request.args.get("horizon", 1))
+        nivel = round(float(request.args.get("level", NIVEL_POR_DEFECTO)), 2)
+    except ValueError:
+        return jsonify({"error": "horizon/level inválidos"}), 400
+    if not 1 <= horizonte <= HORIZONTE_MAX or not 0.5 <= nivel <= 0.99:
+        return jsonify({"error": f"horizon debe estar entre 1 y {HORIZONTE_MAX} y level entre 0.5 y 0.99"}), 400
+
+    preds = planificador.obtener(estacion)
+    if preds is None:
+        planificador.marcar(estacion)
+        return jsonify({"temperature": None, "humidity": None, "co2": None,
+                        "station": estacion, "pending": True})
+
+    def construir():
+        preds.update({
+            "horizon": horizonte,
+            "level": nivel,
+            "paths": planificador.obtener_trayectorias(estacion, horizonte, nivel),
+        })
+        return jsonify(preds)
+
+    # Versión del pronóstico publicado: sin recálculo nuevo, 304
+    generado = datetime.fromisoformat(preds["generated_at"]).timestamp() * 1000
+    return respuestas.condicional(_etag("f", preds["version"]), respuestas.instante_http(generado), construir)
+
+@app.route("/stream")
+def stream():
+    """
+    Server-Sent Events: `reading` con cada lectura nueva y `forecast` con
+    cada pronóstico publicado, para ?station= o para todas. Sustituye al
+    sondeo de /data, /history y /forecast.
+    """
+    sus = hub.suscribir(estacion_pedida())
+
+    def generar():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                mensaje = sus.siguiente(STREAM_LATIDO)
+                if mensaje is CERRADA or (mensaje is None and not sus.activa):
+                    return
+                yield mensaje if mensaje is not None else ": ping\n\n"
+        finally:
+            hub.cancelar(sus)
+
+    return Response(generar(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+@app.route("/stations")
+def stations():
+    # La cache se precarga con todas las estaciones de la BD
+    return jsonify(ultima_lectura.estaciones())
+
+@app.route("/anomalies")
+def anomalies():
+    """
+    Últimas lecturas marcadas como anómalas (?station=, ?from=&to=,
+    ?limit=) y contadores del detector de este proceso.
+    """
+    try:
+        limite = min(int(request.args.get("limit", 100)), 1000)
+    except ValueError:
+        return jsonify({"error": "limit inválido"}), 400
+    query = lecturas_de(estacion_pedida()).filter(Lectura.anomalia != 0)
+    if request.args.get("from") or request.args.get("to"):
+        try:
+            desde, hasta = rango_pedido()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        query = query.filter(Lectura.fecha >= desde, Lectura.fecha <= hasta)
+    filas = query.order_by(Lectura.fecha.desc()).limit(limite).all()
+    return jsonify({
+        "readings": [
+            {
+                "id": l.id,
+                "station": l.estacion,
+                "fecha": l.fecha.isoformat(timespec="seconds"),
+                "temperature": l.temperatura,
+                "humidity": l.humedad,
+                "co2": l.co2,
+                "anomalies": variables_marcadas(l.anomalia, api=True),
+            }
+            for l in filas
+        ],
+        "detector": detector.estadisticas(),
+    })
+
+@app.route("/ingest/stats")
+def ingest_stats():
+    return jsonify({"modo": INGESTA_MODO, **cola_ingesta.estadisticas()})
+
+# Lo que ya cuentan la cola, la cache, el detector, el hub y el
+# planificador se lee al exportar, sin tocar su camino caliente
+def _estado_cola(clave):
+    return lambda: cola_ingesta.estadisticas()[clave]
+
+def _aciertos_cache():
+    aciertos = {
+        ("latest_reading", "hit"): ultima_lectura.aciertos,
+        ("latest_reading", "miss"): ultima_lectura.fallos,
+    }
+    if TAREAS_FONDO:
+        pronos = planificador.estadisticas()
+        aciertos[("forecast_paths", "hit")] = pronos["trayectorias_aciertos"]
+        aciertos[("forecast_paths", "miss")] = pronos["trayectorias_fallos"]
+    return aciertos
+
+metricas.funcion("ingest_queue_depth", "Lecturas esperando en la cola de ingesta", _estado_cola("profundidad"))
+metricas.funcion("ingest_queue_max_depth", "Máxima profundidad de la cola de ingesta", _estado_cola("max_profundidad"))
+metricas.funcion("ingest_queue_capacity", "Capacidad de la cola de ingesta", _estado_cola("capacidad"))
+metricas.funcion("ingest_dropped_total", "Lecturas descartadas con la cola llena",
+                 _estado_cola("descartadas"), tipo="counter")
+metricas.funcion("ingest_written_total", "Lecturas guardadas en la BD", _estado_cola("escritas"), tipo="counter")
+metricas.funcion("ingest_duplicates_total", "Lecturas repetidas descartadas, en memoria o en la BD",
+                 lambda: {("window",): ventana_duplicados.repetidas, ("db",): cola_ingesta.estadisticas()["repetidas"]},
+                 tipo="counter", etiquetas=("stage",))
+metricas.funcion("ingest_write_errors_total", "Intentos de guardar un lote que fallaron",
+                 _estado_cola("errores_escritura"), tipo="counter")
+metricas.funcion("ingest_write_retries_total", "Lotes reintentados tras un error de escritura",
+                 _estado_cola("reintentos"), tipo="counter")
+metricas.funcion("ingest_lost_rows_total", "Lecturas perdidas tras agotar los reintentos",
+                 _estado_cola("filas_fallidas"), tipo="counter")
+metricas.funcion("cache_requests_total", "Consultas a las caches en memoria por resultado",
+                 _aciertos_cache, tipo="counter", etiquetas=("cache", "result"))
+metricas.funcion("sampling_changes_total", "Cambios de intervalo enviados por el muestreo adaptativo",
+                 lambda: {(d,): controlador_muestreo.estadisticas()[k]
+                          for d, k in (("slower", "alargados"), ("faster", "acortados"), ("resend", "reenvios"))},
+                 tipo="counter", etiquetas=("direction",))
+metricas.funcion("control_messages_total", "Mensajes de control masivo por resultado",
+                 lambda: {(r,): publicador_control.estadisticas()[k]
+                          for r, k in (("published", "publicados"), ("acked", "confirmados"),
+                                       ("error", "errores"), ("timeout", "vencidos"))},
+                 tipo="counter", etiquetas=("result",))
+metricas.funcion("anomaly_flags_total", "Valores marcados como anómalos por variable",
+                 lambda: {(v,): n for v, n in detector.estadisticas()["marcadas"].items()},
+                 tipo="counter", etiquetas=("variable",))
+if TAREAS_FONDO:
+    metricas.funcion("forecast_errors_total", "Ajustes de pronóstico con error",
+                     lambda: planificador.estadisticas()["errores"], tipo="counter")
+    metricas.funcion("forecast_timeouts_total", "Ajustes de pronóstico descartados por timeout",
+                     lambda: planificador.estadisticas()["vencidos"], tipo="counter")
+    metricas.funcion("forecast_queue", "Ajustes de pronóstico esperando turno",
+                     lambda: planificador.estadisticas()["en_cola"])
+metricas.funcion("stream_clients", "Conexiones /stream abiertas", hub.clientes)
+
+def _conexiones_en_uso():
+    with app.app_context():
+        motores = {"default" if k is None else k: e for k, e in db.engines.items()}
+    return {(nombre,): motor.pool.checkedout() for nombre, motor in motores.items()
+            if hasattr(motor.pool, "checkedout")}
+
+metricas.funcion("db_pool_checked_out", "Conexiones en uso por pool", _conexiones_en_uso, etiquetas=("pool",))
+
+@app.route("/metrics")
+def metrics():
+    """Contadores e histogramas del proceso en formato de texto de Prometheus."""
+    return Response(metricas.exportar(), content_type=TIPO_CONTENIDO)
 
 @app.route("/send_control", methods=["POST"])
 def send_control():
+    """
+    {"interval": minutos} fija el intervalo a mano (la estación o todas)
+    y el muestreo adaptativo deja de tocarlo; {"auto": true} lo devuelve
+    al control automático.
+    """
     data = request.json
     interval = data.get("interval")
+    estacion = data.get("station")
+    if data.get("auto"):
+        cambiar_modo_muestreo(estacion, None, True)
+        log_mqtt.info("Muestreo automático", extra={"estacion": estacion})
+        return jsonify({"status": "ok", "mode": "auto"})
     if interval:
-        msg = json.dumps({"interval": int(interval)})
-        client.publish(topic_control, msg)
-        print(f"📤 Intervalo enviado al ESP32: {interval} minutos")
-        return jsonify({"status": "ok"})
+        try:
+            interval = int(interval)
+        except (TypeError, ValueError):
+            return jsonify({"status": "error"}), 400
+        if not intervalo_valido(interval * 60):
+            return jsonify({"status": "error",
+                            "error": f"interval fuera de [{MUESTREO_MIN} s, {INTERVALO_MAX // 60} min]"}), 400
+        msg = json.dumps({"interval": interval})
+        topic = topic_control_estacion.format(estacion) if estacion else topic_control
+        # Retenido por estación: si no, al reconectar le llegaría el último del controlador
+        client.publish(topic, msg, retain=bool(estacion))
+        if not estacion:
+            # El topic común no se retiene: se pisa el retenido de cada estación
+            publicador_control.enviar(
+                [(e, topic_control_estacion.format(e), msg, True) for e in _todas_las_estaciones()],
+                {"station": None, "interval": interval})
+        cambiar_modo_muestreo(estacion, interval * 60, False)
+        log_mqtt.info("Intervalo enviado", extra={"topic": topic, "minutos": interval})
+        return jsonify({"status": "ok", "mode": "manual"})
     return jsonify({"status": "error"}), 400
 
+def _todas_las_estaciones():
+    """
+    Estaciones con lecturas o etiquetas en la BD, más las vistas por este
+    proceso que aún no se han guardado.
+    """
+    estaciones = {e for (e,) in db.session.query(Lectura.estacion).distinct()}
+    estaciones.update(e for (e,) in db.session.query(EstacionEtiqueta.estacion).distinct())
+    estaciones.update(ultima_lectura.estaciones())
+    estaciones.discard(None)
+    return sorted(estaciones)
+
+def _estaciones_de(selector):
+    """
+    Estaciones de un selector de /control/bulk: {"stations": [...]},
+    {"tag": "..."} o {"all": true}. ValueError si no es ninguno.
+    """
+    if not isinstance(selector, dict):
+        raise ValueError("selector debe ser un objeto")
+    if selector.get("all") is True:
+        return _todas_las_estaciones()
+    if "stations" in selector:
+        estaciones = selector["stations"]
+        if not isinstance(estaciones, list) or not all(isinstance(e, str) and e for e in estaciones):
+            raise ValueError("stations debe ser una lista de nombres")
+        return list(dict.fromkeys(estaciones))
+    if isinstance(selector.get("tag"), str):
+        filas = db.session.query(EstacionEtiqueta.estacion).filter(
+            EstacionEtiqueta.etiqueta == selector["tag"]).order_by(EstacionEtiqueta.estacion)
+        return [f[0] for f in filas]
+    raise ValueError("selector necesita stations, tag o all")
+
+def _segundos_de(settings):
+    """(segundos, automático) de los settings de /control/bulk. ValueError si no valen."""
+    if not isinstance(settings, dict):
+        raise ValueError("settings debe ser un objeto")
+    if settings.get("auto") is True:
+        return MUESTREO_MIN, True
+    if "interval_s" in settings:
+        valor, escala = settings["interval_s"], 1
+    elif "interval" in settings:
+        valor, escala = settings["interval"], 60
+    else:
+        raise ValueError("settings necesita interval_s, interval o auto")
+    try:
+        segundos = int(valor) * escala
+    except (TypeError, ValueError):
+        raise ValueError("interval/interval_s inválidos")
+    if not intervalo_valido(segundos):
+        raise ValueError(f"intervalo fuera de [{MUESTREO_MIN}, {INTERVALO_MAX}] s")
+    return segundos, False
+
+@app.route("/control/bulk", methods=["POST"])
+def control_bulk():
+    """
+    Control para muchas estaciones a la vez:
+
+        {"selector": {"stations": [...]} | {"tag": "..."} | {"all": true},
+         "settings": {"interval_s": s} | {"interval": min} | {"auto": true},
+         "group": false}
+
+    Un mensaje retenido por estación en iot/<estacion>/control. Con "all"
+    y "group": true va además uno en el topic común (sin retener, como
+    /send_control), que llega antes a las conectadas; los retenidos
+    siguen haciendo falta para que quien reconecte no reciba su
+    intervalo viejo. Contesta 202 al momento; el estado de la entrega
+    (PUBACK del broker por destino) está en /control/jobs/<id>.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        estaciones = _estaciones_de(data.get("selector"))
+        segundos, auto = _segundos_de(data.get("settings"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    grupo = bool(data.get("group"))
+    if grupo and data["selector"].get("all") is not True:
+        return jsonify({"error": "group solo vale con el selector all"}), 400
+    if not grupo and not estaciones:
+        return jsonify({"error": "el selector no corresponde a ninguna estación"}), 400
+    if len(estaciones) > CONTROL_MAX_ESTACIONES:
+        return jsonify({"error": f"como mucho {CONTROL_MAX_ESTACIONES} estaciones por envío"}), 400
+
+    payload = json.dumps({"interval_s": segundos})
+    mensajes = [(e, topic_control_estacion.format(e), payload, True) for e in estaciones]
+    if grupo:
+        mensajes.insert(0, ("*", topic_control, payload, False))
+    # Con "all" también cambia el modo de las estaciones que aún no se han visto
+    for estacion in [None] if data["selector"].get("all") is True else estaciones:
+        cambiar_modo_muestreo(estacion, segundos, auto)
+
+    descripcion = {"selector": data["selector"], "settings": data["settings"], "group": grupo}
+    envio = publicador_control.enviar(mensajes, descripcion)
+    log_mqtt.info("Control masivo", extra={"job": envio.id, "mensajes": len(mensajes), "segundos": segundos})
+    return jsonify({"job": envio.id, "targets": len(mensajes),
+                    "status_url": f"/control/jobs/{envio.id}"}), 202
+
+@app.route("/control/jobs/<id_envio>")
+def control_job(id_envio):
+    """Estado de un envío de /control/bulk: contadores y estado por destino."""
+    resumen = publicador_control.obtener(id_envio)
+    if resumen is None:
+        return jsonify({"error": "envío desconocido"}), 404
+    return jsonify(resumen)
+
+@app.route("/stations/tags")
+def station_tags():
+    """{etiqueta: [estaciones]}"""
+    etiquetas = {}
+    filas = db.session.query(EstacionEtiqueta.etiqueta, EstacionEtiqueta.estacion).order_by(
+        EstacionEtiqueta.etiqueta, EstacionEtiqueta.estacion)
+    for etiqueta, estacion in filas:
+        etiquetas.setdefault(etiqueta, []).append(estacion)
+    return jsonify(etiquetas)
+
+@app.route("/stations/<estacion>/tags", methods=["PUT"])
+def put_station_tags(estacion):
+    """{"tags": [...]} sustituye las etiquetas de la estación."""
+    etiquetas = (request.get_json(silent=True) or {}).get("tags")
+    if not isinstance(etiquetas, list) or not all(isinstance(t, str) and 0 < len(t) <= 64 for t in etiquetas):
+        return jsonify({"error": "tags debe ser una lista de textos (máx. 64 caracteres)"}), 400
+    etiquetas = sorted(set(etiquetas))
+    guardar_etiquetas(estacion, etiquetas)
+    return jsonify({"station": estacion, "tags": etiquetas})
+
+@app.route("/sampling")
+def sampling():
+    """Intervalo de muestreo de cada estación: pedido, observado, modo y puntuación del controlador."""
+    if not TAREAS_FONDO:
+        return jsonify({"error": "el muestreo adaptativo corre en el proceso con IOT_TAREAS_FONDO=1"}), 503
+    return jsonify(controlador_muestreo.estado())
+
+def _comando_cli():
+    """
+    Nombre del comando de `flask <comando>` que está importando este
+    módulo, o None si no lo importa el CLI de Flask (gunicorn, `python
+    ServidorFlask.py`). Los comandos de la app (`flask particiones`,
+    `flask archivar`) cargan la app en el contexto del grupo ("flask");
+    `flask run`, en el suyo.
+    """
+    contexto = click.get_current_context(silent=True)
+    return contexto.info_name if contexto is not None else None
+
+# Los procesos del pool de pronósticos reimportan este script como
+# __mp_main__ cuando el método de arranque es spawn (Windows, macOS);
+# ahí no debe arrancar nada. Tampoco en un comando de mantenimiento del
+# CLI, que no necesita MQTT, hilos ni pool.
+if __name__ != "__mp_main__" and _comando_cli() in (None, "run"):
+    arrancar()
+
 if __name__ == "__main__":
-    print("🌐 Servidor Flask corriendo en http://127.0.0.1:5000")
+    log.info("Servidor Flask corriendo", extra={"url": "http://127.0.0.1:5000"})
     app.run(debug=True, use_reloader=False)
\ No newline at end of file
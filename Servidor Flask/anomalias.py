@@ -0,0 +1,146 @@
+import math
+import threading
+from collections import deque
+
+# -------------------------------------------------
+# Detección de anomalías en la ingesta
+# -------------------------------------------------
+# Cada lectura recibe una marca (máscara de bits, una por variable) que se
+# guarda con la fila en `lectura.anomalia`. Una variable se marca si:
+#
+#   - está fuera del rango físico del sensor (p. ej. co2 = 0), o
+#   - se aleja más de `umbral` desviaciones de la media de las últimas
+#     `ventana` lecturas normales de esa estación (media y varianza
+#     móviles por Welford, O(1) por muestra).
+#
+# Los valores marcados no entran en la ventana, así un pico no infla la
+# varianza. Si llegan `cambio_nivel` marcas seguidas se interpreta como un
+# cambio de nivel real y la ventana vuelve a empezar desde el valor nuevo.
+
+VARIABLES = ("temperatura", "humedad", "co2")
+BITS = {"temperatura": 1, "humedad": 2, "co2": 4}
+NOMBRES_API = {"temperatura": "temperature", "humedad": "humidity", "co2": "co2"}
+
+# Rangos físicos de DHT11 / MQ135 y desviación mínima (resolución del sensor)
+RANGOS = {"temperatura": (-40.0, 85.0), "humedad": (0.0, 100.0), "co2": (1.0, 10000.0)}
+SIGMA_MIN = {"temperatura": 0.5, "humedad": 2.0, "co2": 20.0}
+
+
+def variables_marcadas(marca, api=False):
+    """Nombres de las variables marcadas en la máscara (en inglés con api=True)."""
+    return [NOMBRES_API[v] if api else v for v in VARIABLES if marca & BITS[v]]
+
+
+class EstadisticaMovil:
+    """Media y varianza de las últimas `ventana` muestras (Welford con altas y bajas)."""
+
+    def __init__(self, ventana):
+        self.ventana = ventana
+        self.valores = deque()
+        self.media = 0.0
+        self._m2 = 0.0
+
+    def __len__(self):
+        return len(self.valores)
+
+    def agregar(self, x):
+        if len(self.valores) == self.ventana:
+            self._quitar(self.valores.popleft())
+        self.valores.append(x)
+        delta = x - self.media
+        self.media += delta / len(self.valores)
+        self._m2 += delta * (x - self.media)
+
+    def _quitar(self, x):
+        n = len(self.valores)  # ya sin x
+        if n == 0:
+            self.media = self._m2 = 0.0
+            return
+        media_anterior = self.media
+        self.media = (media_anterior * (n + 1) - x) / n
+        self._m2 = max(0.0, self._m2 - (x - media_anterior) * (x - self.media))
+
+    def desviacion(self):
+        n = len(self.valores)
+        return math.sqrt(self._m2 / (n - 1)) if n > 1 else 0.0
+
+    def reiniciar(self, x):
+        self.valores.clear()
+        self.media = self._m2 = 0.0
+        self.agregar(x)
+
+
+class DetectorAnomalias:
+    def __init__(self, ventana=60, umbral=6.0, minimo=10, cambio_nivel=5):
+        self.ventana = ventana
+        self.umbral = umbral
+        self.minimo = minimo
+        self.cambio_nivel = cambio_nivel
+        self._lock = threading.Lock()
+        self._series = {}       # (estacion, variable) -> EstadisticaMovil
+        self._seguidas = {}     # (estacion, variable) -> marcas consecutivas
+
+        self.evaluadas = 0
+        self.marcadas = {v: 0 for v in VARIABLES}
+        self.fuera_de_rango = {v: 0 for v in VARIABLES}
+        self.cambios_nivel = 0
+
+    def _serie(self, clave):
+        serie = self._series.get(clave)
+        if serie is None:
+            serie = self._series[clave] = EstadisticaMovil(self.ventana)
+        return serie
+
+    def _evaluar_valor(self, estacion, variable, x):
+        """True si el valor es anómalo; si no, entra en la ventana."""
+        minimo, maximo = RANGOS[variable]
+        if not minimo <= x <= maximo:
+            self.fuera_de_rango[variable] += 1
+            return True
+
+        clave = (estacion, variable)
+        serie = self._serie(clave)
+        if len(serie) >= self.minimo:
+            sigma = max(serie.desviacion(), SIGMA_MIN[variable])
+            if abs(x - serie.media) > self.umbral * sigma:
+                seguidas = self._seguidas.get(clave, 0) + 1
+                if seguidas < self.cambio_nivel:
+                    self._seguidas[clave] = seguidas
+                    return True
+                serie.reiniciar(x)
+                self._seguidas[clave] = 0
+                self.cambios_nivel += 1
+                return False
+        self._seguidas[clave] = 0
+        serie.agregar(x)
+        return False
+
+    def evaluar(self, lectura):
+        """Marca de la lectura (dict con estacion y las variables); la guarda en lectura["anomalia"]."""
+        marca = 0
+        with self._lock:
+            self.evaluadas += 1
+            for variable in VARIABLES:
+                x = lectura[variable]
+                if x is not None and self._evaluar_valor(lectura["estacion"], variable, x):
+                    marca |= BITS[variable]
+                    self.marcadas[variable] += 1
+        lectura["anomalia"] = marca
+        return marca
+
+    def calentar(self, estacion, temperatura, humedad, co2):
+        """Añade una lectura ya validada (p. ej. de la BD al arrancar) sin evaluarla."""
+        with self._lock:
+            for variable, x in zip(VARIABLES, (temperatura, humedad, co2)):
+                if x is not None:
+                    self._serie((estacion, variable)).agregar(x)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "evaluadas": self.evaluadas,
+                "marcadas": {NOMBRES_API[v]: n for v, n in self.marcadas.items()},
+                "fuera_de_rango": {NOMBRES_API[v]: n for v, n in self.fuera_de_rango.items()},
+                "cambios_de_nivel": self.cambios_nivel,
+                "series": len(self._series),
+            }
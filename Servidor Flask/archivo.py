@@ -0,0 +1,317 @@
+import csv
+import io
+import os
+from datetime import date, datetime, time, timedelta
+from urllib.parse import quote
+
+from sqlalchemy import func, select
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # el archivo Parquet es opcional: sin pyarrow solo hay CSV desde la BD
+    pa = pc = pq = None
+
+DISPONIBLE = pa is not None
+
+# -------------------------------------------------
+# Archivo Parquet de lecturas y exportación por streaming
+# -------------------------------------------------
+# Los días ya cerrados se copian de `lectura` a ficheros Parquet
+# comprimidos, uno por día y estación:
+#
+#   <base>/fecha=AAAA-MM-DD/estacion=<estacion>/lecturas.parquet
+#   <base>/fecha=AAAA-MM-DD/_COMPLETO      (el día entero está archivado)
+#
+# /export lee los días archivados de esos ficheros y solo el resto de la
+# BD, por bloques, así que las descargas grandes no cargan MySQL ni la
+# memoria del servidor.
+#
+# Las estaciones guardan muestras sin conexión y las mandan después
+# (/batch), así que a un día ya archivado le pueden llegar filas tarde.
+# Por eso un día se archiva `retraso_dias` después de cerrarse, y cada
+# pasada busca las filas nuevas (id mayor que el de la pasada anterior,
+# guardado en <base>/_REVISADO) de días archivados y, si el día tiene
+# más filas que las que dice su marca _COMPLETO, lo vuelve a archivar.
+# Hasta esa pasada, /export no ve esas filas.
+
+COLUMNAS = ("id", "estacion", "fecha", "temperatura", "humedad", "co2", "anomalia")
+MARCA_COMPLETO = "_COMPLETO"
+MARCA_REVISADO = "_REVISADO"
+SOLAPE_IDS = 10000   # ids que se vuelven a revisar: transacciones aún sin confirmar en la pasada anterior
+FICHERO = "lecturas.parquet"
+SIN_ESTACION = "_"
+COMPRESION = "zstd"
+
+
+def esquema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("estacion", pa.string()),
+        ("fecha", pa.timestamp("ms")),
+        ("temperatura", pa.float64()),
+        ("humedad", pa.float64()),
+        ("co2", pa.float64()),
+        ("anomalia", pa.int16()),
+    ])
+
+
+def ruta_dia(base, dia):
+    return os.path.join(base, f"fecha={dia.isoformat()}")
+
+
+def ruta_estacion(base, dia, estacion):
+    nombre = SIN_ESTACION if estacion is None else quote(estacion, safe="")
+    return os.path.join(ruta_dia(base, dia), f"estacion={nombre}", FICHERO)
+
+
+def dia_archivado(base, dia):
+    return DISPONIBLE and os.path.exists(os.path.join(ruta_dia(base, dia), MARCA_COMPLETO))
+
+
+def _limites(dia):
+    inicio = datetime.combine(dia, time.min)
+    return inicio, inicio + timedelta(days=1)
+
+
+def _consulta(tabla, desde, hasta, estacion=None, incluir_fin=False):
+    """SELECT de las columnas de COLUMNAS en [desde, hasta) ordenado por estación y fecha."""
+    c = tabla.c
+    fin = c.fecha <= hasta if incluir_fin else c.fecha < hasta
+    query = select(*(c[col] for col in COLUMNAS)).where(c.fecha >= desde, fin)
+    if estacion is not None:
+        query = query.where(c.estacion == estacion)
+    return query.order_by(c.estacion, c.fecha)
+
+
+def _bloques_bd(engine, query, lote):
+    """Filas de la consulta en bloques de columnas (dict nombre -> lista), con cursor de servidor."""
+    with engine.connect() as conn:
+        resultado = conn.execution_options(stream_results=True, yield_per=lote).execute(query)
+        for filas in resultado.partitions():
+            yield dict(zip(COLUMNAS, map(list, zip(*filas))))
+
+
+# -------------------------------------------------
+# Archivador
+# -------------------------------------------------
+def _escribir_atomico(ruta, escribir):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    escribir(temporal)
+    os.replace(temporal, ruta)
+
+
+def archivar_dia(engine, tabla, base, dia, lote=50000):
+    """
+    Escribe un Parquet por estación con las lecturas de `dia` y deja la
+    marca _COMPLETO al final. Devuelve el número de filas archivadas.
+    """
+    inicio, fin = _limites(dia)
+    with engine.connect() as conn:
+        estaciones = [
+            f[0] for f in conn.execute(
+                select(tabla.c.estacion).where(tabla.c.fecha >= inicio, tabla.c.fecha < fin).distinct()
+            )
+        ]
+
+    total = 0
+    for estacion in estaciones:
+        query = _consulta(tabla, inicio, fin, estacion)
+        if estacion is None:
+            query = _consulta(tabla, inicio, fin).where(tabla.c.estacion.is_(None))
+
+        def escribir(ruta):
+            nonlocal total
+            with pq.ParquetWriter(ruta, esquema(), compression=COMPRESION) as writer:
+                for bloque in _bloques_bd(engine, query, lote):
+                    writer.write_batch(pa.RecordBatch.from_pydict(bloque, schema=esquema()))
+                    total += len(bloque["id"])
+
+        _escribir_atomico(ruta_estacion(base, dia, estacion), escribir)
+
+    def marcar(ruta):
+        with open(ruta, "w") as f:
+            f.write(str(total))
+
+    # La marca guarda las filas archivadas: con filas atrasadas ya no cuadra
+    _escribir_atomico(os.path.join(ruta_dia(base, dia), MARCA_COMPLETO), marcar)
+    return total
+
+
+def _leer_numero(ruta):
+    try:
+        with open(ruta) as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _incompleto(engine, tabla, base, dia):
+    """True si el día archivado tiene en la BD filas que no están en su archivo."""
+    archivadas = _leer_numero(os.path.join(ruta_dia(base, dia), MARCA_COMPLETO))
+    inicio, fin = _limites(dia)
+    with engine.connect() as conn:
+        filas = conn.execute(
+            select(func.count()).select_from(tabla).where(tabla.c.fecha >= inicio, tabla.c.fecha < fin)
+        ).scalar()
+    return archivadas is None or filas > archivadas
+
+
+def _dias_con_filas_nuevas(engine, tabla, desde_id, hasta_id, antes_de):
+    """Días anteriores a `antes_de` con filas de id en (desde_id, hasta_id]."""
+    c = tabla.c
+    query = select(func.date(c.fecha)).where(
+        c.id > desde_id, c.id <= hasta_id, c.fecha < datetime.combine(antes_de, time.min)
+    ).distinct()
+    with engine.connect() as conn:
+        dias = [f[0] for f in conn.execute(query)]
+    # SQLite devuelve date() como texto
+    return {d if isinstance(d, date) else date.fromisoformat(d) for d in dias}
+
+
+def archivar_pendientes(engine, tabla, base, hoy=None, max_dias=31, lote=50000, retraso_dias=1):
+    """
+    Archiva los días cerrados hace más de `retraso_dias` que aún no lo
+    están, empezando por el más antiguo con lecturas; como mucho
+    `max_dias` por pasada. Antes vuelve a archivar los días ya archivados
+    que han recibido filas desde la pasada anterior. Devuelve {día: filas}.
+    """
+    if not DISPONIBLE:
+        return {}
+    hoy = hoy or date.today()
+    limite = hoy - timedelta(days=retraso_dias)
+    with engine.connect() as conn:
+        primera, ultimo_id = conn.execute(select(func.min(tabla.c.fecha), func.max(tabla.c.id))).one()
+    if primera is None:
+        return {}
+
+    archivados = {}
+    revisado = _leer_numero(os.path.join(base, MARCA_REVISADO))
+    if revisado is not None:
+        desde_id = max(0, revisado - SOLAPE_IDS)
+        for dia in sorted(_dias_con_filas_nuevas(engine, tabla, desde_id, ultimo_id, limite)):
+            if dia_archivado(base, dia) and _incompleto(engine, tabla, base, dia):
+                archivados[dia] = archivar_dia(engine, tabla, base, dia, lote)
+
+    dia = primera.date()
+    nuevos = 0
+    while dia < limite and nuevos < max_dias:
+        if not dia_archivado(base, dia):
+            archivados[dia] = archivar_dia(engine, tabla, base, dia, lote)
+            nuevos += 1
+        dia += timedelta(days=1)
+
+    def escribir(ruta):
+        with open(ruta, "w") as f:
+            f.write(str(ultimo_id))
+
+    _escribir_atomico(os.path.join(base, MARCA_REVISADO), escribir)
+    return archivados
+
+
+# -------------------------------------------------
+# Lectura de un rango (archivo + BD)
+# -------------------------------------------------
+def _bloques_archivo(base, dia, desde, hasta, estacion, lote):
+    if estacion is not None:
+        rutas = [ruta_estacion(base, dia, estacion)]
+    else:
+        carpeta = ruta_dia(base, dia)
+        rutas = [
+            os.path.join(carpeta, d, FICHERO)
+            for d in sorted(os.listdir(carpeta)) if d.startswith("estacion=")
+        ]
+    desde_ms = pa.scalar(desde, pa.timestamp("ms"))
+    hasta_ms = pa.scalar(hasta, pa.timestamp("ms"))
+    for ruta in rutas:
+        if not os.path.exists(ruta):
+            continue
+        fichero = pq.ParquetFile(ruta)
+        columnas = [c for c in COLUMNAS if c in fichero.schema_arrow.names]
+        for batch in fichero.iter_batches(batch_size=lote, columns=columnas):
+            mascara = pc.and_(pc.greater_equal(batch["fecha"], desde_ms), pc.less_equal(batch["fecha"], hasta_ms))
+            batch = batch.filter(mascara)
+            if batch.num_rows:
+                bloque = batch.to_pydict()
+                for c in COLUMNAS:  # ficheros de antes de que existiera la columna
+                    bloque.setdefault(c, [0] * batch.num_rows)
+                yield bloque
+
+
+def leer_rango(engine, tabla, base, desde, hasta, estacion=None, lote=50000):
+    """
+    Lecturas de [desde, hasta] en bloques de columnas, día a día y, dentro
+    de cada día, por estación y fecha. Los días archivados salen de los
+    ficheros Parquet; el resto, de la BD.
+    """
+    dia = desde.date()
+    while dia <= hasta.date():
+        if dia_archivado(base, dia):
+            yield from _bloques_archivo(base, dia, desde, hasta, estacion, lote)
+        else:
+            inicio, fin = _limites(dia)
+            ultimo = fin >= hasta
+            query = _consulta(tabla, max(inicio, desde), min(fin, hasta), estacion, incluir_fin=ultimo)
+            yield from _bloques_bd(engine, query, lote)
+        dia += timedelta(days=1)
+
+
+# -------------------------------------------------
+# Formatos de exportación (generadores para Response)
+# -------------------------------------------------
+def a_csv(bloques):
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    escritor.writerow(COLUMNAS)
+    for bloque in bloques:
+        columnas = [bloque[c] for c in COLUMNAS]
+        i = COLUMNAS.index("fecha")
+        columnas[i] = [f.isoformat(sep=" ") for f in columnas[i]]
+        escritor.writerows(zip(*columnas))
+        yield salida.getvalue()
+        salida.seek(0)
+        salida.truncate()
+    yield salida.getvalue()
+
+
+class _Tubo:
+    """Destino de escritura que acumula los bytes hasta que se recogen."""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+        self.closed = False
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def recoger(self):
+        datos = b"".join(self._partes)
+        self._partes = []
+        return datos
+
+
+def a_parquet(bloques):
+    """Un fichero Parquet emitido por partes: un grupo de filas por bloque y el pie al final."""
+    tubo = _Tubo()
+    writer = pq.ParquetWriter(tubo, esquema(), compression=COMPRESION)
+    for bloque in bloques:
+        writer.write_batch(pa.RecordBatch.from_pydict(bloque, schema=esquema()))
+        datos = tubo.recoger()
+        if datos:
+            yield datos
+    writer.close()
+    yield tubo.recoger()
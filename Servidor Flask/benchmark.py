@@ -0,0 +1,468 @@
+"""
+Banco de pruebas reproducible de la ingesta, las rutas y los pronósticos.
+
+    python benchmark.py --salida resultado.json
+    python benchmark.py --bd mysql+pymysql://root:@localhost/estacion_iot_bench --limpiar
+    python benchmark.py --comparar antes.json despues.json
+
+Importa el servidor (ServidorFlask.py) con un cliente MQTT local en lugar
+del broker y, con una semilla fija:
+
+  1. opcionalmente guarda `--historia-dias` días de lecturas pasadas,
+     para que /history?from= lea agregados como en producción,
+  2. reproduce `--mensajes` mensajes (JSON o binarios) por on_message,
+     generados a partir de las lecturas de BD/estacion_iot.sql, y mide
+     mensajes/s hasta que todo está guardado en la BD,
+  3. lanza `--clientes` hilos que hacen de dashboards contra /data,
+     /history y /forecast (cliente de pruebas de Flask, sin red) y mide
+     p50/p99 por ruta,
+  4. ajusta cada método de pronóstico sobre las series de cada estación
+     y mide los segundos de ajuste completo y de actualización.
+
+El resultado es un JSON con los parámetros, el entorno y las medidas;
+--comparar muestra la variación entre dos resultados.
+
+Por defecto usa una BD SQLite temporal. Con MySQL, conviene una base de
+datos propia para el banco: --limpiar borra sus lecturas y agregados.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VOLCADO = os.path.join(RAIZ, "BD", "estacion_iot.sql")
+INTERVALO_MUESTRAS = 10        # s entre lecturas de una estación, como el firmware
+FORMATO_RESULTADO = 1
+
+
+# -------------------------------------------------
+# Datos de partida
+# -------------------------------------------------
+_FILA_VOLCADO = re.compile(r"^\((\d+), ([\d.-]+|NULL), ([\d.-]+|NULL), ([\d.-]+|NULL), '([^']+)'\)")
+
+
+def lecturas_grabadas(ruta=VOLCADO):
+    """(temperatura, humedad, co2) de las filas del volcado de la BD, en orden."""
+    filas = []
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            m = _FILA_VOLCADO.match(linea)
+            if m and "NULL" not in m.groups()[1:4]:
+                filas.append(tuple(float(x) for x in m.groups()[1:4]))
+    if not filas:
+        raise ValueError(f"no hay lecturas en {ruta}")
+    return np.array(filas)
+
+
+class GeneradorLecturas:
+    """
+    Lecturas por estación a partir de las grabadas:
+      - "grabado": repite las grabadas con un desfase por estación,
+      - "sintetico": paseo aleatorio con el paso típico de las grabadas.
+    Misma semilla, mismas lecturas.
+    """
+
+    def __init__(self, grabadas, origen="sintetico", semilla=1):
+        self.grabadas = grabadas
+        self.origen = origen
+        self.rng = random.Random(semilla)
+        self.media = grabadas.mean(axis=0)
+        # Paso típico; con un mínimo para que la serie no quede constante
+        pasos = np.abs(np.diff(grabadas, axis=0)).mean(axis=0) if len(grabadas) > 1 else np.zeros(3)
+        self.paso = np.maximum(pasos, (0.05, 0.2, 1.0))
+        self._estado = {}
+
+    def siguiente(self, estacion, i):
+        desfase = (sum(map(ord, estacion)) % 7) * 0.3   # hash() cambia entre procesos
+        if self.origen == "grabado":
+            t, h, c = self.grabadas[i % len(self.grabadas)]
+            return round(t + desfase, 2), round(h, 2), round(c, 2)
+        t, h, c = self._estado.get(estacion, self.media + (desfase, 0.0, 0.0))
+        t += self.rng.gauss(0, self.paso[0])
+        h = min(100.0, max(0.0, h + self.rng.gauss(0, self.paso[1])))
+        c = max(1.0, c + self.rng.gauss(0, self.paso[2]))
+        self._estado[estacion] = (t, h, c)
+        return round(t, 2), round(h, 2), round(c, 2)
+
+
+# -------------------------------------------------
+# Broker local
+# -------------------------------------------------
+class ClienteLocal(mqtt.Client):
+    """
+    Cliente paho sin red: connect() no abre sockets, loop_start() llama a
+    on_connect y entregar() invoca on_message como lo haría el hilo de red.
+    Lo publicado queda en `publicados`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.publicados = []
+
+    def connect(self, *args, **kwargs):
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_start(self):
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_stop(self, force=False):
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def subscribe(self, topic, qos=0, options=None, properties=None):
+        return mqtt.MQTT_ERR_SUCCESS, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.publicados.append((topic, payload, qos))
+        info = mqtt.MQTTMessageInfo(len(self.publicados))
+        info._set_as_published()
+        return info
+
+    def entregar(self, topic, payload):
+        mensaje = mqtt.MQTTMessage(topic=topic.encode())
+        mensaje.payload = payload
+        self.on_message(self, None, mensaje)
+
+
+# -------------------------------------------------
+# Utilidades
+# -------------------------------------------------
+def percentiles_ms(segundos):
+    if not segundos:
+        return {"n": 0}
+    ms = np.asarray(segundos) * 1000
+    return {
+        "n": int(ms.size),
+        "media_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def entorno(uri):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "bd": uri.split(":", 1)[0],
+        "commit": commit,
+    }
+
+
+# -------------------------------------------------
+# Fases
+# -------------------------------------------------
+def sembrar_historia(S, generador, estaciones, dias, lote=5000):
+    """Lecturas cada INTERVALO_MUESTRAS s de los últimos `dias` días (con sus agregados)."""
+    if dias <= 0:
+        return {"filas": 0, "segundos": 0.0}
+    inicio = time.perf_counter()
+    ahora = datetime.now().replace(microsecond=0)
+    pasos = int(dias * 86400 / INTERVALO_MUESTRAS)
+    filas, total = [], 0
+    with S.app.app_context():
+        for k in range(pasos, 0, -1):
+            fecha = ahora - timedelta(seconds=k * INTERVALO_MUESTRAS + 60)
+            for estacion in estaciones:
+                t, h, c = generador.siguiente(estacion, k)
+                filas.append({"estacion": estacion, "temperatura": t, "humedad": h, "co2": c,
+                              "fecha": fecha, "anomalia": 0})
+            if len(filas) >= lote:
+                S.guardar_filas(filas)
+                total += len(filas)
+                filas = []
+        if filas:
+            S.guardar_filas(filas)
+            total += len(filas)
+    return {"filas": total, "segundos": round(time.perf_counter() - inicio, 3)}
+
+
+def fase_ingesta(S, cliente, generador, estaciones, n_mensajes, formato, muestras_por_mensaje):
+    from mensajes import codificar_binario
+
+    # Los payloads se generan antes de medir: solo se mide el servidor
+    mensajes = []
+    for i in range(n_mensajes):
+        estacion = estaciones[i % len(estaciones)]
+        if formato == "bin":
+            muestras = [
+                ((muestras_por_mensaje - 1 - j) * INTERVALO_MUESTRAS, *generador.siguiente(estacion, i + j))
+                for j in range(muestras_por_mensaje)
+            ]
+            mensajes.append((f"iot/{estacion}/bin", codificar_binario(muestras)))
+        else:
+            t, h, c = generador.siguiente(estacion, i)
+            mensajes.append((f"iot/{estacion}/data",
+                             json.dumps({"temperature": t, "humidity": h, "co2": c}).encode()))
+    lecturas = n_mensajes * (muestras_por_mensaje if formato == "bin" else 1)
+
+    antes = S.cola_ingesta.estadisticas()
+    duraciones = []
+    inicio = time.perf_counter()
+    for topic, payload in mensajes:
+        t0 = time.perf_counter()
+        cliente.entregar(topic, payload)
+        duraciones.append(time.perf_counter() - t0)
+    callback = time.perf_counter() - inicio
+
+    # Hasta que el hilo escritor haya guardado (o perdido) todo
+    while True:
+        stats = S.cola_ingesta.estadisticas()
+        hechas = (stats["escritas"] - antes["escritas"]) + (stats["filas_fallidas"] - antes["filas_fallidas"]) \
+            + (stats["descartadas"] - antes["descartadas"])
+        if hechas >= lecturas or not S.INGESTA_EMBEBIDA:
+            break
+        time.sleep(0.01)
+    total = time.perf_counter() - inicio
+
+    return {
+        "mensajes": n_mensajes,
+        "lecturas": lecturas,
+        "formato": formato,
+        "on_message_msgs_s": round(n_mensajes / callback, 1),
+        "on_message": percentiles_ms(duraciones),
+        "guardado_msgs_s": round(n_mensajes / total, 1),
+        "guardado_lecturas_s": round(lecturas / total, 1),
+        "segundos": round(total, 3),
+        "escritas": stats["escritas"] - antes["escritas"],
+        "descartadas": stats["descartadas"] - antes["descartadas"],
+        "lotes": stats["lotes"] - antes["lotes"],
+        "errores_escritura": stats["errores_escritura"] - antes["errores_escritura"],
+    }
+
+
+def rutas_dashboard(estacion, ahora_ms):
+    """Lo que pide un dashboard: nombre de la medida -> URL."""
+    return {
+        "data": f"/data?station={estacion}",
+        "history": f"/history?station={estacion}",
+        "history_since": f"/history?station={estacion}&since={ahora_ms - 60_000}",
+        "history_1h": f"/history?station={estacion}&from={ahora_ms - 3_600_000}&max_points=300&downsample=lttb",
+        "history_24h": f"/history?station={estacion}&from={ahora_ms - 86_400_000}&max_points=300&downsample=lttb",
+        "history_7d": f"/history?station={estacion}&from={ahora_ms - 7 * 86_400_000}&max_points=300",
+        "forecast": f"/forecast?station={estacion}&horizon=10",
+    }
+
+
+def fase_rutas(S, estaciones, n_clientes, peticiones):
+    """`n_clientes` hilos con `peticiones` peticiones cada uno, repartidas entre las rutas."""
+    ahora_ms = int(time.time() * 1000)
+    tiempos = {}
+    errores = []
+    lock = threading.Lock()
+    salida = threading.Barrier(n_clientes)
+
+    def cliente(k):
+        http = S.app.test_client()
+        rutas = list(rutas_dashboard(estaciones[k % len(estaciones)], ahora_ms).items())
+        propios = {nombre: [] for nombre, _ in rutas}
+        salida.wait()
+        for i in range(peticiones):
+            nombre, url = rutas[i % len(rutas)]
+            t0 = time.perf_counter()
+            respuesta = http.get(url)
+            respuesta.get_data()
+            propios[nombre].append(time.perf_counter() - t0)
+            if respuesta.status_code != 200:
+                with lock:
+                    errores.append((url, respuesta.status_code))
+        with lock:
+            for nombre, lista in propios.items():
+                tiempos.setdefault(nombre, []).extend(lista)
+
+    hilos = [threading.Thread(target=cliente, args=(k,)) for k in range(n_clientes)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    total = time.perf_counter() - inicio
+
+    todas = [t for lista in tiempos.values() for t in lista]
+    return {
+        "clientes": n_clientes,
+        "peticiones": len(todas),
+        "peticiones_s": round(len(todas) / total, 1),
+        "errores": len(errores),
+        "total": percentiles_ms(todas),
+        "por_ruta": {nombre: percentiles_ms(lista) for nombre, lista in sorted(tiempos.items())},
+    }
+
+
+def fase_pronostico(S, estaciones, metodos, repeticiones):
+    """
+    Segundos por serie de cada método: ajuste desde cero y actualización
+    con un punto nuevo partiendo del estado anterior (lo que hace el
+    planificador en régimen normal).
+    """
+    from pronostico import VARIABLES, pronosticar
+
+    medidas = {m: {v: {"ajuste": [], "actualizacion": []} for v in VARIABLES} for m in metodos}
+    for estacion in estaciones:
+        series = S.series_pronostico(estacion)
+        for variable, (tiempos, valores) in series.items():
+            if len(valores) < 5:
+                continue
+            for metodo in metodos:
+                for _ in range(repeticiones):
+                    ajustar = lambda serie, estado: pronosticar(
+                        serie, VARIABLES[variable], estado, metodo=metodo,
+                        periodo=S.HOLT_WINTERS_PERIODO, tolerancia=S.PRONOSTICO_TOLERANCIA,
+                    )
+                    t0 = time.perf_counter()
+                    _, estado = ajustar((tiempos, valores), None)
+                    medidas[metodo][variable]["ajuste"].append(time.perf_counter() - t0)
+
+                    nueva = (list(tiempos[1:]) + [tiempos[-1] + INTERVALO_MUESTRAS],
+                             list(valores[1:]) + [valores[-1]])
+                    t0 = time.perf_counter()
+                    ajustar(nueva, estado)
+                    medidas[metodo][variable]["actualizacion"].append(time.perf_counter() - t0)
+
+    def resumen(segundos):
+        if not segundos:
+            return None
+        return {"n": len(segundos), "mediana_s": round(float(np.median(segundos)), 5),
+                "max_s": round(float(np.max(segundos)), 5)}
+
+    return {
+        metodo: {
+            variable: {tipo: resumen(lista) for tipo, lista in por_tipo.items()}
+            for variable, por_tipo in por_variable.items()
+        }
+        for metodo, por_variable in medidas.items()
+    }
+
+
+# -------------------------------------------------
+# Comparación de resultados
+# -------------------------------------------------
+def _aplanar(datos, prefijo=""):
+    if isinstance(datos, dict):
+        for clave, valor in datos.items():
+            yield from _aplanar(valor, f"{prefijo}.{clave}" if prefijo else str(clave))
+    elif isinstance(datos, (int, float)) and not isinstance(datos, bool):
+        yield prefijo, datos
+
+
+def comparar(ruta_base, ruta_nueva):
+    """Variación de cada medida (rendimiento, latencias y duraciones) entre dos resultados."""
+    with open(ruta_base, encoding="utf-8") as f:
+        base = dict(_aplanar(json.load(f)["resultados"]))
+    with open(ruta_nueva, encoding="utf-8") as f:
+        nueva = dict(_aplanar(json.load(f)["resultados"]))
+    interesantes = re.compile(r"(_s|_ms|msgs_s|lecturas_s|peticiones_s)$")
+    for clave in sorted(base.keys() & nueva.keys()):
+        if not interesantes.search(clave) or not base[clave]:
+            continue
+        cambio = (nueva[clave] - base[clave]) / base[clave] * 100
+        print(f"{clave:60s} {base[clave]:>12g} {nueva[clave]:>12g} {cambio:+8.1f}%")
+
+
+# -------------------------------------------------
+# Programa
+# -------------------------------------------------
+def argumentos(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    p.add_argument("--bd", help="URI SQLAlchemy (por defecto, SQLite temporal)")
+    p.add_argument("--limpiar", action="store_true", help="borrar lecturas y agregados antes de empezar")
+    p.add_argument("--estaciones", type=int, default=5)
+    p.add_argument("--mensajes", type=int, default=20000)
+    p.add_argument("--formato", choices=("json", "bin"), default="json")
+    p.add_argument("--muestras", type=int, default=1, help="muestras por mensaje binario")
+    p.add_argument("--origen", choices=("sintetico", "grabado"), default="sintetico")
+    p.add_argument("--historia-dias", type=float, default=1.0)
+    p.add_argument("--clientes", type=int, default=8)
+    p.add_argument("--peticiones", type=int, default=200, help="peticiones por cliente")
+    p.add_argument("--metodos", default="ewma,holt,holt_winters,arima,auto")
+    p.add_argument("--repeticiones", type=int, default=1)
+    p.add_argument("--semilla", type=int, default=1)
+    p.add_argument("--salida", help="fichero JSON de resultados (por defecto, a la salida estándar)")
+    p.add_argument("--comparar", nargs=2, metavar=("BASE", "NUEVO"), help="comparar dos resultados y salir")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = argumentos(argv)
+    if args.comparar:
+        comparar(*args.comparar)
+        return
+
+    temporal = None
+    if args.bd is None:
+        temporal = tempfile.NamedTemporaryFile(prefix="bench_iot_", suffix=".sqlite", delete=False).name
+        args.bd = f"sqlite:///{temporal}"
+
+    # El servidor se importa aquí: configura la BD y crea su cliente MQTT
+    # al importarse, así que ambos se preparan antes
+    os.environ.setdefault("IOT_LOG_NIVEL", "warning")
+    os.environ["IOT_BD_URI"] = args.bd
+    mqtt.Client = ClienteLocal
+    if args.limpiar:
+        from flask import Flask
+        import modelos
+        app = Flask(__name__)
+        modelos.configurar(app)
+        with app.app_context():
+            modelos.db.create_all()
+            modelos.db.session.execute(modelos.Rollup.__table__.delete())
+            modelos.db.session.execute(modelos.Lectura.__table__.delete())
+            modelos.db.session.commit()
+    import ServidorFlask as S
+
+    estaciones = [f"bench{i:02d}" for i in range(args.estaciones)]
+    generador = GeneradorLecturas(lecturas_grabadas(), args.origen, args.semilla)
+    metodos = [m for m in args.metodos.split(",") if m]
+
+    try:
+        resultados = {"historia": sembrar_historia(S, generador, estaciones, args.historia_dias)}
+        resultados["ingesta"] = fase_ingesta(
+            S, S.client, generador, estaciones, args.mensajes, args.formato, args.muestras,
+        )
+        resultados["rutas"] = fase_rutas(S, estaciones, args.clientes, args.peticiones)
+        resultados["pronostico"] = fase_pronostico(S, estaciones, metodos, args.repeticiones)
+    finally:
+        S.planificador.detener()
+        S.cola_ingesta.detener()
+        if temporal is not None:
+            os.remove(temporal)
+
+    salida = {
+        "formato": FORMATO_RESULTADO,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("comparar", "salida", "bd")},
+        "entorno": entorno(args.bd),
+        "resultados": resultados,
+    }
+    texto = json.dumps(salida, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
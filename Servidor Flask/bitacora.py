@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# -------------------------------------------------
+# Logs con nivel, estructurados y con límite de frecuencia
+# -------------------------------------------------
+# Todos los módulos escriben en loggers "iot.<parte>" con el mensaje como
+# plantilla y los datos en `extra`:
+#
+#   log = logging.getLogger("iot.ingesta")
+#   log.info("Lote guardado", extra={"filas": 500, "ms": 12.3})
+#
+# configurar() instala un único handler en "iot". Se controla con
+# variables de entorno:
+#
+#   IOT_LOG_NIVEL    debug | info (por defecto) | warning | error | off
+#   IOT_LOG_FORMATO  texto (por defecto) | json (una línea JSON por evento)
+#   IOT_LOG_LIMITE   eventos por plantilla y minuto (0 = sin límite)
+#
+# Con "off" el logger "iot" queda por encima de CRITICAL y cada llamada
+# se corta en isEnabledFor(), sin formatear nada.
+
+RAIZ = "iot"
+NIVELES = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "off": logging.CRITICAL + 1,
+}
+PERIODO_LIMITE = 60.0
+
+# Atributos propios de LogRecord: todo lo demás viene de `extra`
+_ESTANDAR = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "suprimidos"}
+
+
+def campos(record):
+    """Datos estructurados del evento (lo que se pasó en `extra`)."""
+    return {k: v for k, v in vars(record).items() if k not in _ESTANDAR}
+
+
+class FiltroFrecuencia(logging.Filter):
+    """
+    Deja pasar como mucho `limite` eventos por (logger, plantilla) cada
+    `periodo` segundos. El primero que pasa tras un corte lleva en
+    `suprimidos` cuántos se descartaron. Los errores no se limitan.
+    """
+
+    def __init__(self, limite, periodo=PERIODO_LIMITE):
+        super().__init__()
+        self.limite = limite
+        self.periodo = periodo
+        self._lock = threading.Lock()
+        self._ventanas = {}   # (logger, plantilla) -> [inicio, emitidos, suprimidos]
+
+    def filter(self, record):
+        if self.limite <= 0 or record.levelno >= logging.ERROR:
+            return True
+        clave = (record.name, record.msg)
+        ahora = time.monotonic()
+        with self._lock:
+            ventana = self._ventanas.get(clave)
+            if ventana is None or ahora - ventana[0] >= self.periodo:
+                suprimidos = ventana[2] if ventana is not None else 0
+                self._ventanas[clave] = [ahora, 1, 0]
+                if suprimidos:
+                    record.suprimidos = suprimidos
+                return True
+            if ventana[1] < self.limite:
+                ventana[1] += 1
+                return True
+            ventana[2] += 1
+            return False
+
+
+class FormatoTexto(logging.Formatter):
+    """2026-01-01 12:00:00 INFO iot.ingesta Lote guardado filas=500 ms=12.3"""
+
+    def format(self, record):
+        linea = f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')} {record.levelname} {record.name} {record.getMessage()}"
+        datos = campos(record)
+        if getattr(record, "suprimidos", 0):
+            datos["suprimidos"] = record.suprimidos
+        if datos:
+            linea += " " + " ".join(f"{k}={v}" for k, v in datos.items())
+        if record.exc_info:
+            linea += "\n" + self.formatException(record.exc_info)
+        return linea
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por evento: ts, level, logger, msg y los campos de `extra`."""
+
+    def format(self, record):
+        datos = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        datos.update(campos(record))
+        if getattr(record, "suprimidos", 0):
+            datos["suprimidos"] = record.suprimidos
+        if record.exc_info:
+            datos["exc"] = self.formatException(record.exc_info)
+        return json.dumps(datos, default=str, ensure_ascii=False)
+
+
+def configurar(nivel=None, formato=None, limite=None, flujo=None):
+    """
+    Instala (o reemplaza) el handler del logger "iot". Los argumentos
+    que no se indican salen de las variables de entorno.
+    """
+    nivel = (nivel or os.environ.get("IOT_LOG_NIVEL", "info")).lower()
+    formato = (formato or os.environ.get("IOT_LOG_FORMATO", "texto")).lower()
+    if limite is None:
+        limite = int(os.environ.get("IOT_LOG_LIMITE", "20"))
+    if nivel not in NIVELES:
+        raise ValueError(f"IOT_LOG_NIVEL desconocido: {nivel}")
+
+    raiz = logging.getLogger(RAIZ)
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.setLevel(NIVELES[nivel])
+    raiz.propagate = False
+
+    handler = logging.StreamHandler(flujo or sys.stderr)
+    handler.setFormatter(FormatoJSON() if formato == "json" else FormatoTexto())
+    handler.addFilter(FiltroFrecuencia(limite))
+    raiz.addHandler(handler)
+    return raiz
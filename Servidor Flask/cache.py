@@ -0,0 +1,58 @@
+import threading
+import time
+
+# -------------------------------------------------
+# Cache de la última lectura por estación
+# -------------------------------------------------
+class CacheUltimaLectura:
+    """
+    Última lectura completa de cada estación, en memoria.
+
+    La llena la ingesta (on_message) y se precarga desde la BD al arrancar,
+    así /data y / no necesitan consultar MySQL. Cada entrada ya tiene la
+    forma de la respuesta JSON; `obtener()` devuelve una copia.
+    La clave None guarda la lectura más reciente de cualquier estación.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = {}
+        self.aciertos = 0
+        self.fallos = 0
+
+    def actualizar(self, estacion, temperatura, humedad, co2, fecha, instante_ms=None, anomalias=()):
+        """
+        Guarda la lectura si es más reciente que la que ya hay.
+        `instante_ms` es el momento de la actualización (epoch en ms);
+        por defecto, ahora. `anomalias`: variables marcadas en la ingesta.
+        """
+        if instante_ms is None:
+            instante_ms = time.time() * 1000
+        entrada = {
+            "station": estacion,
+            "temperature": temperatura,
+            "humidity": humedad,
+            "co2": co2,
+            "fecha": fecha.isoformat(timespec="seconds") if fecha else None,
+            "last_update_time": instante_ms,
+            "anomalies": list(anomalias),
+        }
+        with self._lock:
+            for clave in (estacion, None):
+                actual = self._entradas.get(clave)
+                if actual is None or actual["last_update_time"] <= instante_ms:
+                    self._entradas[clave] = entrada
+
+    def obtener(self, estacion=None):
+        """Copia de la última lectura de la estación (None = cualquiera) o None."""
+        with self._lock:
+            entrada = self._entradas.get(estacion)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+            return dict(entrada)
+
+    def estaciones(self):
+        with self._lock:
+            return sorted(e for e in self._entradas if e is not None)
@@ -0,0 +1,46 @@
+import os
+
+# -------------------------------------------------
+# Configuración compartida por el servidor y el servicio de ingesta
+# -------------------------------------------------
+# ServidorFlask.py (con ingesta embebida) y servicio_ingesta.py escriben
+# las mismas filas (con la misma máscara `anomalia`), mantienen las
+# mismas particiones y el mismo archivo: lo que tiene que coincidir en
+# los dos procesos se define aquí una vez. Cada valor se puede cambiar
+# con la variable de entorno IOT_<NOMBRE> (p. ej. IOT_RETENCION_MESES=24),
+# que hay que dar igual a los dos procesos.
+
+
+def _entero(nombre, defecto):
+    return int(os.environ.get(f"IOT_{nombre}", defecto))
+
+
+def _real(nombre, defecto):
+    return float(os.environ.get(f"IOT_{nombre}", defecto))
+
+
+# Ingesta por lotes (ingesta.ColaIngesta y servicio_ingesta.py)
+INGESTA_MAX_COLA = _entero("INGESTA_MAX_COLA", 10000)           # lecturas en memoria como máximo
+INGESTA_TAM_LOTE = _entero("INGESTA_TAM_LOTE", 500)             # filas por INSERT
+INGESTA_INTERVALO = _real("INGESTA_INTERVALO", 1.0)             # s máximos antes de vaciar un lote parcial
+INGESTA_INTENTOS = _entero("INGESTA_INTENTOS", 5)               # intentos por lote antes de darlo por perdido
+INGESTA_ESPERA_REINTENTO = _real("INGESTA_ESPERA_REINTENTO", 0.5)  # s antes del primer reintento; se dobla
+INGESTA_ESPERA_MAX = _real("INGESTA_ESPERA_MAX", 10.0)          # ... hasta este tope
+
+# Anomalías (anomalias.DetectorAnomalias) y repetidas (ingesta.VentanaDuplicados)
+ANOMALIAS_VENTANA = _entero("ANOMALIAS_VENTANA", 60)            # lecturas normales por serie en la media móvil
+ANOMALIAS_UMBRAL = _real("ANOMALIAS_UMBRAL", 6.0)               # desviaciones para marcar un valor
+DUPLICADOS_VENTANA = _entero("DUPLICADOS_VENTANA", 4096)        # seq recordados por estación (512 bytes)
+
+# Retención por particiones mensuales (particiones.py)
+RETENCION_MESES = _entero("RETENCION_MESES", 12)                # meses de lecturas que se conservan
+PARTICIONES_ADELANTE = _entero("PARTICIONES_ADELANTE", 3)       # meses futuros ya creados
+MANTENIMIENTO_CADA = _entero("MANTENIMIENTO_CADA", 24 * 3600)   # s entre pasadas
+
+# Archivo Parquet de días cerrados (archivo.py)
+ARCHIVO_DIR = os.environ.get("IOT_ARCHIVO_DIR",
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "archivo"))
+ARCHIVO_CADA = _entero("ARCHIVO_CADA", 3600)                    # s entre pasadas del archivador
+ARCHIVO_MAX_DIAS = _entero("ARCHIVO_MAX_DIAS", 31)              # días archivados como mucho por pasada
+ARCHIVO_RETRASO_DIAS = _entero("ARCHIVO_RETRASO_DIAS", 1)       # días cerrados que esperan a las filas atrasadas de /batch
+EXPORT_LOTE = _entero("EXPORT_LOTE", 50000)                     # filas por bloque al archivar y exportar
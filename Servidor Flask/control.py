@@ -0,0 +1,215 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+log = logging.getLogger("iot.control")
+
+# -------------------------------------------------
+# Control masivo de estaciones
+# -------------------------------------------------
+# POST /control/bulk crea un envío y contesta enseguida (202). Un hilo lo
+# publica por un pool de `conexiones` clientes MQTT propios, en reparto
+# round-robin. Así cientos de mensajes QoS 1 no hacen cola en una sola
+# conexión ni compiten con la suscripción de las lecturas. El PUBACK de
+# cada mensaje marca su destino como confirmado, y GET
+# /control/jobs/<id> devuelve cómo va.
+#
+# Estado de cada destino (una estación, o "*" para el mensaje de grupo):
+#
+#   pending   publicado, sin PUBACK todavía (sin conexión paho lo guarda
+#             y lo manda al reconectar)
+#   acked     el broker lo ha recibido; la estación lo tendrá al estar
+#             conectada, porque el mensaje queda retenido
+#   error     paho rechazó la publicación
+#   timeout   sin PUBACK `timeout` segundos después de publicarlo
+#
+# Que la estación aplique el intervalo se ve después en /sampling.
+
+PENDIENTE, CONFIRMADO, ERROR, VENCIDO = "pending", "acked", "error", "timeout"
+ESTADOS = (PENDIENTE, CONFIRMADO, ERROR, VENCIDO)
+
+
+class EnvioControl:
+    """Un envío: mensajes (destino, topic, payload, retain) y el estado de cada destino."""
+
+    def __init__(self, mensajes, descripcion=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.creado = datetime.now()
+        self.mensajes = mensajes
+        self.descripcion = descripcion or {}
+        self.estados = {destino: PENDIENTE for destino, *_ in mensajes}
+        self.terminado = None
+
+    def _comprobar_fin(self):
+        if self.terminado is None and PENDIENTE not in self.estados.values():
+            self.terminado = datetime.now()
+
+    def resumen(self):
+        cuentas = {estado: 0 for estado in ESTADOS}
+        for estado in self.estados.values():
+            cuentas[estado] += 1
+        return {
+            "job": self.id,
+            "created_at": self.creado.isoformat(timespec="seconds"),
+            "finished_at": self.terminado.isoformat(timespec="seconds") if self.terminado else None,
+            "state": "done" if self.terminado else "running",
+            "request": self.descripcion,
+            "counts": cuentas,
+            "targets": dict(self.estados),
+        }
+
+
+class PublicadorControl:
+    """
+    Pool de clientes MQTT que publica envíos de control en segundo plano
+    y sigue sus PUBACK. Guarda los últimos `max_envios` envíos para
+    consultarlos.
+    """
+
+    def __init__(self, broker, puerto, conexiones=4, timeout=30.0, max_envios=100,
+                 prefijo="control", qos=1, keepalive=60):
+        self.broker = broker
+        self.puerto = puerto
+        self.conexiones = conexiones
+        self.timeout = timeout
+        self.max_envios = max_envios
+        self.prefijo = prefijo
+        self.qos = qos
+        self.keepalive = keepalive
+
+        self._lock = threading.Lock()
+        self._cola = queue.Queue()
+        self._parar = threading.Event()
+        self._hilo = None
+        self._clientes = []
+        self._turno = None
+        self._envios = OrderedDict()   # id -> EnvioControl
+        self._esperando = {}           # (cliente, mid) -> (envio, destino, instante de publicación)
+
+        self.envios = 0
+        self.publicados = 0
+        self.confirmados = 0
+        self.errores = 0
+        self.vencidos = 0
+
+    # --- Ciclo de vida ---
+    def iniciar(self):
+        if self._hilo is not None:
+            return
+        for i in range(self.conexiones):
+            cliente = mqtt.Client(f"{self.prefijo}-control-{i}", userdata=i)
+            cliente.on_publish = self._confirmado
+            cliente.max_inflight_messages_set(100)
+            cliente.connect_async(self.broker, self.puerto, self.keepalive)
+            cliente.loop_start()
+            self._clientes.append(cliente)
+        self._turno = itertools.cycle(range(len(self._clientes)))
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="control", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=5.0):
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+            self._hilo = None
+        for cliente in self._clientes:
+            cliente.disconnect()
+            cliente.loop_stop()
+        self._clientes = []
+
+    # --- API ---
+    def enviar(self, mensajes, descripcion=None):
+        """Encola un envío de [(destino, topic, payload, retain)] y lo devuelve."""
+        envio = EnvioControl(mensajes, descripcion)
+        with self._lock:
+            self._envios[envio.id] = envio
+            while len(self._envios) > self.max_envios:
+                self._envios.popitem(last=False)
+            self.envios += 1
+        self._cola.put(envio)
+        return envio
+
+    def obtener(self, id_envio):
+        """Resumen del envío, o None si no existe (o ya se descartó)."""
+        with self._lock:
+            envio = self._envios.get(id_envio)
+            return envio.resumen() if envio is not None else None
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "conexiones": len(self._clientes),
+                "conectadas": sum(1 for c in self._clientes if c.is_connected()),
+                "envios": self.envios,
+                "publicados": self.publicados,
+                "confirmados": self.confirmados,
+                "errores": self.errores,
+                "vencidos": self.vencidos,
+                "esperando": len(self._esperando),
+            }
+
+    # --- Hilo ---
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                envio = self._cola.get(timeout=1.0)
+            except queue.Empty:
+                envio = None
+            if envio is not None:
+                self._publicar(envio)
+            self._revisar_vencidos()
+
+    def _publicar(self, envio):
+        for destino, topic, payload, retain in envio.mensajes:
+            indice = next(self._turno)
+            # El lock cubre publish() y el registro del mid: el PUBACK
+            # (otro hilo) no puede llegar antes de que se sepa de quién es
+            with self._lock:
+                info = self._clientes[indice].publish(topic, payload, qos=self.qos, retain=retain)
+                if info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                    envio.estados[destino] = ERROR
+                    self.errores += 1
+                    continue
+                self.publicados += 1
+                if self.qos == 0:
+                    envio.estados[destino] = CONFIRMADO
+                else:
+                    self._esperando[(indice, info.mid)] = (envio, destino, time.monotonic())
+        with self._lock:
+            envio._comprobar_fin()
+        log.info("Envío de control publicado", extra={"job": envio.id, "mensajes": len(envio.mensajes)})
+
+    def _confirmado(self, cliente, indice, mid):
+        with self._lock:
+            esperado = self._esperando.pop((indice, mid), None)
+            if esperado is None:
+                return
+            envio, destino, _ = esperado
+            envio.estados[destino] = CONFIRMADO
+            self.confirmados += 1
+            envio._comprobar_fin()
+
+    def _revisar_vencidos(self):
+        ahora = time.monotonic()
+        with self._lock:
+            # Desde cada publicación, no desde que se creó el envío: en uno
+            # grande los últimos mensajes salen bastante después
+            vencidos = [
+                clave for clave, (_, _, publicado) in self._esperando.items()
+                if ahora - publicado > self.timeout
+            ]
+            for clave in vencidos:
+                envio, destino, _ = self._esperando.pop(clave)
+                envio.estados[destino] = VENCIDO
+                self.vencidos += 1
+                envio._comprobar_fin()
+        if vencidos:
+            log.warning("Mensajes de control sin confirmar", extra={"mensajes": len(vencidos)})
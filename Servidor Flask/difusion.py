@@ -0,0 +1,105 @@
+import json
+import queue
+import threading
+
+# -------------------------------------------------
+# Difusión de eventos a los navegadores (Server-Sent Events)
+# -------------------------------------------------
+CERRADA = object()   # marca de fin para una suscripción expulsada
+
+
+class Suscripcion:
+    def __init__(self, estacion, max_pendientes):
+        self.estacion = estacion
+        self.cola = queue.Queue(maxsize=max_pendientes)
+        self.activa = True
+
+    def siguiente(self, timeout):
+        """Próximo mensaje SSE ya codificado, None si venció el timeout o CERRADA."""
+        try:
+            return self.cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class HubEventos:
+    """
+    Reparte cada evento a todas las conexiones /stream abiertas.
+
+    El evento se serializa una sola vez y se deja en la cola de cada
+    suscripción. Una suscripción de estación solo recibe los eventos de
+    esa estación; la de estación None los recibe todos. Un cliente que
+    acumula `max_pendientes` mensajes sin leer se desconecta (el
+    navegador reconecta solo y recupera el hueco con /history?since=).
+    """
+
+    def __init__(self, max_pendientes=256):
+        self.max_pendientes = max_pendientes
+        self._lock = threading.Lock()
+        self._suscripciones = set()
+        self.publicados = 0
+        self.entregados = 0
+        self.expulsados = 0
+
+    def suscribir(self, estacion=None):
+        sus = Suscripcion(estacion, self.max_pendientes)
+        with self._lock:
+            self._suscripciones.add(sus)
+        return sus
+
+    def cancelar(self, sus):
+        with self._lock:
+            self._suscripciones.discard(sus)
+
+    def clientes(self):
+        with self._lock:
+            return len(self._suscripciones)
+
+    def publicar(self, tipo, datos, estacion=None):
+        with self._lock:
+            destinos = [
+                s for s in self._suscripciones
+                if s.estacion is None or s.estacion == estacion
+            ]
+        if not destinos:
+            return 0
+
+        mensaje = f"event: {tipo}\ndata: {json.dumps(datos)}\n\n"
+        entregados = 0
+        for sus in destinos:
+            try:
+                sus.cola.put_nowait(mensaje)
+                entregados += 1
+            except queue.Full:
+                self._expulsar(sus)
+        with self._lock:
+            self.publicados += 1
+            self.entregados += entregados
+        return entregados
+
+    def _expulsar(self, sus):
+        with self._lock:
+            if sus not in self._suscripciones:
+                return
+            self._suscripciones.discard(sus)
+            self.expulsados += 1
+        sus.activa = False
+        # Se vacía la cola para que quepa la marca de cierre
+        while True:
+            try:
+                sus.cola.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            sus.cola.put_nowait(CERRADA)
+        except queue.Full:
+            pass  # el generador lo verá en `activa` al siguiente timeout
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "clientes": len(self._suscripciones),
+                "publicados": self.publicados,
+                "entregados": self.entregados,
+                "expulsados": self.expulsados,
+            }
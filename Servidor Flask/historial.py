@@ -0,0 +1,151 @@
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from anomalias import variables_marcadas
+
+# -------------------------------------------------
+# Historial reciente en memoria (buffers circulares)
+# -------------------------------------------------
+class BufferCircular:
+    """
+    Ventana fija de las últimas `capacidad` lecturas de una serie, guardada
+    en arrays de NumPy preasignados. Los puntos se añaden en orden de
+    llegada, así que `t` (epoch en ms) está ordenado y las consultas
+    "desde" son una búsqueda binaria.
+
+    Un punto con `t` igual al último es el reenvío de una lectura que ya
+    está y se descarta, salvo con `iguales` (el buffer global, donde dos
+    estaciones pueden medir en el mismo instante).
+    """
+
+    def __init__(self, capacidad, iguales=False):
+        self.capacidad = capacidad
+        self.iguales = iguales
+        self._t = np.zeros(capacidad)
+        self._valores = np.zeros((capacidad, 3))  # temperatura, humedad, co2
+        self._marcas = np.zeros(capacidad, dtype=np.int16)  # máscara de anomalías
+        self._inicio = 0
+        self._n = 0
+        self.agregadas = 0   # crece con cada lectura aceptada: versión del buffer
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._n
+
+    def agregar(self, t, temperatura, humedad, co2, anomalia=0):
+        """Añade el punto; False si se descarta por repetido o fuera de orden."""
+        with self._lock:
+            if self._n:
+                ultimo = self._t[(self._inicio + self._n - 1) % self.capacidad]
+                # Fuera de orden (p. ej. la precarga tras la ingesta) o repetido
+                if t < ultimo or (t == ultimo and not self.iguales):
+                    return False
+            pos = (self._inicio + self._n) % self.capacidad
+            self._t[pos] = t
+            self._valores[pos] = (temperatura, humedad, co2)
+            self._marcas[pos] = anomalia
+            self.agregadas += 1
+            if self._n < self.capacidad:
+                self._n += 1
+            else:
+                self._inicio = (self._inicio + 1) % self.capacidad
+            return True
+
+    def _ordenados(self):
+        fin = self._inicio + self._n
+        if fin <= self.capacidad:
+            return tuple(a[self._inicio:fin].copy() for a in (self._t, self._valores, self._marcas))
+        resto = fin - self.capacidad
+        return tuple(
+            np.concatenate((a[self._inicio:], a[:resto]))
+            for a in (self._t, self._valores, self._marcas)
+        )
+
+    def ultimos(self, n):
+        """Las últimas `n` lecturas como (t, valores, marcas), en orden cronológico."""
+        with self._lock:
+            t, valores, marcas = self._ordenados()
+        return t[-n:], valores[-n:], marcas[-n:]
+
+    def desde(self, t_desde, limite=None):
+        """Lecturas con t estrictamente mayor que `t_desde` (como mucho las `limite` últimas)."""
+        with self._lock:
+            t, valores, marcas = self._ordenados()
+        i = np.searchsorted(t, t_desde, side="right")
+        t, valores, marcas = t[i:], valores[i:], marcas[i:]
+        if limite is not None:
+            t, valores, marcas = t[-limite:], valores[-limite:], marcas[-limite:]
+        return t, valores, marcas
+
+
+class HistorialReciente:
+    """
+    Un BufferCircular por estación más uno global (clave None) con la
+    mezcla de todas, igual que la vista sin estación de /history.
+    """
+
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def _buffer(self, estacion):
+        buf = self._buffers.get(estacion)
+        if buf is None:
+            with self._lock:
+                buf = self._buffers.setdefault(estacion, BufferCircular(self.capacidad, iguales=estacion is None))
+        return buf
+
+    def agregar(self, estacion, fecha, temperatura, humedad, co2, global_=True, anomalia=0):
+        """False si el buffer de la estación la descartó (y entonces tampoco va al global)."""
+        t = fecha.timestamp() * 1000
+        if not self._buffer(estacion).agregar(t, temperatura, humedad, co2, anomalia):
+            return False
+        if global_ and estacion is not None:
+            self._buffer(None).agregar(t, temperatura, humedad, co2, anomalia)
+        return True
+
+    def version(self, estacion):
+        """Lecturas aceptadas por el buffer de la estación; cambia con cada una nueva."""
+        buf = self._buffers.get(estacion)
+        return buf.agregadas if buf is not None else 0
+
+    def ultimos(self, estacion, n):
+        buf = self._buffers.get(estacion)
+        if buf is None:
+            return []
+        return serializar(*buf.ultimos(n))
+
+    def desde(self, estacion, t_desde, limite=None):
+        buf = self._buffers.get(estacion)
+        if buf is None:
+            return []
+        return serializar(*buf.desde(t_desde, limite))
+
+
+def serializar(t, valores, marcas):
+    """
+    Mismo formato que /history: lista de dicts con la hora como etiqueta,
+    `t` como cursor y las variables marcadas como anómalas en la ingesta.
+    """
+    return [
+        {
+            "t": ti,
+            "fecha": datetime.fromtimestamp(ti / 1000).strftime("%H:%M:%S"),
+            "temperatura": temp,
+            "humedad": hum,
+            "co2": co2,
+            "anomalias": variables_marcadas(marca) if marca else [],
+        }
+        for ti, (temp, hum, co2), marca in zip(t.tolist(), valores.tolist(), marcas.tolist())
+    ]
+
+
+def parsear_desde(valor):
+    """`since` como epoch en ms (el `t` del último punto recibido) o fecha ISO."""
+    try:
+        return float(valor)
+    except ValueError:
+        return datetime.fromisoformat(valor).timestamp() * 1000
@@ -0,0 +1,329 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger("iot.ingesta")
+
+# -------------------------------------------------
+# Ventana de duplicados por número de secuencia
+# -------------------------------------------------
+class VentanaDuplicados:
+    """
+    Descarta en memoria las lecturas repetidas (reintentos QoS, lotes
+    reenviados tras una reconexión) antes de que lleguen a la BD. Por
+    estación guarda el mayor seq visto y una máscara de bits con los
+    `tamano` anteriores, como la ventana anti-repetición de IPsec:
+    coste O(1) y tamano/8 bytes por estación.
+
+    repetida() solo consulta; la lectura se anota() cuando ya está en la
+    cola de ingesta, y se olvida() si su lote no llega a guardarse. Así
+    el reenvío de la estación de algo que se perdió no se toma por
+    repetido.
+
+    Las v2 no traen seq y van marcadas "deduplicar": de esas se guardan
+    las `tamano` últimas fechas por estación y se comparan por (estación,
+    fecha), igual que en la BD.
+
+    Lo que cae fuera de la ventana (muy viejo, o tras reiniciar el
+    proceso) se deja pasar y lo resuelve la clave única de la BD. El
+    resto de lecturas sin seq pasan siempre.
+    """
+
+    def __init__(self, tamano=4096, max_estaciones=10000):
+        self.tamano = tamano
+        self.max_estaciones = max_estaciones
+        self._mascara = (1 << tamano) - 1
+        self._lock = threading.Lock()   # olvidar() llega desde el hilo escritor
+        self._estaciones = {}   # estacion -> [mayor seq, bits]; bit i = mayor - i visto
+        self._fechas = {}       # estacion -> OrderedDict de fechas v2 vistas
+        self.repetidas = 0
+        self.fuera_de_ventana = 0
+
+    def repetida(self, lectura):
+        """True si el seq (o la fecha, en las v2) de la lectura ya está anotado. No anota nada."""
+        seq = lectura.get("seq")
+        if seq is None:
+            if not lectura.get("deduplicar"):
+                return False
+            with self._lock:
+                if lectura["fecha"] in self._fechas.get(lectura["estacion"], ()):
+                    self.repetidas += 1
+                    return True
+            return False
+        with self._lock:
+            estado = self._estaciones.get(lectura["estacion"])
+            if estado is None or seq > estado[0]:
+                return False
+            distancia = estado[0] - seq
+            if distancia >= self.tamano:
+                self.fuera_de_ventana += 1
+                return False
+            if estado[1] >> distancia & 1:
+                self.repetidas += 1
+                return True
+            return False
+
+    def anotar(self, lectura):
+        seq = lectura.get("seq")
+        if seq is None:
+            if lectura.get("deduplicar"):
+                self._anotar_fecha(lectura["estacion"], lectura["fecha"])
+            return
+        estacion = lectura["estacion"]
+        with self._lock:
+            estado = self._estaciones.get(estacion)
+            if estado is None:
+                if len(self._estaciones) >= self.max_estaciones:
+                    del self._estaciones[next(iter(self._estaciones))]
+                self._estaciones[estacion] = [seq, 1]
+                return
+            mayor, bits = estado
+            if seq > mayor:
+                desplazamiento = seq - mayor
+                estado[0] = seq
+                estado[1] = ((bits << desplazamiento) | 1) & self._mascara if desplazamiento < self.tamano else 1
+            elif mayor - seq < self.tamano:
+                estado[1] = bits | 1 << (mayor - seq)
+
+    def _anotar_fecha(self, estacion, fecha):
+        with self._lock:
+            fechas = self._fechas.get(estacion)
+            if fechas is None:
+                if len(self._fechas) >= self.max_estaciones:
+                    del self._fechas[next(iter(self._fechas))]
+                fechas = self._fechas[estacion] = OrderedDict()
+            fechas[fecha] = None
+            if len(fechas) > self.tamano:
+                fechas.popitem(last=False)
+
+    def olvidar(self, lectura):
+        """Quita la lectura de la ventana (su lote no se guardó)."""
+        seq = lectura.get("seq")
+        if seq is None:
+            if lectura.get("deduplicar"):
+                with self._lock:
+                    self._fechas.get(lectura["estacion"], {}).pop(lectura["fecha"], None)
+            return
+        with self._lock:
+            estado = self._estaciones.get(lectura["estacion"])
+            if estado is not None and 0 <= estado[0] - seq < self.tamano:
+                estado[1] &= ~(1 << (estado[0] - seq))
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "estaciones": len(self._estaciones.keys() | self._fechas.keys()),
+                "repetidas": self.repetidas,
+                "fuera_de_ventana": self.fuera_de_ventana,
+            }
+
+
+# -------------------------------------------------
+# Escritura de lotes con reintentos
+# -------------------------------------------------
+class LotePerdido(Exception):
+    """El lote no se pudo guardar tras todos los intentos."""
+
+
+class Reintentos:
+    """
+    Política de reintentos de un lote que falla al guardarse (BD caída,
+    deadlock), compartida por ColaIngesta y servicio_ingesta.py: hasta
+    `intentos` intentos con espera creciente (`espera`, doble cada vez,
+    como mucho `espera_max`). Tras el último, las filas cuentan como
+    perdidas, se llama a `al_perder(lote)` si se da y escribir() lanza
+    LotePerdido. Bloquea mientras espera: se llama desde un hilo.
+    """
+
+    def __init__(self, intentos=5, espera=0.5, espera_max=10.0, al_perder=None):
+        self.intentos = intentos
+        self.espera = espera
+        self.espera_max = espera_max
+        self.al_perder = al_perder
+        self._lock = threading.Lock()
+        self.errores = 0          # intentos fallidos
+        self.reintentos = 0
+        self.filas_perdidas = 0
+
+    def escribir(self, escribir_lote, lote):
+        """Devuelve lo que devuelva escribir_lote(lote); LotePerdido si no hubo forma."""
+        espera = self.espera
+        for intento in range(1, self.intentos + 1):
+            try:
+                return escribir_lote(lote)
+            except Exception as e:
+                with self._lock:
+                    self.errores += 1
+                if intento == self.intentos:
+                    with self._lock:
+                        self.filas_perdidas += len(lote)
+                    log.error("Lote perdido tras reintentar",
+                              extra={"filas": len(lote), "intentos": intento, "error": str(e)})
+                    if self.al_perder is not None:
+                        self.al_perder(lote)
+                    raise LotePerdido() from e
+                with self._lock:
+                    self.reintentos += 1
+                log.warning("Error guardando lote, se reintenta",
+                            extra={"filas": len(lote), "intento": intento, "espera_s": espera, "error": str(e)})
+                time.sleep(espera)
+                espera = min(espera * 2, self.espera_max)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "errores_escritura": self.errores,
+                "reintentos": self.reintentos,
+                "filas_fallidas": self.filas_perdidas,
+            }
+
+
+# -------------------------------------------------
+# Cola de ingesta por lotes
+# -------------------------------------------------
+class ColaIngesta:
+    """
+    Cola acotada en memoria que desacopla el callback MQTT de la BD.
+
+      - on_message solo parsea y llama a encolar(),
+      - un hilo escritor vacía la cola en lotes de hasta `tam_lote`
+        filas o cada `intervalo` segundos (lo que ocurra antes),
+      - si la cola está llena se espera `espera_encolar` segundos
+        (backpressure sobre el hilo de red de paho) y, si sigue llena,
+        la lectura se descarta y se cuenta,
+      - un lote que falla se reintenta con la política de Reintentos
+        (`intentos`, `espera_reintento`, `espera_max`); solo entonces se
+        da por perdido. Mientras, la cola sigue llenándose y aplica el
+        backpressure de arriba.
+
+    `escribir_lote` recibe una lista de dicts y debe insertarlos todos
+    en una sola transacción. Puede devolver cuántas filas insertó de
+    verdad (el resto eran repetidas); None cuenta el lote entero.
+    `al_perder(lote)`, si se da, recibe los lotes que se dan por perdidos.
+    """
+
+    def __init__(self, escribir_lote, max_cola=10000, tam_lote=500,
+                 intervalo=1.0, espera_encolar=0.05, intentos=5,
+                 espera_reintento=0.5, espera_max=10.0, al_perder=None):
+        self.escribir_lote = escribir_lote
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        self.espera_encolar = espera_encolar
+        self.politica = Reintentos(intentos, espera_reintento, espera_max, al_perder)
+        self.cola = queue.Queue(maxsize=max_cola)
+
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._hilo = None
+
+        self.encoladas = 0
+        self.descartadas = 0
+        self.esperas = 0
+        self.max_profundidad = 0
+        self.escritas = 0
+        self.repetidas = 0
+        self.lotes = 0
+
+    def encolar(self, fila):
+        """Devuelve True si la fila entró en la cola, False si se descartó."""
+        try:
+            self.cola.put_nowait(fila)
+        except queue.Full:
+            with self._lock:
+                self.esperas += 1
+            try:
+                self.cola.put(fila, timeout=self.espera_encolar)
+            except queue.Full:
+                with self._lock:
+                    self.descartadas += 1
+                return False
+
+        profundidad = self.cola.qsize()
+        with self._lock:
+            self.encoladas += 1
+            if profundidad > self.max_profundidad:
+                self.max_profundidad = profundidad
+        return True
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="escritor-ingesta", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=5.0):
+        """Para el hilo escritor después de vaciar lo que quede en la cola."""
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "profundidad": self.cola.qsize(),
+                "capacidad": self.cola.maxsize,
+                "max_profundidad": self.max_profundidad,
+                "encoladas": self.encoladas,
+                "esperas": self.esperas,
+                "descartadas": self.descartadas,
+                "escritas": self.escritas,
+                "repetidas": self.repetidas,
+                "lotes": self.lotes,
+                **self.politica.estadisticas(),
+            }
+
+    def _tomar_lote(self):
+        """Bloquea hasta tener un lote lleno o hasta que venza el intervalo."""
+        lote = []
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.tam_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.cola.get(timeout=restante))
+            except queue.Empty:
+                break
+            # Lo que ya está en la cola se toma sin esperar
+            while len(lote) < self.tam_lote:
+                try:
+                    lote.append(self.cola.get_nowait())
+                except queue.Empty:
+                    break
+        return lote
+
+    def _escribir(self, lote):
+        inicio = time.perf_counter()
+        try:
+            guardadas = self.politica.escribir(self.escribir_lote, lote)
+        except LotePerdido:
+            return
+        duracion = (time.perf_counter() - inicio) * 1000
+        if guardadas is None:
+            guardadas = len(lote)
+        with self._lock:
+            self.escritas += guardadas
+            self.repetidas += len(lote) - guardadas
+            self.lotes += 1
+        log.debug("Lote guardado", extra={"filas": len(lote), "ms": round(duracion, 1)})
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            lote = self._tomar_lote()
+            if lote:
+                self._escribir(lote)
+
+        # Al parar, se vacía lo pendiente antes de salir
+        while True:
+            lote = []
+            while len(lote) < self.tam_lote:
+                try:
+                    lote.append(self.cola.get_nowait())
+                except queue.Empty:
+                    break
+            if not lote:
+                break
+            self._escribir(lote)
@@ -0,0 +1,195 @@
+import json
+import struct
+from datetime import datetime, timedelta
+
+# -------------------------------------------------
+# Mensajes MQTT de las estaciones
+# -------------------------------------------------
+# Formato de topics y payloads, compartido por el servidor web y el
+# servicio de ingesta. Cada estación publica en estos topics:
+#
+#   iot/<estacion>/data   JSON con una lectura:
+#                         {"temperature": 21.5, "humidity": 40, "co2": 415}
+#   iot/<estacion>/bin    binario little-endian con una o varias muestras:
+#                         cabecera  u8 versión (1, 2 o 3), u8 número de muestras
+#                                   v3: + u16 arranque, u32 secuencia de la 1.ª
+#                         muestra   u32 tiempo    v1: ms entre la medida y el envío
+#                                                 v2/v3: instante de la medida (epoch, s)
+#                                   i16 temperatura en centésimas de °C
+#                                   u16 humedad en centésimas de %
+#                                   u16 co2 en ppm
+#                         (i16 -32768 / u16 65535 = sin dato)
+#   iot/<estacion>/batch  el mismo binario: lotes de muestras que la
+#                         estación guardó mientras no tenía conexión
+#
+# Una lectura JSON se fecha al llegar; una muestra v1, al llegar menos su
+# edad; una v2 o v3, con el reloj (NTP) de la estación. En v3 las
+# muestras de un mensaje son consecutivas y cada una lleva
+# seq = arranque << 32 | secuencia, creciente aunque la estación se
+# reinicie (el arranque se guarda en su flash). Con eso los reenvíos se
+# descartan en memoria (ingesta.VentanaDuplicados) y, si se escapan, en
+# el INSERT (clave única (estacion, seq, fecha)). Las v2 no tienen seq y
+# se marcan para deduplicar por (estación, fecha), en la misma ventana y
+# en modelos.guardar_filas. 10 bytes por muestra frente a ~50 del JSON, y
+# todas las muestras de un mensaje se decodifican con un solo
+# struct.iter_unpack.
+
+BROKER = "broker.emqx.io"
+PUERTO = 1883
+TOPIC_DATOS = "iot/+/data"            # una estación por nivel: iot/<estacion>/data
+TOPIC_BINARIO = "iot/+/bin"
+TOPIC_LOTE = "iot/+/batch"
+TOPICS = (TOPIC_DATOS, TOPIC_BINARIO, TOPIC_LOTE)
+TIPOS_TOPIC = ("data", "bin", "batch")
+
+VERSION_EDAD = 1                      # u32 = edad en ms
+VERSION_INSTANTE = 2                  # u32 = epoch en s del reloj de la estación
+VERSION_SECUENCIA = 3                 # como v2, con número de secuencia
+CABECERA = struct.Struct("<BB")
+SECUENCIA = struct.Struct("<HI")      # arranque, secuencia de la primera muestra (solo v3)
+MUESTRA_V1 = struct.Struct("<IhHH")   # tiempo, temperatura, humedad, co2 (igual en todas)
+SIN_TEMPERATURA = -32768
+SIN_DATO_U16 = 65535
+MAX_ADELANTO = timedelta(minutes=5)   # muestras "del futuro": reloj de la estación mal
+
+
+def estacion_de_topic(topic):
+    """iot/<estacion>/data -> <estacion> (None si el topic no sigue el formato)."""
+    partes = topic.split("/")
+    if len(partes) != 3 or not partes[1] or len(partes[1]) > 64:
+        return None
+    return partes[1]
+
+
+def tipo_de_topic(topic):
+    """"data", "bin", "batch" u "otro": etiqueta acotada para métricas."""
+    tipo = topic.rpartition("/")[2]
+    return tipo if tipo in TIPOS_TOPIC else "otro"
+
+
+def to_float_safe(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def leer_json(payload):
+    """Variables de un payload JSON como fila (temperatura, humedad, co2), None si faltan."""
+    datos = json.loads(payload.decode())
+    if not isinstance(datos, dict):
+        raise ValueError("el payload no es un objeto JSON")
+    return (
+        to_float_safe(datos.get("temperature")),
+        to_float_safe(datos.get("humidity")),
+        to_float_safe(datos.get("co2")),
+    )
+
+
+def leer_binario(payload):
+    """
+    Decodifica todas las muestras de un payload binario con un solo
+    iter_unpack. Devuelve (versión, seq de la primera muestra o None,
+    muestras), con las muestras como lista de (tiempo, temperatura,
+    humedad, co2) y None donde no hay dato; el tiempo es la edad en s
+    (v1) o el epoch en s (v2, v3).
+    """
+    if len(payload) < CABECERA.size:
+        raise ValueError("payload binario sin cabecera")
+    version, n = CABECERA.unpack_from(payload)
+    if version not in (VERSION_EDAD, VERSION_INSTANTE, VERSION_SECUENCIA):
+        raise ValueError(f"versión de payload binario no soportada: {version}")
+    inicio = CABECERA.size
+    seq = None
+    if version == VERSION_SECUENCIA:
+        if len(payload) < inicio + SECUENCIA.size:
+            raise ValueError("payload binario v3 sin secuencia")
+        arranque, secuencia = SECUENCIA.unpack_from(payload, inicio)
+        seq = arranque << 32 | secuencia
+        inicio += SECUENCIA.size
+    if len(payload) != inicio + n * MUESTRA_V1.size:
+        raise ValueError(f"payload binario de {len(payload)} bytes para {n} muestras")
+
+    escala = 1000 if version == VERSION_EDAD else 1
+    return version, seq, [
+        (
+            tiempo / escala,
+            None if temp == SIN_TEMPERATURA else temp / 100,
+            None if hum == SIN_DATO_U16 else hum / 100,
+            None if co2 == SIN_DATO_U16 else float(co2),
+        )
+        for tiempo, temp, hum, co2 in MUESTRA_V1.iter_unpack(memoryview(payload)[inicio:])
+    ]
+
+
+def leer_lecturas(topic, payload, ahora=None):
+    """
+    Lecturas de un mensaje de iot/<estacion>/data, /bin o /batch como
+    lista de dicts con estacion, temperatura, humedad, co2 (None en las
+    variables que falten) y fecha, de la más antigua a la más nueva. Las
+    v3 llevan además "seq" y las v2 "deduplicar": True. None si el topic
+    no es de una estación. Lanza ValueError si el payload no se puede
+    decodificar.
+    """
+    estacion = estacion_de_topic(topic)
+    if estacion is None:
+        return None
+    ahora = ahora or datetime.now()
+
+    if topic.endswith("/bin") or topic.endswith("/batch"):
+        version, seq, muestras = leer_binario(payload)
+        if version == VERSION_EDAD:
+            return [
+                {
+                    "estacion": estacion,
+                    "temperatura": temp,
+                    "humedad": hum,
+                    "co2": co2,
+                    "fecha": ahora - timedelta(seconds=edad) if edad else ahora,
+                }
+                for edad, temp, hum, co2 in muestras
+            ]
+        limite = ahora + MAX_ADELANTO
+        lecturas = []
+        for i, (instante, temp, hum, co2) in enumerate(muestras):
+            fecha = datetime.fromtimestamp(instante)
+            if fecha > limite:
+                continue
+            lectura = {"estacion": estacion, "temperatura": temp, "humedad": hum, "co2": co2, "fecha": fecha}
+            if seq is None:
+                lectura["deduplicar"] = True
+            else:
+                lectura["seq"] = seq + i
+            lecturas.append(lectura)
+        return lecturas
+
+    temp, hum, co2 = leer_json(payload)
+    return [{"estacion": estacion, "temperatura": temp, "humedad": hum, "co2": co2, "fecha": ahora}]
+
+
+def codificar_binario(muestras, version=VERSION_EDAD, seq=0):
+    """
+    Payload binario a partir de (tiempo, temperatura, humedad, co2), con
+    el tiempo como edad en s (v1) o epoch en s (v2, v3); None = sin dato.
+    En v3, `seq` es el de la primera muestra. Es lo que hace el firmware;
+    sirve para pruebas y para simular estaciones.
+    """
+    if len(muestras) > 255:
+        raise ValueError("como mucho 255 muestras por mensaje")
+    escala = 1000 if version == VERSION_EDAD else 1
+    partes = [CABECERA.pack(version, len(muestras))]
+    if version == VERSION_SECUENCIA:
+        partes.append(SECUENCIA.pack(seq >> 32, seq & 0xFFFFFFFF))
+    for tiempo, temp, hum, co2 in muestras:
+        partes.append(MUESTRA_V1.pack(
+            round(tiempo * escala),
+            SIN_TEMPERATURA if temp is None else round(temp * 100),
+            SIN_DATO_U16 if hum is None else round(hum * 100),
+            SIN_DATO_U16 if co2 is None else round(co2),
+        ))
+    return b"".join(partes)
+
+
+def completa(lectura):
+    """Solo las lecturas con las tres variables se guardan."""
+    return all(lectura[k] is not None for k in ("temperatura", "humedad", "co2"))
@@ -0,0 +1,170 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# -------------------------------------------------
+# Métricas en formato de texto de Prometheus
+# -------------------------------------------------
+# Contadores e histogramas en memoria, sin dependencias: el coste en el
+# camino caliente es un lock y una suma. Lo que ya cuentan otras clases
+# (cola de ingesta, cache, detector, planificador) no se duplica: se
+# registra una función que lo lee en el momento de exportar.
+#
+#   registro = RegistroMetricas("iot")
+#   mensajes = registro.contador("mqtt_messages_total", "Mensajes MQTT", ("kind",))
+#   mensajes.inc("data")
+#   registro.exportar()   # texto para GET /metrics
+
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SEGUNDOS_LARGOS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+FILAS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=""):
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(x):
+    if x == math.inf:
+        return "+Inf"
+    if isinstance(x, float) and x.is_integer():
+        return str(int(x))
+    return repr(x) if isinstance(x, float) else str(x)
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def inc(self, *etiquetas, n=1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + n
+
+    def muestras(self):
+        with self._lock:
+            valores = dict(self._valores)
+        for clave, valor in sorted(valores.items()):
+            yield self.nombre, _etiquetas(self.etiquetas, clave), valor
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.limites = tuple(sorted(limites))
+        self._lock = threading.Lock()
+        self._series = {}   # etiquetas -> [cuentas por cubo (+Inf al final), suma]
+
+    def observar(self, valor, *etiquetas):
+        i = bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.limites) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+
+    @contextmanager
+    def medir(self, *etiquetas):
+        """Observa los segundos que tarda el bloque `with`."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, *etiquetas)
+
+    def muestras(self):
+        with self._lock:
+            series = {k: (list(cuentas), suma) for k, (cuentas, suma) in self._series.items()}
+        for clave, (cuentas, suma) in sorted(series.items()):
+            acumulado = 0
+            for limite, n in zip(self.limites + (math.inf,), cuentas):
+                acumulado += n
+                le = f'le="{_numero(float(limite))}"'
+                yield f"{self.nombre}_bucket", _etiquetas(self.etiquetas, clave, le), acumulado
+            yield f"{self.nombre}_sum", _etiquetas(self.etiquetas, clave), suma
+            yield f"{self.nombre}_count", _etiquetas(self.etiquetas, clave), acumulado
+
+
+class Funcion:
+    """
+    Métrica leída al exportar: `funcion()` devuelve un número o un dict
+    {tupla de valores de etiquetas: número}.
+    """
+
+    def __init__(self, nombre, ayuda, tipo, funcion, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.tipo = tipo
+        self.funcion = funcion
+        self.etiquetas = tuple(etiquetas)
+
+    def muestras(self):
+        valores = self.funcion()
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        for clave, valor in sorted(valores.items()):
+            yield self.nombre, _etiquetas(self.etiquetas, clave), valor
+
+
+class RegistroMetricas:
+    def __init__(self, prefijo="iot"):
+        self.prefijo = prefijo
+        self._lock = threading.Lock()
+        self._metricas = {}
+
+    def _registrar(self, metrica):
+        with self._lock:
+            if metrica.nombre in self._metricas:
+                raise ValueError(f"métrica duplicada: {metrica.nombre}")
+            self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def _nombre(self, nombre):
+        return f"{self.prefijo}_{nombre}" if self.prefijo else nombre
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Contador(self._nombre(nombre), ayuda, etiquetas))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), limites=SEGUNDOS):
+        return self._registrar(Histograma(self._nombre(nombre), ayuda, etiquetas, limites))
+
+    def funcion(self, nombre, ayuda, funcion, tipo="gauge", etiquetas=()):
+        return self._registrar(Funcion(self._nombre(nombre), ayuda, tipo, funcion, etiquetas))
+
+    def exportar(self):
+        """Todas las métricas en formato de texto de Prometheus (0.0.4)."""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        lineas = []
+        for metrica in metricas:
+            try:
+                muestras = list(metrica.muestras())
+            except Exception as e:  # una función rota no tumba el resto
+                lineas.append(f"# {metrica.nombre}: error leyendo la métrica: {_escapar(e)}")
+                continue
+            lineas.append(f"# HELP {metrica.nombre} {_escapar(metrica.ayuda)}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            for nombre, etiquetas, valor in muestras:
+                lineas.append(f"{nombre}{etiquetas} {_numero(valor)}")
+        return "\n".join(lineas) + "\n"
@@ -0,0 +1,271 @@
+import os
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as SesionFlask
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import rollups
+
+# -------------------------------------------------
+# Modelos, conexiones y escritura de lecturas
+# -------------------------------------------------
+# Compartidos por el servidor web (ServidorFlask.py) y el servicio de
+# ingesta (servicio_ingesta.py): cada proceso crea su app Flask y llama a
+# configurar(app).
+#
+# Cada proceso tiene tres motores (y tres pools de conexiones):
+#
+#   por defecto  db.session de las peticiones, DDL, particiones y archivo
+#   "lectura"    los SELECT de db.session; apunta a la réplica si la hay
+#   "escritura"  el escritor de la ingesta (guardar_filas) y las demás
+#                escrituras (guardar_etiquetas), con una sesión propia; con
+#                ingesta externa, las peticiones web solo leen
+#
+# Así una consulta lenta del dashboard no deja al escritor sin conexión,
+# ni un lote grande bloquea las lecturas. Con réplica, lo recién escrito
+# puede tardar en verse según su retraso de replicación.
+#
+# Configuración por variables de entorno:
+#
+#   IOT_BD_URI             BD principal (por defecto URI_POR_DEFECTO)
+#   IOT_BD_URI_LECTURA     réplica de solo lectura (por defecto, la principal)
+#   IOT_BD_POOL            conexiones fijas de los pools de peticiones y lecturas (5)
+#   IOT_BD_POOL_EXTRA      conexiones extra en picos (10)
+#   IOT_BD_POOL_ESCRITURA  conexiones del pool del escritor (2)
+#   IOT_BD_POOL_ESPERA     s de espera por una conexión libre (10)
+#   IOT_BD_RECICLAR        s de vida de una conexión (1800; por debajo del
+#                          wait_timeout de MySQL)
+#   IOT_BD_PRE_PING        1 = comprobar la conexión antes de usarla (1)
+
+URI_POR_DEFECTO = 'mysql+pymysql://root:@localhost/estacion_iot'
+BIND_LECTURA = "lectura"
+BIND_ESCRITURA = "escritura"
+
+
+class SesionEnrutada(SesionFlask):
+    """db.session que manda los SELECT al motor de lectura y lo demás a la principal."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and getattr(clause, "is_select", False):
+            motor = self._db.engines.get(BIND_LECTURA)
+            if motor is not None:
+                return motor
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": SesionEnrutada})
+
+
+def _opciones_motor(uri, pool, extra):
+    opciones = {
+        "pool_pre_ping": os.environ.get("IOT_BD_PRE_PING", "1") == "1",
+        "pool_recycle": int(os.environ.get("IOT_BD_RECICLAR", "1800")),
+    }
+    # SQLite (pruebas, benchmark.py) no usa un pool con tamaño
+    if not uri.startswith("sqlite"):
+        opciones.update({
+            "pool_size": pool,
+            "max_overflow": extra,
+            "pool_timeout": int(os.environ.get("IOT_BD_POOL_ESPERA", "10")),
+        })
+    return opciones
+
+
+def configurar(app):
+    """Configura los tres motores en `app` (sin pisar lo que ya tenga) y llama a db.init_app."""
+    uri = os.environ.get("IOT_BD_URI", URI_POR_DEFECTO)
+    uri_lectura = os.environ.get("IOT_BD_URI_LECTURA") or uri
+    pool = int(os.environ.get("IOT_BD_POOL", "5"))
+    extra = int(os.environ.get("IOT_BD_POOL_EXTRA", "10"))
+    pool_escritura = int(os.environ.get("IOT_BD_POOL_ESCRITURA", "2"))
+
+    app.config.setdefault("SQLALCHEMY_DATABASE_URI", uri)
+    app.config.setdefault("SQLALCHEMY_TRACK_MODIFICATIONS", False)
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", _opciones_motor(uri, pool, extra))
+    app.config.setdefault("SQLALCHEMY_BINDS", {
+        BIND_LECTURA: {"url": uri_lectura, **_opciones_motor(uri_lectura, pool, extra)},
+        BIND_ESCRITURA: {"url": uri, **_opciones_motor(uri, pool_escritura, 0)},
+    })
+    db.init_app(app)
+
+
+def motor_lectura():
+    """Motor de las lecturas (réplica o principal). Necesita un contexto de aplicación."""
+    return db.engines.get(BIND_LECTURA, db.engine)
+
+
+class Lectura(db.Model):
+    __table_args__ = (
+        db.Index("ix_lectura_estacion_fecha", "estacion", "fecha"),
+        db.Index("ix_lectura_fecha", "fecha"),
+        # Reenvíos de la estación (BD/migraciones/005_secuencia.sql)
+        db.Index("ux_lectura_estacion_seq", "estacion", "seq", "fecha", unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    estacion = db.Column(db.String(64))
+    # arranque << 32 | secuencia de la estación (payload v3); NULL sin secuencia
+    seq = db.Column(db.BigInteger)
+    temperatura = db.Column(db.Float)
+    humedad = db.Column(db.Float)
+    co2 = db.Column(db.Float)
+    fecha = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    # Máscara de variables marcadas como anómalas en la ingesta (anomalias.py)
+    anomalia = db.Column(db.SmallInteger, nullable=False, default=0, server_default="0")
+
+
+class EstacionEtiqueta(db.Model):
+    """Etiquetas de estación para el control por grupos (POST /control/bulk)."""
+    __tablename__ = "estacion_etiqueta"
+    __table_args__ = (
+        db.Index("ix_estacion_etiqueta_etiqueta", "etiqueta"),
+    )
+
+    estacion = db.Column(db.String(64), primary_key=True)
+    etiqueta = db.Column(db.String(64), primary_key=True)
+
+
+def guardar_etiquetas(estacion, etiquetas):
+    """Sustituye las etiquetas de la estación, por el motor de escritura. Necesita un contexto de aplicación."""
+    motor = db.engines.get(BIND_ESCRITURA, db.engine)
+    with Session(motor) as sesion, sesion.begin():
+        sesion.query(EstacionEtiqueta).filter(EstacionEtiqueta.estacion == estacion).delete()
+        sesion.add_all(EstacionEtiqueta(estacion=estacion, etiqueta=e) for e in etiquetas)
+
+
+class Rollup(db.Model):
+    """Agregados por minuto, hora y día de `lectura` (ver rollups.py)."""
+    __tablename__ = "lectura_rollup"
+    __table_args__ = (
+        db.Index("ix_rollup_resolucion_inicio", "resolucion", "inicio"),
+    )
+
+    resolucion = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    estacion = db.Column(db.String(64), primary_key=True)
+    inicio = db.Column(db.DateTime, primary_key=True)
+    n = db.Column(db.Integer, nullable=False)
+    temp_min = db.Column(db.Float, nullable=False)
+    temp_max = db.Column(db.Float, nullable=False)
+    temp_suma = db.Column(db.Float, nullable=False)
+    hum_min = db.Column(db.Float, nullable=False)
+    hum_max = db.Column(db.Float, nullable=False)
+    hum_suma = db.Column(db.Float, nullable=False)
+    co2_min = db.Column(db.Float, nullable=False)
+    co2_max = db.Column(db.Float, nullable=False)
+    co2_suma = db.Column(db.Float, nullable=False)
+
+
+class _Repetidas(Exception):
+    """El INSERT ignoró lecturas con seq que ya estaban guardadas."""
+
+
+def sentencia_insertar_nuevas(tabla, dialecto):
+    """
+    INSERT que se salta las filas cuya clave única ya existe (sin error).
+    None si el dialecto no tiene forma de hacerlo: guardar_filas() quita
+    entonces las repetidas antes de insertar.
+    """
+    if dialecto == "mysql":
+        # IGNORE y no ON DUPLICATE KEY UPDATE: con CLIENT_FOUND_ROWS (lo
+        # activa SQLAlchemy) una fila repetida contaría como afectada
+        from sqlalchemy.dialects.mysql import insert
+        return insert(tabla).prefix_with("IGNORE")
+    if dialecto == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialecto == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert(tabla).on_conflict_do_nothing()
+
+
+def _claves_guardadas(sesion, columna, filas):
+    """(estacion, valor de `columna`) ya guardados en el rango que cubren `filas`."""
+    valores = [f[columna.key] for f in filas]
+    consulta = select(Lectura.estacion, columna).where(
+        Lectura.estacion.in_({f["estacion"] for f in filas}),
+        columna.between(min(valores), max(valores)),
+    )
+    return sesion.execute(consulta).all()
+
+
+def _sin_repetidas(sesion, filas, por_seq=False):
+    """
+    Quita del lote las lecturas ya guardadas o repetidas en el propio
+    lote: las marcadas "deduplicar" (v2, sin seq) por (estación, fecha)
+    y, con `por_seq`, las que traen seq por (estación, seq). Una consulta
+    por tipo de clave, sobre sus índices y el rango que cubre el lote.
+    """
+    por_fecha = [f for f in filas if f.get("deduplicar")]
+    con_seq = [f for f in filas if f.get("seq") is not None] if por_seq else []
+    if not por_fecha and not con_seq:
+        return filas
+    vistas = set()
+    for tipo, columna, marcadas in (("fecha", Lectura.fecha, por_fecha), ("seq", Lectura.seq, con_seq)):
+        if marcadas:
+            vistas.update((tipo, *clave) for clave in _claves_guardadas(sesion, columna, marcadas))
+
+    nuevas = []
+    for fila in filas:
+        if por_seq and fila.get("seq") is not None:
+            clave = ("seq", fila["estacion"], fila["seq"])
+        elif fila.get("deduplicar"):
+            clave = ("fecha", fila["estacion"], fila["fecha"])
+        else:
+            nuevas.append(fila)
+            continue
+        if clave in vistas:
+            continue
+        vistas.add(clave)
+        nuevas.append(fila)
+    return nuevas
+
+
+def _insertar(motor, filas, filtrar_seq):
+    with Session(motor) as sesion, sesion.begin():
+        filas = _sin_repetidas(sesion, filas, por_seq=filtrar_seq)
+        if not filas:
+            return 0
+        sentencia = sentencia_insertar_nuevas(Lectura.__table__, motor.dialect.name)
+        con_seq = [f for f in filas if f.get("seq") is not None] if sentencia is not None else []
+        sin_seq = [f for f in filas if f.get("seq") is None] if sentencia is not None else filas
+        if sin_seq:
+            sesion.bulk_insert_mappings(Lectura, sin_seq)
+        if con_seq:
+            insertadas = sesion.execute(sentencia, con_seq).rowcount
+            # Alguna ya estaba: se deshace todo para no sumarla dos veces
+            # en los agregados y se repite filtrando
+            if insertadas != len(con_seq) and not filtrar_seq:
+                raise _Repetidas()
+        agregados = rollups.agregar_lote(filas)
+        # Un lote con solo lecturas anómalas no aporta agregados (y un
+        # executemany vacío sería un INSERT ... DEFAULT VALUES)
+        if agregados:
+            rollups.acumular(sesion, Rollup.__table__, agregados)
+    return len(filas)
+
+
+def guardar_filas(filas):
+    """
+    Inserta un lote de lecturas y acumula sus agregados por minuto, hora y
+    día en una sola transacción, con una sesión propia sobre el motor de
+    escritura (no la db.session de las peticiones). Devuelve el número de
+    filas insertadas. Necesita un contexto de aplicación.
+
+    Las lecturas con seq van con un INSERT que ignora las ya guardadas
+    (clave única (estacion, seq, fecha)): sin ida y vuelta extra a la BD.
+    Si el INSERT salta alguna, la transacción se deshace y se repite
+    quitando antes las guardadas, para que los agregados no las cuenten
+    dos veces; es el caso raro, la mayoría de reenvíos ya los para
+    ingesta.VentanaDuplicados. En un dialecto sin ese INSERT se filtra
+    siempre antes.
+    """
+    motor = db.engines.get(BIND_ESCRITURA, db.engine)
+    if sentencia_insertar_nuevas(Lectura.__table__, motor.dialect.name) is None:
+        return _insertar(motor, filas, filtrar_seq=True)
+    try:
+        return _insertar(motor, filas, filtrar_seq=False)
+    except _Repetidas:
+        return _insertar(motor, filas, filtrar_seq=True)
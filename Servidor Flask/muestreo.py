@@ -0,0 +1,207 @@
+import logging
+import threading
+
+from anomalias import NOMBRES_API, SIGMA_MIN, VARIABLES, EstadisticaMovil
+
+# -------------------------------------------------
+# Muestreo adaptativo de las estaciones
+# -------------------------------------------------
+# Decide cada cuánto mide cada estación a partir de dos señales por
+# variable, en unidades de la resolución del sensor (SIGMA_MIN):
+#
+#   - error: |lectura - último pronóstico a un paso|, suavizado (EWMA)
+#   - variabilidad: desviación de las últimas `ventana` lecturas
+#
+# Manda la peor variable. Por debajo de `bajo` la señal es plana y
+# predecible: el intervalo se duplica (hasta `maximo`). Por encima de
+# `alto` (o con un solo error de más de 2 x `alto`, sin esperar al
+# suavizado) algo está cambiando: se vuelve al mínimo de golpe. Entre medias
+# no se toca (histéresis). Alargar es lento y acortar inmediato, así no
+# se pierde el comienzo de un cambio.
+#
+# El intervalo nuevo se manda con `enviar(estacion, segundos)` (mensaje
+# de control MQTT). Si la estación no lo aplica (mensaje perdido,
+# firmware viejo), el intervalo observado entre sus muestras no cuadra y
+# se reenvía, como mucho `max_reenvios` veces seguidas.
+
+log = logging.getLogger("iot.muestreo")
+
+
+class _Estacion:
+    def __init__(self, intervalo, ventana, manual):
+        self.intervalo = intervalo          # s pedidos a la estación
+        self.manual = manual                # fijado por un operador: no se toca
+        self.error = {v: None for v in VARIABLES}
+        self.series = {v: EstadisticaMovil(ventana) for v in VARIABLES}
+        self.ultima_fecha = None
+        self.observado = None               # s entre muestras (EWMA)
+        self.desde_cambio = 0               # muestras desde el último envío
+        self.reenvios = 0
+        self.puntuacion = 0.0
+        self.pico = 0.0                     # mayor error sin suavizar de la última lectura
+
+
+class ControladorMuestreo:
+    def __init__(self, enviar, minimo=10, maximo=300, bajo=0.5, alto=1.5,
+                 ventana=30, alfa=0.2, muestras_min=10, max_reenvios=3):
+        self.enviar = enviar
+        self.minimo = minimo
+        self.maximo = maximo
+        self.bajo = bajo
+        self.alto = alto
+        self.ventana = ventana
+        self.alfa = alfa
+        self.muestras_min = muestras_min
+        self.max_reenvios = max_reenvios
+        self._lock = threading.Lock()
+        self._estaciones = {}
+        self._manual_por_defecto = False
+
+        self.observadas = 0
+        self.alargados = 0
+        self.acortados = 0
+        self.reenvios = 0
+        self.errores_envio = 0
+
+    def _estacion(self, estacion):
+        estado = self._estaciones.get(estacion)
+        if estado is None:
+            estado = self._estaciones[estacion] = _Estacion(self.minimo, self.ventana, self._manual_por_defecto)
+        return estado
+
+    @staticmethod
+    def _cuadra(observado, pedido):
+        return abs(observado - pedido) < 0.25 * pedido
+
+    def _suavizar(self, anterior, valor):
+        return valor if anterior is None else (1 - self.alfa) * anterior + self.alfa * valor
+
+    def _puntuar(self, estado, lectura, pronostico):
+        puntuacion = pico = 0.0
+        for variable in VARIABLES:
+            x = lectura[variable]
+            if x is None:
+                continue
+            escala = SIGMA_MIN[variable]
+            prevision = pronostico.get(NOMBRES_API[variable]) if pronostico else None
+            if prevision is not None:
+                error = abs(x - prevision) / escala
+                pico = max(pico, error)
+                estado.error[variable] = self._suavizar(estado.error[variable], error)
+            serie = estado.series[variable]
+            serie.agregar(x)
+            puntuacion = max(puntuacion, estado.error[variable] or 0.0, serie.desviacion() / escala)
+        estado.puntuacion, estado.pico = puntuacion, pico
+
+    def _decidir(self, estado):
+        """Intervalo a enviar, o None si no hay que enviar nada."""
+        if estado.manual:
+            return None
+        cambiando = estado.puntuacion > self.alto or estado.pico > 2 * self.alto
+        if cambiando and estado.intervalo > self.minimo:
+            self.acortados += 1
+            return self.minimo
+        if estado.desde_cambio < self.muestras_min:
+            return None
+        # Solo se alarga lo que la estación ya aplica; si no, se reenvía
+        aplicado = estado.observado is not None and self._cuadra(estado.observado, estado.intervalo)
+        if not aplicado:
+            if estado.reenvios < self.max_reenvios:
+                estado.reenvios += 1
+                self.reenvios += 1
+                return estado.intervalo
+            return None
+        if estado.puntuacion < self.bajo and estado.intervalo < self.maximo:
+            self.alargados += 1
+            return min(self.maximo, estado.intervalo * 2)
+        return None
+
+    def observar(self, lectura, pronostico=None):
+        """
+        Cuenta una lectura en vivo de la estación (dict de mensajes.py) y
+        el último pronóstico publicado para ella (dict de /forecast o
+        None). Las que llegan desordenadas no cuentan. Devuelve el
+        intervalo enviado, o None.
+        """
+        estacion, fecha = lectura["estacion"], lectura["fecha"]
+        with self._lock:
+            estado = self._estacion(estacion)
+            if estado.ultima_fecha is not None:
+                hueco = (fecha - estado.ultima_fecha).total_seconds()
+                if hueco <= 0:
+                    return None
+                estado.observado = self._suavizar(estado.observado, hueco)
+                if self._cuadra(hueco, estado.intervalo):
+                    estado.reenvios = 0
+            estado.ultima_fecha = fecha
+            estado.desde_cambio += 1
+            self.observadas += 1
+            self._puntuar(estado, lectura, pronostico)
+            nuevo = self._decidir(estado)
+            if nuevo is None:
+                return None
+            estado.intervalo = nuevo
+            estado.desde_cambio = 0
+            # El primer hueco tras el cambio mezcla los dos ritmos: no cuenta
+            estado.ultima_fecha = estado.observado = None
+
+        try:
+            self.enviar(estacion, nuevo)
+        except Exception as e:
+            with self._lock:
+                self.errores_envio += 1
+            log.warning("Error enviando el intervalo", extra={"estacion": estacion, "segundos": nuevo, "error": str(e)})
+            return None
+        return nuevo
+
+    def fijar(self, estacion, segundos):
+        """Intervalo fijado por un operador (estacion=None: todas); el controlador deja de tocarlo."""
+        with self._lock:
+            if estacion is None:
+                self._manual_por_defecto = True
+                estados = list(self._estaciones.values())
+            else:
+                estados = [self._estacion(estacion)]
+            for estado in estados:
+                estado.manual = True
+                estado.intervalo = segundos
+                estado.observado = None
+
+    def automatico(self, estacion=None, segundos=None):
+        """Devuelve la estación (o todas) al control automático, desde `segundos` si se da."""
+        with self._lock:
+            if estacion is None:
+                self._manual_por_defecto = False
+                estados = list(self._estaciones.values())
+            else:
+                estados = [self._estacion(estacion)]
+            for estado in estados:
+                estado.manual = False
+                estado.desde_cambio = 0
+                if segundos is not None:
+                    estado.intervalo = segundos
+                    estado.observado = None
+
+    def estado(self):
+        """{estación: {"interval_s", "mode", "observed_s", "score"}} para la API."""
+        with self._lock:
+            return {
+                estacion: {
+                    "interval_s": e.intervalo,
+                    "mode": "manual" if e.manual else "auto",
+                    "observed_s": round(e.observado, 1) if e.observado is not None else None,
+                    "score": round(e.puntuacion, 2),
+                }
+                for estacion, e in self._estaciones.items()
+            }
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "estaciones": len(self._estaciones),
+                "observadas": self.observadas,
+                "alargados": self.alargados,
+                "acortados": self.acortados,
+                "reenvios": self.reenvios,
+                "errores_envio": self.errores_envio,
+            }
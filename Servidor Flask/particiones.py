@@ -0,0 +1,103 @@
+from datetime import date
+
+from sqlalchemy import text
+
+# -------------------------------------------------
+# Particiones mensuales de `lectura` (MySQL/MariaDB)
+# -------------------------------------------------
+# La tabla se particiona con RANGE (TO_DAYS(fecha)), una partición por mes
+# llamada pAAAAMM más una partición `pmax` con MAXVALUE (ver
+# BD/migraciones/002_particiones.sql). Borrar un mes viejo es un
+# DROP PARTITION, que no depende del número de filas.
+
+PARTICION_MAX = "pmax"
+
+
+def nombre_particion(dia):
+    return f"p{dia.year:04d}{dia.month:02d}"
+
+
+def inicio_mes(dia, desplazamiento=0):
+    """Primer día del mes de `dia` desplazado `desplazamiento` meses."""
+    total = dia.year * 12 + (dia.month - 1) + desplazamiento
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def particiones_existentes(conn, tabla="lectura"):
+    """Nombres de partición de la tabla, en orden; lista vacía si no está particionada."""
+    filas = conn.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :tabla "
+        "AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {"tabla": tabla}).fetchall()
+    return [f[0] for f in filas]
+
+
+def mes_de_particion(nombre):
+    """Primer día del mes de una partición pAAAAMM; None si el nombre no sigue el formato."""
+    if len(nombre) != 7 or not nombre.startswith("p") or not nombre[1:].isdigit():
+        return None
+    return date(int(nombre[1:5]), int(nombre[5:]), 1)
+
+
+def asegurar_particiones(conn, hoy=None, meses_adelante=3, tabla="lectura"):
+    """
+    Crea las particiones que faltan desde la última mensual existente
+    hasta `meses_adelante` meses después del actual, partiendo `pmax`
+    un mes cada vez, para que las lecturas nuevas nunca caigan en ella.
+    Con RANGE solo se puede partir la última partición, así que un hueco
+    (la migración fija los meses hasta una fecha y el servidor arranca
+    más tarde) se rellena mes a mes desde ahí; las filas que ya hubieran
+    caído en `pmax` pasan a su mes. Devuelve los nombres creados.
+    """
+    hoy = hoy or date.today()
+    existentes = particiones_existentes(conn, tabla)
+    if PARTICION_MAX not in existentes:
+        return []
+
+    meses = [m for m in map(mes_de_particion, existentes) if m is not None]
+    mes = inicio_mes(max(meses), 1) if meses else inicio_mes(hoy)
+    hasta = inicio_mes(hoy, meses_adelante)
+
+    nuevas = []
+    while mes <= hasta:
+        nombre = nombre_particion(mes)
+        limite = inicio_mes(mes, 1).isoformat()
+        conn.execute(text(
+            f"ALTER TABLE `{tabla}` REORGANIZE PARTITION {PARTICION_MAX} INTO ("
+            f"PARTITION {nombre} VALUES LESS THAN (TO_DAYS('{limite}')), "
+            f"PARTITION {PARTICION_MAX} VALUES LESS THAN MAXVALUE)"
+        ))
+        nuevas.append(nombre)
+        mes = inicio_mes(mes, 1)
+    return nuevas
+
+
+def purgar_particiones(conn, meses_retencion, hoy=None, tabla="lectura"):
+    """
+    Borra las particiones mensuales anteriores a la ventana de retención
+    (el mes actual cuenta como uno). Devuelve los nombres borrados.
+    """
+    hoy = hoy or date.today()
+    corte = nombre_particion(inicio_mes(hoy, -(meses_retencion - 1)))
+    viejas = [
+        p for p in particiones_existentes(conn, tabla)
+        if p != PARTICION_MAX and p < corte
+    ]
+    if viejas:
+        conn.execute(text(f"ALTER TABLE `{tabla}` DROP PARTITION {', '.join(viejas)}"))
+    return viejas
+
+
+def mantener(engine, meses_adelante=3, meses_retencion=12):
+    """
+    Una pasada de mantenimiento: crea los meses próximos y purga los viejos.
+    No hace nada si la BD no es MySQL o la tabla no está particionada.
+    """
+    if engine.dialect.name != "mysql":
+        return [], []
+    with engine.begin() as conn:
+        creadas = asegurar_particiones(conn, meses_adelante=meses_adelante)
+        borradas = purgar_particiones(conn, meses_retencion)
+    return creadas, borradas
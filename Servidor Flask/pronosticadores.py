@@ -0,0 +1,155 @@
+from statistics import NormalDist
+
+import numpy as np
+
+# -------------------------------------------------
+# Pronosticadores rápidos (suavizado exponencial)
+# -------------------------------------------------
+# EWMA, Holt (tendencia lineal) y Holt-Winters aditivo en forma de
+# corrección de error. Los parámetros se eligen por mínimo error cuadrático
+# a un paso sobre una rejilla: la recursión recorre la serie una sola vez
+# con todas las combinaciones de la rejilla a la vez como vectores de
+# NumPy, así que un ajuste cuesta del orden de cientos de microsegundos.
+#
+# Cada ajuste devuelve un estado (dict) que basta para pronosticar
+# cualquier horizonte con su intervalo. El modo automático los compara
+# con ARIMA fuera de muestra: ajusta sin los últimos puntos y mide el
+# error de pronosticarlos (ver pronostico._seleccionar).
+
+ALFAS = np.linspace(0.05, 0.95, 19)
+BETAS = np.array([0.01, 0.05, 0.1, 0.2, 0.3, 0.5])
+GAMMAS = np.array([0.01, 0.05, 0.1, 0.2, 0.3])
+
+
+def puntos_backtest(n):
+    """Puntos finales de la serie que se dejan fuera del ajuste para medir el error."""
+    return max(5, n // 5)
+
+
+def _rejilla(*ejes):
+    mallas = np.meshgrid(*ejes, indexing="ij")
+    return [m.ravel() for m in mallas]
+
+
+def _elegir(errores, inicio):
+    """Índice de la combinación con menor SSE (ignorando el arranque) y sus errores."""
+    sse = np.square(errores[inicio:]).sum(axis=0)
+    mejor = int(np.argmin(sse))
+    return mejor, errores[:, mejor]
+
+
+def _resumen(errores_mejor, inicio):
+    utiles = errores_mejor[inicio:]
+    return {"sigma": float(np.sqrt(np.mean(np.square(utiles)))) if len(utiles) else 0.0}
+
+
+def ajustar_ewma(y):
+    """Suavizado exponencial simple (nivel)."""
+    alfas = ALFAS
+    nivel = np.full(len(alfas), y[0])
+    errores = np.zeros((len(y), len(alfas)))
+    for i in range(1, len(y)):
+        e = y[i] - nivel
+        errores[i] = e
+        nivel = nivel + alfas * e
+    mejor, err = _elegir(errores, 1)
+    estado = {
+        "metodo": "ewma",
+        "alfa": float(alfas[mejor]),
+        "nivel": float(nivel[mejor]),
+        "descripcion": f"EWMA(α={alfas[mejor]:.2f})",
+    }
+    estado.update(_resumen(err, 1))
+    return estado
+
+
+def ajustar_holt(y):
+    """Holt: nivel + tendencia lineal."""
+    alfas, betas = _rejilla(ALFAS, BETAS)
+    paso = min(len(y) - 1, 4)
+    nivel = np.full(len(alfas), y[0])
+    tendencia = np.full(len(alfas), (y[paso] - y[0]) / paso)
+    errores = np.zeros((len(y), len(alfas)))
+    for i in range(1, len(y)):
+        e = y[i] - (nivel + tendencia)
+        errores[i] = e
+        nivel = nivel + tendencia + alfas * e
+        tendencia = tendencia + alfas * betas * e
+    mejor, err = _elegir(errores, 2)
+    estado = {
+        "metodo": "holt",
+        "alfa": float(alfas[mejor]),
+        "beta": float(betas[mejor]),
+        "nivel": float(nivel[mejor]),
+        "tendencia": float(tendencia[mejor]),
+        "descripcion": f"Holt(α={alfas[mejor]:.2f}, β={betas[mejor]:.2f})",
+    }
+    estado.update(_resumen(err, 2))
+    return estado
+
+
+def ajustar_holt_winters(y, periodo):
+    """Holt-Winters aditivo con estacionalidad de `periodo` muestras (necesita 2 periodos)."""
+    m = periodo
+    if m < 2 or len(y) < 2 * m + 2:
+        return None
+    alfas, betas, gammas = _rejilla(ALFAS[::3], BETAS, GAMMAS)
+    g = len(alfas)
+    nivel0 = y[:m].mean()
+    nivel = np.full(g, nivel0)
+    tendencia = np.full(g, (y[m:2 * m].mean() - nivel0) / m)
+    estacional = np.repeat((y[:m] - nivel0)[:, None], g, axis=1)
+    errores = np.zeros((len(y), g))
+    for i in range(m, len(y)):
+        s = estacional[i % m]
+        e = y[i] - (nivel + tendencia + s)
+        errores[i] = e
+        nivel = nivel + tendencia + alfas * e
+        tendencia = tendencia + alfas * betas * e
+        estacional[i % m] = s + gammas * (1 - alfas) * e
+    mejor, err = _elegir(errores, m + 1)
+    # Componentes estacionales en el orden de los próximos pasos
+    siguientes = [(len(y) + j) % m for j in range(m)]
+    estado = {
+        "metodo": "holt_winters",
+        "periodo": m,
+        "alfa": float(alfas[mejor]),
+        "beta": float(betas[mejor]),
+        "gamma": float(gammas[mejor]),
+        "nivel": float(nivel[mejor]),
+        "tendencia": float(tendencia[mejor]),
+        "estacional": estacional[siguientes, mejor].tolist(),
+        "descripcion": f"Holt-Winters(m={m}, α={alfas[mejor]:.2f}, β={betas[mejor]:.2f}, γ={gammas[mejor]:.2f})",
+    }
+    estado.update(_resumen(err, m + 1))
+    return estado
+
+
+def predecir(estado, horizonte, nivel):
+    """(media, inferior, superior) a `horizonte` pasos con intervalo normal de nivel `nivel`."""
+    j = np.arange(1, horizonte + 1)
+    metodo = estado["metodo"]
+    alfa = estado["alfa"]
+    if metodo == "ewma":
+        media = np.full(horizonte, estado["nivel"])
+        c = np.full(horizonte - 1, alfa)
+    else:
+        beta = estado["beta"]
+        media = estado["nivel"] + j * estado["tendencia"]
+        c = alfa * (1 + j[:-1] * beta)
+        if metodo == "holt_winters":
+            m = estado["periodo"]
+            media = media + np.resize(estado["estacional"], horizonte)
+            c = c + estado["gamma"] * (1 - alfa) * (j[:-1] % m == 0)
+    # Var(h) = sigma² (1 + sum_{i<h} c_i²)
+    varianza = np.square(estado["sigma"]) * np.concatenate(([1.0], 1 + np.cumsum(np.square(c))))
+    z = NormalDist().inv_cdf(0.5 + nivel / 2)
+    ancho = z * np.sqrt(varianza)
+    return media, media - ancho, media + ancho
+
+
+AJUSTES = {
+    "ewma": lambda y, periodo: ajustar_ewma(y),
+    "holt": lambda y, periodo: ajustar_holt(y),
+    "holt_winters": ajustar_holt_winters,
+}
@@ -0,0 +1,696 @@
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from statistics import NormalDist
+
+import numpy as np
+from pmdarima import auto_arima
+
+import pronosticadores
+
+log = logging.getLogger("iot.pronostico")
+
+# Variables que se pronostican: clave JSON -> nombre para los logs
+VARIABLES = {"temperature": "Temperatura", "humidity": "Humedad", "co2": "CO2"}
+
+# -------------------------------------------------
+# Modelo de predicción (auto-ARIMA incremental)
+# -------------------------------------------------
+# Este módulo no tiene efectos al importarse: los procesos del pool
+# solo necesitan poder importar `autoarima_forecast`.
+#
+# La búsqueda de orden de auto_arima se hace una vez por serie; después,
+# cada lectura nueva se incorpora con ARIMA.update(), que parte de los
+# parámetros ya ajustados. La búsqueda completa se repite cuando:
+#   - pasaron REBUSQUEDA_CADA segundos o REBUSQUEDA_ACTUALIZACIONES updates,
+#   - el error medio a un paso supera DEGRADACION veces el residuo del ajuste,
+#   - o la ventana ya no contiene el último punto visto (hueco en los datos).
+REBUSQUEDA_CADA = 1800
+REBUSQUEDA_ACTUALIZACIONES = 360
+DEGRADACION = 2.0
+ALFA_ERROR = 0.2   # peso de cada error nuevo en la media móvil exponencial
+
+def _auto_arima(valores):
+    return auto_arima(
+        valores,
+        seasonal=False,
+        stepwise=True,
+        error_action="ignore",
+        suppress_warnings=True,
+        max_p=5,
+        max_q=5
+    )
+
+def _estado_arima(model, ultimo_t):
+    fc = float(model.predict(n_periods=1)[0])
+    inicio = max(model.order[1], 1)
+    residuos = np.abs(model.resid()[inicio:])
+    error_base = float(residuos.mean()) if len(residuos) else 0.0
+    return fc, {
+        "metodo": "arima",
+        "descripcion": f"ARIMA{model.order}",
+        "modelo": model,
+        "ultimo_t": ultimo_t,
+        "ajustado_en": time.time(),
+        "actualizaciones": 0,
+        "error_base": error_base,
+        "error_medio": error_base,
+        "prediccion": fc,
+    }
+
+def _busqueda_completa(tiempos, valores, nombre):
+    fc, estado = _estado_arima(_auto_arima(valores), float(tiempos[-1]))
+    log.debug("auto-ARIMA búsqueda completa", extra={"serie": nombre, "modelo": estado["descripcion"], "prediccion": fc})
+    return fc, estado
+
+def _necesita_busqueda(estado, tiempos):
+    if estado is None or estado["ultimo_t"] < tiempos[0]:
+        return True
+    if time.time() - estado["ajustado_en"] > REBUSQUEDA_CADA:
+        return True
+    if estado["actualizaciones"] >= REBUSQUEDA_ACTUALIZACIONES:
+        return True
+    return estado["error_medio"] > DEGRADACION * max(estado["error_base"], 1e-9)
+
+def _valores_validos(series):
+    """
+    (tiempos, valores) como arrays float sin los huecos (None o NaN).
+    Con arrays ya limpios, como los de series_pronostico, se devuelven
+    los mismos sin copiar.
+    """
+    tiempos, valores = series
+    tiempos = np.asarray(tiempos, dtype=float)
+    valores = np.asarray(valores, dtype=float)   # None -> NaN
+    validos = ~np.isnan(valores)
+    if validos.all():
+        return tiempos, valores
+    return tiempos[validos], valores[validos]
+
+def _constante(valores):
+    return valores.min() == valores.max()
+
+def autoarima_forecast(series, nombre="", estado=None):
+    """
+    Pronóstico a un paso de `series` = (tiempos, valores).
+    `estado` es lo que devolvió la llamada anterior para la misma serie;
+    devuelve (predicción o None, estado nuevo o None).
+    """
+    tiempos, valid = _valores_validos(series)
+
+    if len(valid) < 5:
+        log.info("Muy pocos datos válidos para auto-ARIMA", extra={"serie": nombre, "n": len(valid)})
+        return None, None
+
+    if _constante(valid):
+        log.debug("Serie casi constante", extra={"serie": nombre, "prediccion": float(valid[-1])})
+        return float(valid[-1]), None
+
+    try:
+        if _necesita_busqueda(estado, tiempos):
+            return _busqueda_completa(tiempos, valid, nombre)
+
+        nuevos = valid[tiempos > estado["ultimo_t"]]
+        if not len(nuevos):
+            return estado["prediccion"], estado
+
+        # Error a un paso del pronóstico anterior contra lo que llegó
+        error = abs(nuevos[0] - estado["prediccion"])
+        estado = dict(estado)
+        estado["error_medio"] = (1 - ALFA_ERROR) * estado["error_medio"] + ALFA_ERROR * error
+
+        model = estado["modelo"]
+        model.update(nuevos)
+        fc = float(model.predict(n_periods=1)[0])
+        estado.update({
+            "ultimo_t": float(tiempos[-1]),
+            "actualizaciones": estado["actualizaciones"] + len(nuevos),
+            "prediccion": fc,
+        })
+        log.debug("auto-ARIMA update", extra={"serie": nombre, "nuevos": len(nuevos), "orden": model.order, "prediccion": fc})
+        return fc, estado
+    except Exception as e:
+        log.warning("Error en auto_arima", extra={"serie": nombre, "error": str(e)})
+        return None, None
+
+# -------------------------------------------------
+# Pronosticador por variable
+# -------------------------------------------------
+# METODOS: "arima", los rápidos de pronosticadores.py ("ewma", "holt",
+# "holt_winters") o "auto", que compara todos contra ARIMA en un backtest
+# fuera de muestra y se queda con el más barato cuyo error no supere en
+# más de `tolerancia` (relativa) al de ARIMA. La elección se revisa cada
+# REBUSQUEDA_CADA segundos. Si la serie no deja MIN_ENTRENAMIENTO puntos
+# para ajustar sin los de prueba, no hay backtest y se usa EWMA.
+METODOS = ("auto", "arima") + tuple(pronosticadores.AJUSTES)
+RAPIDOS = tuple(pronosticadores.AJUSTES)   # de más barato a más caro
+MIN_ENTRENAMIENTO = 10
+
+def _rapido(metodo, valores, periodo, nombre):
+    estado = pronosticadores.AJUSTES[metodo](valores, periodo)
+    if estado is None:
+        return None, None
+    fc = float(pronosticadores.predecir(estado, 1, 0.95)[0][0])
+    log.debug("Pronóstico rápido", extra={"serie": nombre, "modelo": estado["descripcion"], "prediccion": fc})
+    return fc, estado
+
+def _seleccionar(tiempos, valores, nombre, periodo, tolerancia):
+    """
+    Backtest fuera de muestra: cada candidato se ajusta sin los últimos k
+    puntos y se mide el MAE de su pronóstico a k pasos contra ellos. El
+    elegido se vuelve a ajustar con la serie entera.
+    """
+    n = len(valores)
+    k = pronosticadores.puntos_backtest(n)
+    if n - k < MIN_ENTRENAMIENTO:
+        fc, estado = _rapido("ewma", valores, periodo, nombre)
+        log.info("auto sin backtest, serie corta", extra={"serie": nombre, "n": n, "prediccion": fc})
+        return "ewma", fc, estado, {}
+    entrenamiento, prueba = valores[:n - k], valores[n - k:]
+    model = _auto_arima(entrenamiento)
+    mae_arima = float(np.mean(np.abs(prueba - np.asarray(model.predict(n_periods=k)))))
+
+    errores = {"arima": mae_arima}
+    for metodo in RAPIDOS:
+        ajuste = pronosticadores.AJUSTES[metodo](entrenamiento, periodo)
+        if ajuste is None:
+            continue
+        errores[metodo] = float(np.mean(np.abs(prueba - pronosticadores.predecir(ajuste, k, 0.95)[0])))
+        if errores[metodo] <= (1 + tolerancia) * mae_arima:
+            estado = pronosticadores.AJUSTES[metodo](valores, periodo)
+            fc = float(pronosticadores.predecir(estado, 1, 0.95)[0][0])
+            log.info("auto elige modelo", extra={"serie": nombre, "modelo": estado["descripcion"], "mae": errores, "prediccion": fc})
+            return metodo, fc, estado, errores
+
+    # Mismo orden, coeficientes reajustados con los puntos de prueba
+    model.update(prueba)
+    fc, estado = _estado_arima(model, float(tiempos[-1]))
+    log.info("auto elige modelo", extra={"serie": nombre, "modelo": estado["descripcion"], "mae": errores, "prediccion": fc})
+    return "arima", fc, estado, errores
+
+def pronosticar(series, nombre="", estado=None, metodo="arima", periodo=0, tolerancia=0.1):
+    """
+    Pronóstico a un paso con el método configurado para la variable.
+    Misma interfaz que autoarima_forecast: devuelve (predicción o None, estado).
+    """
+    if metodo == "arima":
+        return autoarima_forecast(series, nombre, estado)
+
+    tiempos, valores = _valores_validos(series)
+    if len(valores) < 5:
+        log.info("Muy pocos datos válidos para pronosticar", extra={"serie": nombre, "n": len(valores)})
+        return None, None
+    if _constante(valores):
+        log.debug("Serie casi constante", extra={"serie": nombre, "prediccion": float(valores[-1])})
+        return float(valores[-1]), None
+
+    try:
+        if metodo in RAPIDOS:
+            return _rapido(metodo, valores, periodo, nombre)
+
+        # metodo == "auto"
+        vigente = (
+            estado is not None
+            and time.time() - estado["elegido_en"] <= REBUSQUEDA_CADA
+        )
+        if vigente:
+            elegido = estado["elegido"]
+            if elegido == "arima":
+                fc, interno = autoarima_forecast((tiempos, valores), nombre, estado["interno"])
+            else:
+                fc, interno = _rapido(elegido, valores, periodo, nombre)
+        else:
+            elegido, fc, interno, errores = _seleccionar(tiempos, valores, nombre, periodo, tolerancia)
+            # Sin backtest (serie corta) se vuelve a elegir en la próxima pasada
+            estado = {"metodo": "auto", "elegido_en": time.time() if errores else 0, "mae": errores}
+        if interno is None:
+            return fc, None
+        estado = dict(estado, elegido=elegido, interno=interno,
+                      descripcion=f"auto: {interno['descripcion']}")
+        return fc, estado
+    except Exception as e:
+        log.warning("Error pronosticando", extra={"serie": nombre, "metodo": metodo, "error": str(e)})
+        return None, None
+
+def trayectoria(estado, valor, horizonte, nivel):
+    """
+    Pronóstico a `horizonte` pasos con su intervalo de confianza `nivel`,
+    sacado del modelo ya ajustado (solo predict, sin reajustar).
+    Una serie constante da un camino plano; sin pronóstico, None.
+    """
+    if valor is None:
+        return None
+    if estado is None:
+        camino = [valor] * horizonte
+        return {"mean": camino, "lower": camino, "upper": camino}
+    if estado["metodo"] == "auto":
+        return trayectoria(estado["interno"], valor, horizonte, nivel)
+    if estado["metodo"] == "arima":
+        media, intervalo = estado["modelo"].predict(
+            n_periods=horizonte, return_conf_int=True, alpha=1 - nivel
+        )
+        intervalo = np.asarray(intervalo)
+        inferior, superior = intervalo[:, 0], intervalo[:, 1]
+    else:
+        media, inferior, superior = pronosticadores.predecir(estado, horizonte, nivel)
+    return {
+        "mean": np.asarray(media, dtype=float).tolist(),
+        "lower": np.asarray(inferior, dtype=float).tolist(),
+        "upper": np.asarray(superior, dtype=float).tolist(),
+    }
+
+# -------------------------------------------------
+# Planificador de pronósticos en segundo plano
+# -------------------------------------------------
+class PlanificadorPronosticos:
+    """
+    Recalcula los pronósticos fuera de las peticiones HTTP y guarda el
+    último resultado de cada estación.
+
+      - la ingesta llama a marcar(estacion) cuando llega una lectura,
+      - un hilo recalcula las estaciones marcadas, como mucho una vez cada
+        `min_intervalo` segundos por estación,
+      - cada `max_intervalo` segundos se recalculan todas las conocidas
+        aunque no hayan recibido datos,
+      - /forecast solo lee `obtener(estacion)`.
+
+    Cada (estación, variable) es un trabajo independiente que se ajusta en
+    un pool de `procesos` procesos (0 = en el propio hilo del planificador).
+    Al pool se envían como mucho tantos trabajos como procesos y nunca dos
+    de la misma serie a la vez; el resto espera en una cola propia donde un
+    trabajo más nuevo de la misma serie sustituye al viejo. Un trabajo que
+    supera `timeout` segundos se da por perdido y su resultado se descarta;
+    si todos los procesos están ocupados con trabajos vencidos, el pool se
+    reemplaza por uno nuevo.
+
+    `al_publicar(estacion, resultado)`, si se indica, se llama con cada
+    pronóstico publicado (fuera del lock); `al_ajustar(variable, segundos)`,
+    con la duración de cada ajuste terminado (con o sin error).
+
+    `obtener_series(estacion)` devuelve {variable: (tiempos, valores)} y se
+    ejecuta en el hilo del planificador. `ajustar(serie, nombre, estado)`
+    (una función, o un dict {variable: función}) se ejecuta en el pool y
+    devuelve (valor pronosticado o None, estado); el estado (p. ej. el
+    modelo ajustado) se guarda aquí por serie y se pasa al siguiente
+    trabajo de esa serie.
+    """
+
+    def __init__(self, obtener_series, ajustar=autoarima_forecast, procesos=None,
+                 timeout=120.0, min_intervalo=30.0, max_intervalo=300.0, al_publicar=None,
+                 al_ajustar=None):
+        self.obtener_series = obtener_series
+        self.al_publicar = al_publicar
+        self.al_ajustar = al_ajustar
+        if not isinstance(ajustar, dict):
+            ajustar = {variable: ajustar for variable in VARIABLES}
+        self.ajustar = ajustar
+        self.procesos = (os.cpu_count() or 1) if procesos is None else procesos
+        self.timeout = timeout
+        self.min_intervalo = min_intervalo
+        self.max_intervalo = max_intervalo
+
+        # Reentrante: cancelar futuros puede disparar _terminado en este mismo hilo
+        self._lock = threading.RLock()
+        self._hay_trabajo = threading.Event()
+        self._parar = threading.Event()
+        self._hilo = None
+        self._pool = None
+
+        self._pendientes = set()
+        self._ultimo_calculo = {}        # estacion -> time.monotonic()
+        self._resultados = {}            # estacion -> dict publicado
+        self._version = 0
+
+        self._estados = {}               # (estacion, variable) -> estado del modelo
+        self._cola = OrderedDict()       # (estacion, variable) -> serie
+        self._en_curso = {}              # future -> ((estacion, variable), inicio)
+        self._atascados = set()          # futuros vencidos que aún ocupan un proceso
+        self._trayectorias = {}          # (estacion, horizonte, nivel) -> (version, caminos)
+
+        self.calculos = 0
+        self.errores = 0
+        self.vencidos = 0
+        self.reemplazados = 0
+        self.reinicios_pool = 0
+        self.trayectorias_aciertos = 0
+        self.trayectorias_fallos = 0
+
+    def marcar(self, estacion):
+        with self._lock:
+            self._pendientes.add(estacion)
+        self._hay_trabajo.set()
+
+    def obtener(self, estacion):
+        """Último pronóstico publicado para la estación, o None si aún no hay."""
+        with self._lock:
+            resultado = self._resultados.get(estacion)
+            return dict(resultado) if resultado is not None else None
+
+    def obtener_trayectorias(self, estacion, horizonte, nivel):
+        """
+        Caminos {variable: {mean, lower, upper}} del último pronóstico de la
+        estación. Se calculan con los modelos guardados una vez por versión
+        publicada y combinación (horizonte, nivel); después salen de memoria.
+        """
+        with self._lock:
+            resultado = self._resultados.get(estacion)
+            if resultado is None:
+                return None
+            clave = (estacion, horizonte, nivel)
+            cacheado = self._trayectorias.get(clave)
+            if cacheado is not None and cacheado[0] == resultado["version"]:
+                self.trayectorias_aciertos += 1
+                return cacheado[1]
+            self.trayectorias_fallos += 1
+            estados = {v: self._estados.get((estacion, v)) for v in VARIABLES}
+
+        caminos = {}
+        for variable in VARIABLES:
+            try:
+                caminos[variable] = trayectoria(estados[variable], resultado[variable], horizonte, nivel)
+            except Exception as e:
+                log.warning("Error calculando trayectoria", extra={"estacion": estacion, "variable": variable, "error": str(e)})
+                caminos[variable] = None
+
+        with self._lock:
+            self._trayectorias[clave] = (resultado["version"], caminos)
+        return caminos
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        if self.procesos > 0 and self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.procesos)
+        self._hilo = threading.Thread(target=self._bucle, name="pronosticos", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=5.0):
+        self._parar.set()
+        self._hay_trabajo.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "procesos": self.procesos,
+                "pendientes": len(self._pendientes),
+                "en_cola": len(self._cola),
+                "en_curso": len(self._en_curso),
+                "estaciones": len(self._resultados),
+                "version": self._version,
+                "calculos": self.calculos,
+                "errores": self.errores,
+                "vencidos": self.vencidos,
+                "reemplazados": self.reemplazados,
+                "modelos": len(self._estados),
+                "reinicios_pool": self.reinicios_pool,
+                "trayectorias_aciertos": self.trayectorias_aciertos,
+                "trayectorias_fallos": self.trayectorias_fallos,
+            }
+
+    # --- planificación -------------------------------------------------
+
+    def _listas(self, ahora):
+        """Estaciones a recalcular ahora y segundos hasta la próxima que toque."""
+        listas, espera = [], self.max_intervalo
+        with self._lock:
+            conocidas = set(self._ultimo_calculo) | self._pendientes
+            for estacion in conocidas:
+                ultimo = self._ultimo_calculo.get(estacion)
+                if ultimo is None:
+                    listas.append(estacion)
+                    continue
+                transcurrido = ahora - ultimo
+                if estacion in self._pendientes:
+                    falta = self.min_intervalo - transcurrido
+                else:
+                    falta = self.max_intervalo - transcurrido
+                if falta <= 0:
+                    listas.append(estacion)
+                else:
+                    espera = min(espera, falta)
+            for estacion in listas:
+                self._pendientes.discard(estacion)
+                self._ultimo_calculo[estacion] = ahora
+        return listas, espera
+
+    def _crear_trabajos(self, estacion):
+        try:
+            series = self.obtener_series(estacion)
+        except Exception as e:
+            with self._lock:
+                self.errores += 1
+            log.warning("Error leyendo series", extra={"estacion": estacion, "error": str(e)})
+            return
+
+        for variable, serie in series.items():
+            if not len(serie[1]):
+                self._publicar(estacion, variable, None)
+                continue
+            clave = (estacion, variable)
+            with self._lock:
+                # Reemplazar conserva el turno del trabajo viejo en la cola
+                if clave in self._cola:
+                    self.reemplazados += 1
+                self._cola[clave] = serie
+
+    # --- ejecución -------------------------------------------------------
+
+    def _siguiente(self, ocupadas):
+        """Saca de la cola el trabajo más antiguo cuya serie no esté en curso."""
+        for clave in self._cola:
+            if clave not in ocupadas:
+                return clave, self._cola.pop(clave), self._estados.get(clave)
+        return None
+
+    def _despachar(self):
+        """Envía trabajos de la cola al pool hasta ocupar todos los procesos."""
+        while True:
+            with self._lock:
+                libres = self.procesos - len(self._en_curso) - len(self._atascados)
+                if not self._cola or libres <= 0:
+                    return
+                siguiente = self._siguiente({c for c, _ in self._en_curso.values()})
+                if siguiente is None:
+                    return
+                clave, serie, estado = siguiente
+                try:
+                    futuro = self._pool.submit(self.ajustar[clave[1]], serie, VARIABLES.get(clave[1], clave[1]), estado)
+                except BrokenProcessPool as e:
+                    self._cola[clave] = serie
+                    self._cola.move_to_end(clave, last=False)
+                    log.error("Pool de pronósticos roto, se reemplaza", extra={"error": str(e)})
+                    self._reiniciar_pool()
+                    return
+                except RuntimeError:
+                    return  # el intérprete se está cerrando
+                self._en_curso[futuro] = (clave, time.monotonic())
+            futuro.add_done_callback(self._terminado)
+
+    def _terminado(self, futuro):
+        """Callback del pool: guarda el estado del modelo y publica el resultado."""
+        with self._lock:
+            info = self._en_curso.pop(futuro, None)
+            self._atascados.discard(futuro)
+        self._hay_trabajo.set()
+        if info is None or futuro.cancelled():
+            return  # vencido o de un pool ya reemplazado
+        (estacion, variable), inicio = info
+        self._medido(variable, time.monotonic() - inicio)
+        try:
+            valor, estado = futuro.result()
+        except Exception as e:
+            with self._lock:
+                self.errores += 1
+            log.warning("Error en pronóstico", extra={"estacion": estacion, "variable": variable, "error": str(e)})
+            return
+        self._guardar_estado((estacion, variable), estado)
+        self._publicar(estacion, variable, valor, estado)
+
+    def _guardar_estado(self, clave, estado):
+        with self._lock:
+            if estado is None:
+                self._estados.pop(clave, None)
+            else:
+                self._estados[clave] = estado
+
+    def _revisar_vencidos(self, ahora):
+        """Descarta los trabajos que pasaron de `timeout`; devuelve segundos hasta el próximo vencimiento."""
+        espera = None
+        with self._lock:
+            vencidos = []
+            for futuro, (clave, inicio) in self._en_curso.items():
+                falta = inicio + self.timeout - ahora
+                if falta <= 0:
+                    vencidos.append(futuro)
+                else:
+                    espera = falta if espera is None else min(espera, falta)
+            for futuro in vencidos:
+                clave = self._en_curso.pop(futuro)[0]
+                self._atascados.add(futuro)
+                self.vencidos += 1
+                log.warning("Pronóstico vencido, se descarta",
+                            extra={"estacion": clave[0], "variable": clave[1], "timeout_s": self.timeout})
+            # Los procesos que siguen con trabajos vencidos no quedan libres
+            if len(self._atascados) >= self.procesos:
+                self._reiniciar_pool()
+        return espera
+
+    def _reiniciar_pool(self):
+        """Reemplaza el pool (llamar con el lock tomado)."""
+        viejo = self._pool
+        self._pool = ProcessPoolExecutor(max_workers=self.procesos)
+        self._en_curso.clear()
+        self._atascados.clear()
+        self.reinicios_pool += 1
+        if viejo is not None:
+            viejo.shutdown(wait=False, cancel_futures=True)
+
+    def _ejecutar_en_linea(self):
+        """Sin pool (procesos=0): ajusta la cola en el hilo del planificador."""
+        while not self._parar.is_set():
+            with self._lock:
+                siguiente = self._siguiente(set())
+            if siguiente is None:
+                return
+            (estacion, variable), serie, estado = siguiente
+            # update() modifica el modelo; sin pool se trabaja sobre una copia
+            # para no tocar el que usa obtener_trayectorias
+            estado = copy.deepcopy(estado)
+            inicio = time.monotonic()
+            try:
+                valor, estado = self.ajustar[variable](serie, VARIABLES.get(variable, variable), estado)
+            except Exception as e:
+                with self._lock:
+                    self.errores += 1
+                log.warning("Error en pronóstico", extra={"estacion": estacion, "variable": variable, "error": str(e)})
+                continue
+            finally:
+                self._medido(variable, time.monotonic() - inicio)
+            self._guardar_estado((estacion, variable), estado)
+            self._publicar(estacion, variable, valor, estado)
+
+    def _medido(self, variable, segundos):
+        if self.al_ajustar is not None:
+            try:
+                self.al_ajustar(variable, segundos)
+            except Exception as e:
+                log.warning("Error registrando la duración del ajuste", extra={"variable": variable, "error": str(e)})
+
+    def _publicar(self, estacion, variable, valor, estado=None):
+        if estado is not None:
+            descripcion = estado.get("descripcion")
+        else:
+            descripcion = "constante" if valor is not None else None
+        with self._lock:
+            self._version += 1
+            self.calculos += 1
+            resultado = dict(self._resultados.get(estacion) or {v: None for v in VARIABLES})
+            modelos = dict(resultado.get("models") or {v: None for v in VARIABLES})
+            modelos[variable] = descripcion
+            resultado.update({
+                variable: valor,
+                "station": estacion,
+                "models": modelos,
+                # Por estación: el ETag de /forecast no cambia con las demás
+                "version": resultado.get("version", 0) + 1,
+                "generated_at": datetime.now().isoformat(timespec="seconds"),
+            })
+            self._resultados[estacion] = resultado
+        log.debug("Pronóstico publicado", extra={"estacion": estacion, "variable": variable, "valor": valor})
+        if self.al_publicar is not None:
+            try:
+                self.al_publicar(estacion, dict(resultado))
+            except Exception as e:
+                log.warning("Error avisando del pronóstico", extra={"estacion": estacion, "variable": variable, "error": str(e)})
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            self._hay_trabajo.clear()
+            ahora = time.monotonic()
+            listas, espera = self._listas(ahora)
+            for estacion in listas:
+                self._crear_trabajos(estacion)
+
+            if self.procesos > 0:
+                vence = self._revisar_vencidos(ahora)
+                self._despachar()
+                if vence is not None:
+                    espera = min(espera, vence)
+            else:
+                self._ejecutar_en_linea()
+
+            self._hay_trabajo.wait(espera)
+
+
+# -------------------------------------------------
+# Pronósticos recibidos de otro proceso
+# -------------------------------------------------
+class PronosticosRecibidos:
+    """
+    Lado de lectura de PlanificadorPronosticos para los procesos que no
+    calculan pronósticos (workers web con ingesta externa): guarda los que
+    publica por MQTT el proceso que sí los calcula, cada uno con sus
+    caminos a `horizonte` pasos y nivel `nivel`.
+
+    Un camino más corto es el principio del largo, y las bandas de todos
+    los modelos son normales y simétricas, así que las de otro nivel salen
+    de reescalar el ancho por el cociente de los cuantiles.
+    """
+
+    def __init__(self, horizonte, nivel):
+        self.horizonte = horizonte
+        self.nivel = nivel
+        self._z = NormalDist().inv_cdf(0.5 + nivel / 2)
+        self._lock = threading.Lock()
+        self._resultados = {}   # estacion -> (resultado sin caminos, caminos)
+        self.recibidos = 0
+
+    def recibir(self, estacion, resultado):
+        caminos = resultado.pop("paths", None) or {}
+        with self._lock:
+            self._resultados[estacion] = (resultado, caminos)
+            self.recibidos += 1
+
+    def marcar(self, estacion):
+        pass   # lo calcula otro proceso
+
+    def obtener(self, estacion):
+        with self._lock:
+            guardado = self._resultados.get(estacion)
+        return dict(guardado[0]) if guardado is not None else None
+
+    def obtener_trayectorias(self, estacion, horizonte, nivel):
+        with self._lock:
+            guardado = self._resultados.get(estacion)
+        if guardado is None:
+            return None
+        factor = NormalDist().inv_cdf(0.5 + nivel / 2) / self._z
+        caminos = {}
+        for variable in VARIABLES:
+            camino = guardado[1].get(variable)
+            if camino is None:
+                caminos[variable] = None
+                continue
+            media = np.asarray(camino["mean"][:horizonte], dtype=float)
+            ancho = (np.asarray(camino["upper"][:horizonte], dtype=float) - media) * factor
+            caminos[variable] = {
+                "mean": media.tolist(),
+                "lower": (media - ancho).tolist(),
+                "upper": (media + ancho).tolist(),
+            }
+        return caminos
+
+    def estadisticas(self):
+        with self._lock:
+            return {"estaciones": len(self._resultados), "recibidos": self.recibidos}
@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+from datetime import datetime, timezone
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se comprime con gzip
+    brotli = None
+
+# -------------------------------------------------
+# Caché HTTP y compresión de respuestas
+# -------------------------------------------------
+# - condicional(): ETag (débil) y Last-Modified a partir de la versión de
+#   los datos (última lectura, pronóstico publicado); si el navegador ya
+#   tiene esa versión se contesta 304 sin construir el cuerpo.
+# - comprimir(): after_request que comprime JSON, HTML y texto con brotli
+#   o gzip según Accept-Encoding.
+# - PaginaEstatica: un cuerpo fijo (la página del dashboard) comprimido
+#   una sola vez al arrancar.
+
+COMPRIMIR_MIN_BYTES = 512      # por debajo, la cabecera cuesta más de lo que se ahorra
+NIVEL_GZIP = 5
+CALIDAD_BROTLI = 4             # rápida para respuestas dinámicas
+CALIDAD_BROTLI_ESTATICA = 11   # máxima para lo que se comprime una sola vez
+TIPOS_COMPRIMIBLES = {"application/json", "text/html", "text/plain", "text/csv"}
+
+
+def codificaciones():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def codificacion_aceptada():
+    """'br', 'gzip' o None según el Accept-Encoding de la petición."""
+    return request.accept_encodings.best_match(codificaciones())
+
+
+def _comprimir(datos, codificacion, calidad_brotli=CALIDAD_BROTLI):
+    if codificacion == "br":
+        return brotli.compress(datos, quality=calidad_brotli)
+    return gzip.compress(datos, compresslevel=NIVEL_GZIP, mtime=0)
+
+
+def instante_http(epoch_ms):
+    """Epoch en ms -> datetime UTC a la resolución de Last-Modified (segundos)."""
+    if epoch_ms is None:
+        return None
+    return datetime.fromtimestamp(int(epoch_ms // 1000), tz=timezone.utc)
+
+
+def no_modificado(etag, modificado=None):
+    """True si la petición ya tiene esta versión (If-None-Match o, sin él, If-Modified-Since)."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if modificado is not None and request.if_modified_since is not None:
+        return modificado <= request.if_modified_since
+    return False
+
+
+def condicional(etag, modificado, construir):
+    """
+    Respuesta de `construir()` con sus validadores, o 304 vacío si el
+    cliente ya tiene la versión `etag`. Cache-Control: no-cache hace que
+    el navegador pregunte siempre, pero con If-None-Match.
+    """
+    if no_modificado(etag, modificado):
+        respuesta = Response(status=304)
+    else:
+        respuesta = construir()
+    respuesta.set_etag(etag, weak=True)
+    if modificado is not None:
+        respuesta.last_modified = modificado
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+
+def comprimir(respuesta):
+    """after_request: comprime el cuerpo si el cliente lo acepta y compensa."""
+    if (
+        respuesta.status_code != 200
+        or respuesta.direct_passthrough
+        or respuesta.is_streamed
+        or "Content-Encoding" in respuesta.headers
+        or respuesta.mimetype not in TIPOS_COMPRIMIBLES
+    ):
+        return respuesta
+    respuesta.vary.add("Accept-Encoding")
+    codificacion = codificacion_aceptada()
+    if codificacion is None or (respuesta.content_length or 0) < COMPRIMIR_MIN_BYTES:
+        return respuesta
+    respuesta.set_data(_comprimir(respuesta.get_data(), codificacion))
+    respuesta.headers["Content-Encoding"] = codificacion
+    return respuesta
+
+
+class PaginaEstatica:
+    """Cuerpo fijo con su ETag y sus versiones comprimidas, preparadas una vez."""
+
+    def __init__(self, contenido, mimetype="text/html"):
+        datos = contenido.encode("utf-8")
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(datos).hexdigest()[:16]
+        self.variantes = {None: datos}
+        for codificacion in codificaciones():
+            self.variantes[codificacion] = _comprimir(datos, codificacion, CALIDAD_BROTLI_ESTATICA)
+
+    def respuesta(self):
+        if request.if_none_match.contains_weak(self.etag):
+            respuesta = Response(status=304)
+            codificacion = None
+        else:
+            codificacion = codificacion_aceptada()
+            respuesta = Response(self.variantes[codificacion], mimetype=self.mimetype)
+            if codificacion is not None:
+                respuesta.headers["Content-Encoding"] = codificacion
+        respuesta.set_etag(self.etag, weak=True)   # débil: la misma para todas las codificaciones
+        respuesta.vary.add("Accept-Encoding")
+        respuesta.cache_control.no_cache = True
+        return respuesta
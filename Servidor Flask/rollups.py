@@ -0,0 +1,204 @@
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import bindparam, func, insert as insertar, select
+
+# -------------------------------------------------
+# Agregados por intervalo (rollups) de `lectura`
+# -------------------------------------------------
+# La tabla `lectura_rollup` guarda, por resolución (60, 3600 u 86400 s),
+# estación e inicio del intervalo: número de lecturas y min/max/suma de
+# cada variable (la media es suma / n). Se mantiene en la ingesta, en la
+# misma transacción que el lote, con un upsert que acumula.
+
+RESOLUCIONES = {60: "1m", 3600: "1h", 86400: "1d"}
+VARIABLES = ("temp", "hum", "co2")
+COLUMNAS_LECTURA = {"temp": "temperatura", "hum": "humedad", "co2": "co2"}
+
+# Etiqueta de cada punto según la resolución (0 = lecturas crudas)
+ETIQUETAS = {0: "%d/%m %H:%M:%S", 60: "%d/%m %H:%M", 3600: "%d/%m %H:%M", 86400: "%d/%m/%Y"}
+
+
+def inicio_cubo(fecha, resolucion):
+    """Inicio del intervalo que contiene `fecha` (hora local, igual que `fecha`)."""
+    if resolucion == 60:
+        return fecha.replace(second=0, microsecond=0)
+    if resolucion == 3600:
+        return fecha.replace(minute=0, second=0, microsecond=0)
+    return fecha.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def agregar_lote(filas):
+    """
+    Agrega un lote de lecturas en filas de rollup (una por resolución,
+    estación e intervalo). Las lecturas con alguna anomalía no cuentan.
+    """
+    cubos = {}
+    for fila in filas:
+        if fila.get("anomalia"):
+            continue
+        for resolucion in RESOLUCIONES:
+            clave = (resolucion, fila["estacion"], inicio_cubo(fila["fecha"], resolucion))
+            cubo = cubos.get(clave)
+            if cubo is None:
+                cubo = {"resolucion": resolucion, "estacion": clave[1], "inicio": clave[2], "n": 0}
+                for v in VARIABLES:
+                    cubo[f"{v}_min"] = cubo[f"{v}_max"] = fila[COLUMNAS_LECTURA[v]]
+                    cubo[f"{v}_suma"] = 0.0
+                cubos[clave] = cubo
+            cubo["n"] += 1
+            for v in VARIABLES:
+                valor = fila[COLUMNAS_LECTURA[v]]
+                cubo[f"{v}_suma"] += valor
+                if valor < cubo[f"{v}_min"]:
+                    cubo[f"{v}_min"] = valor
+                if valor > cubo[f"{v}_max"]:
+                    cubo[f"{v}_max"] = valor
+    return list(cubos.values())
+
+
+def sentencia_upsert(tabla, dialecto):
+    """
+    INSERT que suma n y las sumas y combina min/max si el intervalo ya
+    existe. None si el dialecto no tiene upsert (ver acumular()).
+    """
+    if dialecto == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(tabla)
+        nuevo = stmt.inserted
+        menor, mayor = func.least, func.greatest
+    elif dialecto in ("sqlite", "postgresql"):
+        if dialecto == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+            menor, mayor = func.min, func.max
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+            menor, mayor = func.least, func.greatest
+        stmt = insert(tabla)
+        nuevo = stmt.excluded
+    else:
+        return None
+
+    cambios = {"n": tabla.c.n + nuevo.n}
+    for v in VARIABLES:
+        cambios[f"{v}_min"] = menor(tabla.c[f"{v}_min"], nuevo[f"{v}_min"])
+        cambios[f"{v}_max"] = mayor(tabla.c[f"{v}_max"], nuevo[f"{v}_max"])
+        cambios[f"{v}_suma"] = tabla.c[f"{v}_suma"] + nuevo[f"{v}_suma"]
+
+    if dialecto == "mysql":
+        return stmt.on_duplicate_key_update(**cambios)
+    return stmt.on_conflict_do_update(
+        index_elements=["resolucion", "estacion", "inicio"], set_=cambios
+    )
+
+
+def _combinar(viejo, nuevo):
+    combinado = {"n": viejo["n"] + nuevo["n"]}
+    for v in VARIABLES:
+        combinado[f"{v}_min"] = min(viejo[f"{v}_min"], nuevo[f"{v}_min"])
+        combinado[f"{v}_max"] = max(viejo[f"{v}_max"], nuevo[f"{v}_max"])
+        combinado[f"{v}_suma"] = viejo[f"{v}_suma"] + nuevo[f"{v}_suma"]
+    return combinado
+
+
+def acumular(sesion, tabla, agregados):
+    """
+    Suma `agregados` a la tabla en la transacción de `sesion`. Con el
+    upsert del dialecto si lo hay; si no, lee los intervalos que ya
+    existen, los combina aquí y hace UPDATE de esos e INSERT del resto.
+    Lo genérico solo es correcto con un escritor, que es el caso de la
+    ingesta (un hilo escritor o servicio_ingesta).
+    """
+    upsert = sentencia_upsert(tabla, sesion.get_bind().dialect.name)
+    if upsert is not None:
+        sesion.execute(upsert, agregados)
+        return
+
+    existentes = {}
+    for resolucion in {a["resolucion"] for a in agregados}:
+        del_nivel = [a for a in agregados if a["resolucion"] == resolucion]
+        consulta = select(tabla).where(
+            tabla.c.resolucion == resolucion,
+            tabla.c.estacion.in_({a["estacion"] for a in del_nivel}),
+            tabla.c.inicio.between(min(a["inicio"] for a in del_nivel), max(a["inicio"] for a in del_nivel)),
+        )
+        for fila in sesion.execute(consulta).mappings():
+            existentes[(fila["resolucion"], fila["estacion"], fila["inicio"])] = fila
+
+    nuevos, cambiados = [], []
+    for agregado in agregados:
+        viejo = existentes.get((agregado["resolucion"], agregado["estacion"], agregado["inicio"]))
+        if viejo is None:
+            nuevos.append(agregado)
+            continue
+        cambiado = _combinar(viejo, agregado)
+        cambiado.update(b_resolucion=agregado["resolucion"], b_estacion=agregado["estacion"],
+                        b_inicio=agregado["inicio"])
+        cambiados.append(cambiado)
+    if nuevos:
+        sesion.execute(insertar(tabla), nuevos)
+    if cambiados:
+        sesion.execute(tabla.update().where(
+            tabla.c.resolucion == bindparam("b_resolucion"),
+            tabla.c.estacion == bindparam("b_estacion"),
+            tabla.c.inicio == bindparam("b_inicio"),
+        ), cambiados)
+
+
+def lttb(t, valores, n_salida):
+    """
+    Largest-Triangle-Three-Buckets: índices de `n_salida` puntos que
+    conservan la forma de la serie. `valores` es (n, k); el área de cada
+    triángulo se suma sobre las k variables normalizadas por su rango,
+    así las tres series comparten los mismos instantes.
+    """
+    n = len(t)
+    if n_salida >= n or n_salida < 3:
+        return np.arange(n)
+
+    rango = np.ptp(valores, axis=0)
+    y = valores / np.where(rango > 0, rango, 1.0)
+    x = (t - t[0]) / max(t[-1] - t[0], 1e-9)
+
+    bordes = np.linspace(1, n - 1, n_salida - 1).astype(int)
+    indices = np.empty(n_salida, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_salida - 2):
+        ini, fin = bordes[i], bordes[i + 1]
+        sig_ini, sig_fin = bordes[i + 1], (bordes[i + 2] if i + 2 < len(bordes) else n)
+        # Vértice C: media del siguiente cubo (o el último punto)
+        cx = x[sig_ini:sig_fin].mean() if sig_fin > sig_ini else x[-1]
+        cy = y[sig_ini:sig_fin].mean(axis=0) if sig_fin > sig_ini else y[-1]
+        bx, by = x[ini:fin], y[ini:fin]
+        areas = np.abs(
+            (x[a] - cx) * (by - y[a]) - (x[a] - bx)[:, None] * (cy - y[a])
+        ).sum(axis=1)
+        a = ini + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+
+def serializar_rango(t, valores, resolucion, minimos=None, maximos=None, n=None):
+    """
+    Puntos de /history?from=&to=: mismo formato que el historial reciente
+    (`valores` son las medias si hay agregados) más `n`, `min` y `max` por
+    variable cuando vienen de `lectura_rollup`.
+    """
+    formato = ETIQUETAS[resolucion]
+    puntos = []
+    for i, (ti, (temp, hum, co2)) in enumerate(zip(t.tolist(), valores.tolist())):
+        punto = {
+            "t": ti,
+            "fecha": datetime.fromtimestamp(ti / 1000).strftime(formato),
+            "temperatura": temp,
+            "humedad": hum,
+            "co2": co2,
+        }
+        if n is not None:
+            lo, hi = minimos[i].tolist(), maximos[i].tolist()
+            punto["n"] = int(n[i])
+            punto["min"] = {"temperatura": lo[0], "humedad": lo[1], "co2": lo[2]}
+            punto["max"] = {"temperatura": hi[0], "humedad": hi[1], "co2": hi[2]}
+        puntos.append(punto)
+    return puntos
@@ -0,0 +1,389 @@
+"""
+Servicio de ingesta MQTT, independiente del servidor web.
+
+    python servicio_ingesta.py
+
+Se suscribe con suscripciones compartidas ($share/<grupo>/iot/+/data,
+.../bin y .../batch):
+el broker reparte los mensajes del grupo entre las instancias conectadas,
+así que para escalar basta con arrancar más procesos (cada uno con su
+propio client_id). Las lecturas se agrupan en lotes y se guardan con el
+mismo camino de escritura que el servidor (modelos.guardar_filas), en un
+hilo para no bloquear el bucle de asyncio. También mantiene las particiones
+y el archivo Parquet de días cerrados.
+
+Sus métricas (cola, lotes, latencia de escritura) se sirven en formato
+Prometheus en http://<host>:9101/metrics (IOT_METRICAS_PUERTO, 0 = no).
+
+El servidor web se arranca entonces con IOT_INGESTA=externa.
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+
+import paho.mqtt.client as mqtt
+from flask import Flask
+
+import archivo
+from anomalias import DetectorAnomalias
+from configuracion import (
+    ANOMALIAS_UMBRAL, ANOMALIAS_VENTANA, ARCHIVO_CADA, ARCHIVO_DIR, ARCHIVO_MAX_DIAS,
+    ARCHIVO_RETRASO_DIAS, DUPLICADOS_VENTANA, EXPORT_LOTE, INGESTA_ESPERA_MAX,
+    INGESTA_ESPERA_REINTENTO, INGESTA_INTENTOS, INGESTA_INTERVALO, INGESTA_MAX_COLA,
+    INGESTA_TAM_LOTE, MANTENIMIENTO_CADA, PARTICIONES_ADELANTE, RETENCION_MESES,
+)
+from ingesta import LotePerdido, Reintentos, VentanaDuplicados
+import bitacora
+import particiones
+from mensajes import BROKER, PUERTO, TOPICS, completa, leer_lecturas, tipo_de_topic
+from metricas import FILAS, TIPO_CONTENIDO, RegistroMetricas
+import modelos
+from modelos import Lectura, db, guardar_filas
+
+# -------------------------------------------------
+# Configuración
+# -------------------------------------------------
+GRUPO = "ingesta"
+TOPICS_COMPARTIDOS = [f"$share/{GRUPO}/{topic}" for topic in TOPICS]
+CLIENT_ID = f"ingesta-{socket.gethostname()}-{os.getpid()}"
+KEEPALIVE = 60
+RECONEXION_MAX = 30            # s máximos entre reintentos de conexión
+
+ESTADISTICAS_CADA = 60         # s entre resúmenes en el log
+METRICAS_PUERTO = int(os.environ.get("IOT_METRICAS_PUERTO", "9101"))
+# Lotes, reintentos, anomalías, particiones y archivo: configuracion.py,
+# compartida con ServidorFlask.py
+
+app = Flask(__name__)
+modelos.configurar(app)
+
+log = logging.getLogger("iot.ingesta")
+
+
+# -------------------------------------------------
+# Cliente paho sobre el bucle de asyncio
+# -------------------------------------------------
+class AdaptadorAsyncio:
+    """
+    Conecta el socket del cliente paho al bucle de asyncio en lugar de
+    usar el hilo de loop_start(): lectura y escritura con add_reader /
+    add_writer y loop_misc() (keepalive, reintentos QoS) cada segundo.
+    Los callbacks de paho corren así en el propio bucle.
+    """
+
+    def __init__(self, bucle, cliente):
+        self.bucle = bucle
+        self.cliente = cliente
+        self._misc = None
+        cliente.on_socket_open = self._abierto
+        cliente.on_socket_close = self._cerrado
+        cliente.on_socket_register_write = self._registrar_escritura
+        cliente.on_socket_unregister_write = self._anular_escritura
+
+    def _abierto(self, cliente, userdata, sock):
+        self.bucle.add_reader(sock, cliente.loop_read)
+        self._misc = self.bucle.create_task(self._bucle_misc())
+
+    def _cerrado(self, cliente, userdata, sock):
+        self.bucle.remove_reader(sock)
+        if self._misc is not None:
+            self._misc.cancel()
+
+    def _registrar_escritura(self, cliente, userdata, sock):
+        self.bucle.add_writer(sock, cliente.loop_write)
+
+    def _anular_escritura(self, cliente, userdata, sock):
+        self.bucle.remove_writer(sock)
+
+    async def _bucle_misc(self):
+        while self.cliente.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+
+# -------------------------------------------------
+# Servicio
+# -------------------------------------------------
+class ServicioIngesta:
+    def __init__(self):
+        self.cola = asyncio.Queue(maxsize=INGESTA_MAX_COLA)
+        self.metricas = self._crear_metricas()
+        self.detector = DetectorAnomalias(ventana=ANOMALIAS_VENTANA, umbral=ANOMALIAS_UMBRAL)
+        self.ventana = VentanaDuplicados(DUPLICADOS_VENTANA)
+        self.parar = asyncio.Event()
+        self._desconectado = None
+
+        self.recibidas = 0
+        self.invalidas = 0
+        self.descartadas = 0
+        self.escritas = 0
+        self.repetidas = 0
+        self.lotes = 0
+        self.politica = Reintentos(INGESTA_INTENTOS, INGESTA_ESPERA_REINTENTO, INGESTA_ESPERA_MAX,
+                                   al_perder=self._olvidar_lote)
+
+    # --- MQTT ---
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            log.info("Conectado al broker MQTT", extra={"client_id": CLIENT_ID})
+            client.subscribe([(topic, 1) for topic in TOPICS_COMPARTIDOS])
+        else:
+            log.error("Error de conexión MQTT", extra={"rc": rc})
+
+    def on_disconnect(self, client, userdata, rc):
+        log.warning("Desconectado del broker MQTT", extra={"rc": rc})
+        if self._desconectado is not None and not self._desconectado.done():
+            self._desconectado.set_result(rc)
+
+    def on_message(self, client, userdata, msg):
+        # Corre en el bucle de asyncio: parsear y encolar, nada más
+        self.m_mensajes.inc(tipo_de_topic(msg.topic))
+        try:
+            lecturas = leer_lecturas(msg.topic, msg.payload)
+        except Exception as e:
+            self.invalidas += 1
+            log.warning("Error procesando datos MQTT", extra={"topic": msg.topic, "error": str(e)})
+            return
+        if lecturas is None:
+            self.invalidas += 1
+            return
+        for lectura in lecturas:
+            if self.ventana.repetida(lectura):
+                continue
+            if not completa(lectura):
+                self.invalidas += 1
+                continue
+            self.detector.evaluar(lectura)
+            try:
+                self.cola.put_nowait(lectura)
+                self.recibidas += 1
+            except asyncio.QueueFull:
+                self.descartadas += 1
+                continue
+            # Solo lo que entró en la cola cuenta como visto
+            self.ventana.anotar(lectura)
+
+    async def conectar(self, bucle):
+        """Mantiene la conexión con el broker hasta que se pida parar."""
+        cliente = mqtt.Client(CLIENT_ID)
+        cliente.on_connect = self.on_connect
+        cliente.on_disconnect = self.on_disconnect
+        cliente.on_message = self.on_message
+        AdaptadorAsyncio(bucle, cliente)
+
+        espera = 1
+        while not self.parar.is_set():
+            self._desconectado = bucle.create_future()
+            try:
+                cliente.connect(BROKER, PUERTO, KEEPALIVE)
+            except OSError as e:
+                log.error("No se pudo conectar al broker", extra={"error": str(e), "reintento_s": espera})
+                await self._dormir(espera)
+                espera = min(espera * 2, RECONEXION_MAX)
+                continue
+            espera = 1
+            parar = asyncio.ensure_future(self.parar.wait())
+            await asyncio.wait({self._desconectado, parar}, return_when=asyncio.FIRST_COMPLETED)
+            parar.cancel()
+            if not self.parar.is_set():
+                await self._dormir(espera)
+        cliente.disconnect()
+
+    async def _dormir(self, segundos):
+        try:
+            await asyncio.wait_for(self.parar.wait(), segundos)
+        except asyncio.TimeoutError:
+            pass
+
+    # --- Escritura por lotes ---
+    async def _tomar_lote(self):
+        """Junta hasta INGESTA_TAM_LOTE lecturas o las que lleguen en INGESTA_INTERVALO s."""
+        lote = []
+        limite = time.monotonic() + INGESTA_INTERVALO
+        while len(lote) < INGESTA_TAM_LOTE:
+            try:
+                lote.append(self.cola.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            restante = limite - time.monotonic()
+            if restante <= 0 or self.parar.is_set():
+                break
+            try:
+                lote.append(await asyncio.wait_for(self.cola.get(), restante))
+            except asyncio.TimeoutError:
+                break
+        return lote
+
+    def _guardar(self, lote):
+        with self.m_commit.medir(), app.app_context():
+            return guardar_filas(lote)
+
+    async def _escribir(self, lote):
+        inicio = time.perf_counter()
+        self.m_lote.observar(len(lote))
+        # Los reintentos esperan en el hilo: mientras, la cola sigue
+        # llenándose y on_message descarta al llenarse
+        try:
+            guardadas = await asyncio.to_thread(self.politica.escribir, self._guardar, lote)
+        except LotePerdido:
+            return
+        self.escritas += guardadas
+        self.repetidas += len(lote) - guardadas
+        self.lotes += 1
+        log.debug("Lote guardado", extra={"filas": len(lote), "ms": round((time.perf_counter() - inicio) * 1000, 1)})
+
+    def _olvidar_lote(self, lote):
+        """Lote perdido: que el reenvío de la estación no se tome por repetido."""
+        for lectura in lote:
+            self.ventana.olvidar(lectura)
+
+    async def escritor(self):
+        # Al parar, sigue hasta vaciar lo pendiente
+        while not self.parar.is_set() or not self.cola.empty():
+            lote = await self._tomar_lote()
+            if lote:
+                await self._escribir(lote)
+
+    # --- Tareas periódicas ---
+    async def mantenimiento(self):
+        while not self.parar.is_set():
+            try:
+                creadas, borradas = await asyncio.to_thread(self._mantener_particiones)
+                if creadas or borradas:
+                    log.info("Particiones mantenidas", extra={"creadas": creadas, "borradas": borradas})
+            except Exception as e:
+                log.error("Error en mantenimiento de particiones", extra={"error": str(e)})
+            await self._dormir(MANTENIMIENTO_CADA)
+
+    def _mantener_particiones(self):
+        with app.app_context():
+            return particiones.mantener(db.engine, PARTICIONES_ADELANTE, RETENCION_MESES)
+
+    async def archivar(self):
+        while archivo.DISPONIBLE and not self.parar.is_set():
+            try:
+                archivados = await asyncio.to_thread(self._archivar)
+                for dia, filas in archivados.items():
+                    log.info("Día archivado", extra={"dia": dia.isoformat(), "filas": filas})
+            except Exception as e:
+                log.error("Error archivando lecturas", extra={"error": str(e)})
+            await self._dormir(ARCHIVO_CADA)
+
+    def _archivar(self):
+        with app.app_context():
+            return archivo.archivar_pendientes(
+                db.engine, Lectura.__table__, ARCHIVO_DIR,
+                max_dias=ARCHIVO_MAX_DIAS, lote=EXPORT_LOTE, retraso_dias=ARCHIVO_RETRASO_DIAS,
+            )
+
+    async def informar(self):
+        while not self.parar.is_set():
+            await self._dormir(ESTADISTICAS_CADA)
+            if not self.parar.is_set():
+                log.info("Estadísticas de ingesta", extra=self._resumen())
+
+    def estadisticas(self):
+        return {
+            "profundidad": self.cola.qsize(),
+            "recibidas": self.recibidas,
+            "invalidas": self.invalidas,
+            "descartadas": self.descartadas,
+            "escritas": self.escritas,
+            "repetidas": self.repetidas,
+            "lotes": self.lotes,
+            **self.politica.estadisticas(),
+            "anomalias": self.detector.estadisticas(),
+            "duplicados": self.ventana.estadisticas(),
+        }
+
+    def _resumen(self):
+        """estadisticas() sin los campos anidados, para el log."""
+        return {k: v for k, v in self.estadisticas().items() if not isinstance(v, dict)}
+
+    # --- Métricas ---
+    def _crear_metricas(self):
+        metricas = RegistroMetricas("iot")
+        self.m_mensajes = metricas.contador("mqtt_messages_total", "Mensajes MQTT recibidos por tipo de topic", ("kind",))
+        self.m_commit = metricas.histograma("db_commit_seconds", "Duración de la escritura de un lote en la BD")
+        self.m_lote = metricas.histograma("db_batch_rows", "Filas por lote escrito en la BD", limites=FILAS)
+        metricas.funcion("ingest_queue_depth", "Lecturas esperando en la cola de ingesta", self.cola.qsize)
+        metricas.funcion("ingest_queue_capacity", "Capacidad de la cola de ingesta", lambda: self.cola.maxsize)
+        for nombre, ayuda, atributo in (
+            ("ingest_received_total", "Lecturas encoladas", "recibidas"),
+            ("ingest_invalid_total", "Mensajes o lecturas inválidos", "invalidas"),
+            ("ingest_dropped_total", "Lecturas descartadas con la cola llena", "descartadas"),
+            ("ingest_written_total", "Lecturas guardadas en la BD", "escritas"),
+        ):
+            metricas.funcion(nombre, ayuda, lambda a=atributo: getattr(self, a), tipo="counter")
+        for nombre, ayuda, clave in (
+            ("ingest_write_errors_total", "Intentos de guardar un lote que fallaron", "errores_escritura"),
+            ("ingest_write_retries_total", "Lotes reintentados tras un error de escritura", "reintentos"),
+            ("ingest_lost_rows_total", "Lecturas perdidas tras agotar los reintentos", "filas_fallidas"),
+        ):
+            metricas.funcion(nombre, ayuda, lambda c=clave: self.politica.estadisticas()[c], tipo="counter")
+        metricas.funcion("ingest_duplicates_total", "Lecturas repetidas descartadas, en memoria o en la BD",
+                         lambda: {("window",): self.ventana.repetidas, ("db",): self.repetidas},
+                         tipo="counter", etiquetas=("stage",))
+        metricas.funcion("anomaly_flags_total", "Valores marcados como anómalos por variable",
+                         lambda: {(v,): n for v, n in self.detector.estadisticas()["marcadas"].items()},
+                         tipo="counter", etiquetas=("variable",))
+        return metricas
+
+    async def _servir_metricas(self, lector, escritor):
+        """HTTP mínimo: cualquier GET devuelve las métricas (para el scraper de Prometheus)."""
+        try:
+            peticion = await asyncio.wait_for(lector.readuntil(b"\r\n\r\n"), 5)
+            if peticion.startswith(b"GET "):
+                cuerpo, estado = self.metricas.exportar().encode(), "200 OK"
+            else:
+                cuerpo, estado = b"", "405 Method Not Allowed"
+            escritor.write(
+                f"HTTP/1.1 {estado}\r\nContent-Type: {TIPO_CONTENIDO}\r\n"
+                f"Content-Length: {len(cuerpo)}\r\nConnection: close\r\n\r\n".encode() + cuerpo
+            )
+            await escritor.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            escritor.close()
+
+    async def ejecutar(self):
+        bucle = asyncio.get_running_loop()
+        for senal in (signal.SIGINT, signal.SIGTERM):
+            try:
+                bucle.add_signal_handler(senal, self.parar.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows: Ctrl+C llega como KeyboardInterrupt
+
+        await asyncio.to_thread(self._crear_tablas)
+        servidor = None
+        if METRICAS_PUERTO:
+            servidor = await asyncio.start_server(self._servir_metricas, port=METRICAS_PUERTO)
+        escritor = asyncio.create_task(self.escritor())
+        tareas = [
+            asyncio.create_task(self.mantenimiento()),
+            asyncio.create_task(self.archivar()),
+            asyncio.create_task(self.informar()),
+        ]
+        try:
+            await self.conectar(bucle)
+        finally:
+            self.parar.set()
+            for tarea in tareas:
+                tarea.cancel()
+            await escritor
+            if servidor is not None:
+                servidor.close()
+            log.info("Ingesta detenida", extra=self._resumen())
+
+    def _crear_tablas(self):
+        with app.app_context():
+            db.create_all()
+
+
+if __name__ == "__main__":
+    bitacora.configurar()
+    asyncio.run(ServicioIngesta().ejecutar())
@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pronostico
+
+
+def serie(n, semilla=0):
+    rng = np.random.default_rng(semilla)
+    return np.arange(n) * 10.0, 20 + 0.05 * np.arange(n) + rng.normal(0, 0.2, n)
+
+
+class SeleccionAutoTest(unittest.TestCase):
+    """Modo "auto" en el límite del backtest: n - k frente a MIN_ENTRENAMIENTO."""
+
+    def test_series_cortas_sin_backtest(self):
+        for n in range(5, 15):
+            with self.subTest(n=n):
+                fc, estado = pronostico.pronosticar(serie(n), "temp", None, metodo="auto")
+                self.assertIsNotNone(fc)
+                self.assertTrue(np.isfinite(fc))
+                self.assertEqual(estado["elegido"], "ewma")
+                self.assertEqual(estado["mae"], {})
+
+    def test_serie_corta_se_revisa_en_la_siguiente_pasada(self):
+        _, estado = pronostico.pronosticar(serie(8), "temp", None, metodo="auto")
+        _, estado = pronostico.pronosticar(serie(30), "temp", estado, metodo="auto")
+        self.assertIn("arima", estado["mae"])
+
+    def test_primera_serie_con_backtest(self):
+        n = next(n for n in range(5, 40)
+                 if n - pronostico.pronosticadores.puntos_backtest(n) >= pronostico.MIN_ENTRENAMIENTO)
+        fc, estado = pronostico.pronosticar(serie(n), "temp", None, metodo="auto")
+        self.assertIsNotNone(fc)
+        self.assertIn("arima", estado["mae"])
+        self.assertIn("ewma", estado["mae"])
+
+    def test_menos_de_cinco_puntos(self):
+        self.assertEqual(pronostico.pronosticar(serie(4), "temp", None, metodo="auto"), (None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
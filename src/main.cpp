@@ -3,6 +3,8 @@
 #include <PubSubClient.h>
 #include <ArduinoJson.h>
 #include <LiquidCrystal.h>
+#include <Preferences.h>
+#include <time.h>
 #include "DHT.h"
 #include <access.h>
 
@@ -30,22 +32,130 @@ const char* mqtt_pass = "admin";
 WiFiClient espClient;
 PubSubClient client(espClient);
 
-// ===== Función de reconexión MQTT =====
+// ===== Identificador de estación =====
+// Cada placa publica en iot/<estacion>/data (JSON) o iot/<estacion>/bin
+// (binario), y lo que guardó sin conexión en iot/<estacion>/batch; el
+// servidor toma la estación del topic
+String stationId;
+String topicData;
+String topicBin;
+String topicLote;
+String topicControl;
+const char* topicControlGlobal = "iot/esp32/control";
+
+// ===== Intervalo de lectura =====
+// Lo fija el servidor por iot/<estacion>/control (o el global):
+// {"interval_s": 60} del muestreo adaptativo o {"interval": 5} (minutos)
+// del dashboard. Se guarda en flash para que sobreviva a un reinicio.
+#define INTERVALO_POR_DEFECTO_MS 10000UL
+#define INTERVALO_MIN_MS 2000UL
+#define INTERVALO_MAX_MS 3600000UL
+unsigned long intervaloLecturaMs = INTERVALO_POR_DEFECTO_MS;
+
+// ===== Formato de envío =====
+// 1 = binario compacto en iot/<estacion>/bin, 0 = JSON en iot/<estacion>/data.
+// Formato en "Servidor Flask/mensajes.py": cabecera de 2 bytes (versión,
+// número de muestras), 6 de secuencia (arranque, número de la primera
+// muestra) y 10 bytes por muestra, little-endian como el ESP32.
+// Las muestras van fechadas con el reloj NTP y numeradas (versión 3): el
+// servidor descarta las que le lleguen dos veces por (estación, seq).
+#define PAYLOAD_BINARIO 1
+#define VERSION_SECUENCIA 3
+#define CABECERA_BIN 8
+
+// Número de secuencia = arranque << 32 | contador. El arranque se guarda
+// en flash (NVS) y sube en cada reinicio, así que la secuencia nunca
+// vuelve atrás; el contador solo vive en RAM.
+Preferences preferencias;
+uint16_t arranque = 0;
+uint32_t siguienteSeq = 0;   // número de la próxima muestra que se guarde
+
+struct __attribute__((packed)) MuestraBin {
+  uint32_t instante;     // epoch en s de la medida
+  int16_t temperatura;   // centésimas de °C
+  uint16_t humedad;      // centésimas de %
+  uint16_t co2;          // ppm
+};
+
+// ===== Muestras pendientes (store-and-forward) =====
+// Toda muestra entra en un buffer circular en RAM y solo sale cuando se
+// ha publicado. Sin conexión se sigue midiendo y guardando; al volver se
+// envían de la más antigua a la más nueva: si hay una sola es la lectura
+// en vivo, si hay más van en lotes por iot/<estacion>/batch. Con el
+// buffer lleno se pierde la más antigua.
+#define CAPACIDAD_PENDIENTES 2160    // 6 h a una muestra cada 10 s (~35 KB)
+#define MUESTRAS_POR_LOTE 60         // por publicación: 8 + 60 * 10 = 608 bytes
+#define LOTES_POR_VUELTA 4           // lotes como mucho en cada pasada de loop()
+#define TAM_BUFFER_MQTT 768          // PubSubClient trae 256 por defecto
+#define REINTENTO_MQTT_MS 5000
+#define EPOCH_MINIMO 1700000000UL    // por debajo, el reloj aún no está en hora
+
+// El lote, con la cabecera MQTT y el topic, tiene que caber en el buffer
+static_assert(CABECERA_BIN + MUESTRAS_POR_LOTE * sizeof(MuestraBin) + 100 <= TAM_BUFFER_MQTT, "Demasiadas muestras por lote");
+static_assert(MUESTRAS_POR_LOTE <= 255, "El número de muestras va en un byte");
+
+struct Pendiente {
+  MuestraBin muestra;        // instante = 0 mientras el reloj no está en hora
+  unsigned long tomadaEn;    // millis() de la medida
+};
+
+Pendiente pendientes[CAPACIDAD_PENDIENTES];
+uint16_t primera = 0;        // índice de la más antigua (su seq: siguienteSeq - numPendientes)
+uint16_t numPendientes = 0;
+uint32_t perdidas = 0;       // descartadas con el buffer lleno
+unsigned long ultimoIntento = 0;
+
+// ===== Reconexión MQTT sin bloquear =====
+// Un intento cada REINTENTO_MQTT_MS; entre intentos loop() sigue midiendo
+// y guardando en el buffer de pendientes
 void reconnect() {
-  while (!client.connected()) {
-    Serial.println("Intentando conexión MQTT...");
-    String clientId = "ESP32Client-" + String(uint32_t(ESP.getEfuseMac()), HEX);
-    if (client.connect(clientId.c_str(), mqtt_user, mqtt_pass)) {
-      Serial.println("Conectado al broker MQTT");
-    } else {
-      Serial.print("Error rc=");
-      Serial.print(client.state());
-      Serial.println(" - Reintentando en 2s");
-      delay(2000);
-    }
+  if (millis() - ultimoIntento < REINTENTO_MQTT_MS) return;
+  ultimoIntento = millis();
+  if (WiFi.status() != WL_CONNECTED) return;  // la WiFi se reconecta sola
+
+  Serial.println("Intentando conexión MQTT...");
+  String clientId = "ESP32Client-" + stationId;
+  if (client.connect(clientId.c_str(), mqtt_user, mqtt_pass)) {
+    // QoS 1: el último intervalo retenido llega también tras reconectar
+    client.subscribe(topicControl.c_str(), 1);
+    client.subscribe(topicControlGlobal, 1);
+    Serial.print("Conectado al broker MQTT, pendientes: ");
+    Serial.print(numPendientes);
+    Serial.print(" perdidas: ");
+    Serial.println(perdidas);
+  } else {
+    Serial.print("Error rc=");
+    Serial.print(client.state());
+    Serial.println(" - Reintentando en 5s");
   }
 }
 
+// ===== Mensajes de control =====
+void alRecibirControl(char* topic, byte* payload, unsigned int longitud) {
+  StaticJsonDocument<128> doc;
+  if (deserializeJson(doc, payload, longitud)) {
+    Serial.println("Mensaje de control no válido");
+    return;
+  }
+  unsigned long ms = 0;
+  if (doc["interval_s"].is<unsigned long>()) {
+    ms = doc["interval_s"].as<unsigned long>() * 1000UL;
+  } else if (doc["interval"].is<unsigned long>()) {
+    ms = doc["interval"].as<unsigned long>() * 60000UL;
+  }
+  if (ms == 0) return;
+  ms = constrain(ms, INTERVALO_MIN_MS, INTERVALO_MAX_MS);
+  if (ms == intervaloLecturaMs) return;
+
+  intervaloLecturaMs = ms;
+  preferencias.begin("estacion", false);
+  preferencias.putULong("intervalo", ms);
+  preferencias.end();
+  Serial.print("Intervalo de lectura: ");
+  Serial.print(ms / 1000);
+  Serial.println(" s");
+}
+
 // ===== Función para calcular “ppm de CO₂” estimado =====
 float getCO2ppm(int adcValue) {
   // MQ135: RL = 10kΩ
@@ -59,6 +169,96 @@ float getCO2ppm(int adcValue) {
   return ppm;
 }
 
+// ===== Buffer de pendientes =====
+bool relojEnHora() {
+  return time(nullptr) >= (time_t)EPOCH_MINIMO;
+}
+
+// Epoch de una muestra tomada en el millis() `tomadaEn`; 0 sin reloj
+uint32_t instanteDe(unsigned long tomadaEn) {
+  time_t ahora = time(nullptr);
+  if (ahora < (time_t)EPOCH_MINIMO) return 0;
+  return (uint32_t)ahora - (millis() - tomadaEn) / 1000;
+}
+
+void guardarPendiente(float t, float h, float co2ppm) {
+  if (numPendientes == CAPACIDAD_PENDIENTES) {
+    primera = (primera + 1) % CAPACIDAD_PENDIENTES;
+    numPendientes--;
+    perdidas++;
+  }
+  Pendiente &p = pendientes[(primera + numPendientes) % CAPACIDAD_PENDIENTES];
+  p.tomadaEn = millis();
+  p.muestra.instante = instanteDe(p.tomadaEn);
+  p.muestra.temperatura = (int16_t)lroundf(t * 100);
+  p.muestra.humedad = (uint16_t)lroundf(h * 100);
+  p.muestra.co2 = (uint16_t)constrain(lroundf(co2ppm), 0L, 65534L);
+  numPendientes++;
+  siguienteSeq++;
+}
+
+void descartarPendientes(uint16_t n) {
+  primera = (primera + n) % CAPACIDAD_PENDIENTES;
+  numPendientes -= n;
+}
+
+// Publica las `n` pendientes más antiguas en un mensaje binario; solo
+// salen del buffer si PubSubClient las ha escrito en el socket
+bool publicarBinario(const char* topic, uint8_t n) {
+  uint8_t buffer[CABECERA_BIN + MUESTRAS_POR_LOTE * sizeof(MuestraBin)];
+  uint32_t seq = siguienteSeq - numPendientes;  // las pendientes son consecutivas
+  buffer[0] = VERSION_SECUENCIA;
+  buffer[1] = n;
+  memcpy(buffer + 2, &arranque, 2);
+  memcpy(buffer + 4, &seq, 4);
+  for (uint8_t i = 0; i < n; i++) {
+    Pendiente &p = pendientes[(primera + i) % CAPACIDAD_PENDIENTES];
+    // El instante se fija una sola vez: si se reenvía tiene que ser el mismo
+    if (p.muestra.instante == 0) p.muestra.instante = instanteDe(p.tomadaEn);
+    memcpy(buffer + CABECERA_BIN + i * sizeof(MuestraBin), &p.muestra, sizeof(MuestraBin));
+  }
+  if (!client.publish(topic, buffer, CABECERA_BIN + n * sizeof(MuestraBin))) return false;
+  descartarPendientes(n);
+  return true;
+}
+
+#if !PAYLOAD_BINARIO
+bool publicarJSON() {
+  const MuestraBin &m = pendientes[primera].muestra;
+  StaticJsonDocument<256> doc;
+  doc["temperature"] = m.temperatura / 100.0;
+  doc["humidity"] = m.humedad / 100.0;
+  doc["co2"] = m.co2;
+
+  char buffer[256];
+  serializeJson(doc, buffer);
+  if (!client.publish(topicData.c_str(), buffer)) return false;
+  descartarPendientes(1);
+  return true;
+}
+#endif
+
+// Vacía el buffer sin acaparar loop(): como mucho LOTES_POR_VUELTA
+// publicaciones por pasada
+void enviarPendientes() {
+  if (numPendientes == 0) return;
+#if !PAYLOAD_BINARIO
+  if (numPendientes == 1) {
+    publicarJSON();
+    return;
+  }
+#endif
+  if (!relojEnHora()) return;  // sin hora no se pueden fechar: esperan
+  if (numPendientes == 1) {
+    publicarBinario(topicBin.c_str(), 1);
+    return;
+  }
+  for (uint8_t i = 0; i < LOTES_POR_VUELTA && numPendientes > 0; i++) {
+    uint8_t n = min(numPendientes, (uint16_t)MUESTRAS_POR_LOTE);
+    if (!publicarBinario(topicLote.c_str(), n)) return;
+  }
+}
+
 void setup() {
   Serial.begin(115200);
 
@@ -68,6 +268,14 @@ void setup() {
   delay(1000);
   lcd.clear();
 
+  // Arranque para los números de secuencia (una escritura en flash por
+  // reinicio) y último intervalo de lectura recibido
+  preferencias.begin("estacion", false);
+  arranque = preferencias.getUShort("arranque", 0) + 1;
+  preferencias.putUShort("arranque", arranque);
+  intervaloLecturaMs = preferencias.getULong("intervalo", INTERVALO_POR_DEFECTO_MS);
+  preferencias.end();
+
   // Sensores
   dht.begin();
   pinMode(MQ135_PIN, INPUT);
@@ -82,17 +290,36 @@ void setup() {
   Serial.println("\nWiFi conectado");
   Serial.print("IP: ");
   Serial.println(WiFi.localIP());
+  WiFi.setAutoReconnect(true);
+
+  // Reloj NTP (UTC) para fechar las muestras; se sincroniza en segundo plano
+  configTime(0, 0, "pool.ntp.org", "time.google.com");
 
   // MQTT
+  stationId = "esp32-" + String(uint32_t(ESP.getEfuseMac()), HEX);
+  topicData = "iot/" + stationId + "/data";
+  topicBin = "iot/" + stationId + "/bin";
+  topicLote = "iot/" + stationId + "/batch";
+  topicControl = "iot/" + stationId + "/control";
+  Serial.print("Estación: ");
+  Serial.println(stationId);
   client.setServer(mqtt_server, mqtt_port);
+  client.setBufferSize(TAM_BUFFER_MQTT);
+  client.setCallback(alRecibirControl);
+  client.setSocketTimeout(5);
+  ultimoIntento = millis() - REINTENTO_MQTT_MS;  // primer intento sin esperar
 }
 
 void loop() {
-  if (!client.connected()) reconnect();
-  client.loop();
+  if (!client.connected()) {
+    reconnect();
+  } else {
+    client.loop();
+    enviarPendientes();
+  }
 
   static unsigned long lastRead = 0;
-  if (millis() - lastRead > 10000) {
+  if (millis() - lastRead >= intervaloLecturaMs) {
     lastRead = millis();
 
     float h = dht.readHumidity();
@@ -127,15 +354,12 @@ void loop() {
     Serial.print(" Hum: "); Serial.print(h);
     Serial.print(" CO2: "); Serial.println(co2ppm);
 
-    // Crear JSON y publicar por MQTT
-    StaticJsonDocument<256> doc;
-    doc["temperature"] = t;
-    doc["humidity"] = h;
-    doc["co2"] = (int)co2ppm;
-
-    char buffer[256];
-    serializeJson(doc, buffer);
-    client.publish("iot/esp32/data", buffer);
+    // Al buffer de pendientes: sale en la próxima pasada si hay conexión
+    guardarPendiente(t, h, co2ppm);
+    if (!client.connected()) {
+      Serial.print("Sin conexión, pendientes: ");
+      Serial.println(numPendientes);
+    }
   }
 }
  
\ No newline at end of file